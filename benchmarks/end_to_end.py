@@ -0,0 +1,209 @@
+import argparse
+import json
+import logging
+import math
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Sequence, Optional
+
+from pymodbus.client.sync import ModbusTcpClient
+
+from benchmarks.write_read_latency import summarize
+from esmart_device.registers import PollTier
+from esmart_modbus.__main__ import install_asyncio_reactor
+from esmart_monitor.monitor import ESmartMonitor
+from esmart_simulator.controller import SimulatedController
+from esmart_simulator.protocol_esmartsim import register_controller
+from esmart_simulator.pty_simulator import PtySimulator
+
+SampleInterval = 0.01
+
+
+def json_safe(summary: Dict[str, float]) -> Dict[str, Optional[float]]:
+    return {k: None if math.isnan(v) else round(v, 3) for k, v in summary.items()}
+
+
+class MonitorSampler:
+    def __init__(self, monitors: Sequence[ESmartMonitor]) -> None:
+        self.monitors = monitors
+        self.cycle_times: List[float] = []
+        self.staleness: List[float] = []
+        self._cycle_counts = [mon.cycle_time.count for mon in monitors]
+        self._active = True
+
+    def run(self) -> None:
+        while self._active:
+            now = time.time()
+            for i, mon in enumerate(self.monitors):
+                if mon.cycle_time.count != self._cycle_counts[i]:
+                    self._cycle_counts[i] = mon.cycle_time.count
+                    self.cycle_times.append(mon.cycle_time.last)
+                values = mon.snapshot.values
+                for reg, (_, timestamp) in values.items():
+                    if reg.poll_tier == PollTier.Fast:
+                        self.staleness.append(now - timestamp)
+                        break
+            time.sleep(SampleInterval)
+
+    def stop(self) -> None:
+        self._active = False
+
+
+def serial_errors(monitors: Sequence[ESmartMonitor]) -> int:
+    return sum(x.value for mon in monitors
+               for x in (mon.device_metrics.read_timeouts, mon.device_metrics.checksum_errors, mon.device_metrics.protocol_errors))
+
+
+def run_clients(host: str, port: int, units: Sequence[int], clients: int, duration: float, write_interval: float) -> Dict[str, Any]:
+    read_latencies: List[float] = []
+    write_latencies: List[float] = []
+    failures = [0]
+    lock = threading.Lock()
+    end = time.monotonic() + duration
+
+    def reader(index: int) -> None:
+        client = ModbusTcpClient(host, port)
+        local = []
+        local_failures = 0
+        while time.monotonic() < end:
+            unit = units[index % len(units)]
+            index += 1
+            start = time.monotonic()
+            response = client.read_input_registers(1, 12, unit=unit)
+            local.append(time.monotonic() - start)
+            if response.isError():
+                local_failures += 1
+        client.close()
+        with lock:
+            read_latencies.extend(local)
+            failures[0] += local_failures
+
+    def writer() -> None:
+        client = ModbusTcpClient(host, port)
+        value = 60
+        while time.monotonic() < end:
+            value = 121 - value
+            start = time.monotonic()
+            response = client.write_register(6, value, unit=units[0])
+            write_latencies.append(time.monotonic() - start)
+            if response.isError():
+                with lock:
+                    failures[0] += 1
+            time.sleep(write_interval)
+        client.close()
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(clients)]
+    if write_interval > 0:
+        threads.append(threading.Thread(target=writer))
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    return {
+        "clients": clients,
+        "reads_per_second": round(len(read_latencies) / duration, 1),
+        "read_latency": json_safe(summarize(read_latencies)),
+        "write_latency": json_safe(summarize(write_latencies)),
+        "modbus_errors": failures[0],
+    }
+
+
+def run_benchmark(args: argparse.Namespace, monitors: Sequence[ESmartMonitor], controller: SimulatedController) -> Dict[str, Any]:
+    time.sleep(args.warmup)
+
+    phases = []
+    for clients in args.clients:
+        sampler = MonitorSampler(monitors)
+        sampler_thread = threading.Thread(target=sampler.run)
+        sampler_thread.start()
+        requests = controller.requests
+        errors = serial_errors(monitors)
+
+        result = run_clients(args.modbus_host, args.modbus_port, [mon.device_addr for mon in monitors], clients, args.duration, args.write_interval)
+
+        sampler.stop()
+        sampler_thread.join()
+        result["poll_cycle"] = json_safe(summarize(sampler.cycle_times))
+        result["staleness"] = json_safe(summarize(sampler.staleness))
+        result["serial_requests"] = controller.requests - requests
+        result["serial_errors"] = serial_errors(monitors) - errors
+        phases.append(result)
+
+    return {
+        "config": {
+            "transport": args.transport,
+            "devices": args.device_addr,
+            "latency": args.latency,
+            "baud_rate": args.baud_rate,
+            "drop_rate": args.drop_rate,
+            "nack_rate": args.nack_rate,
+            "err_rate": args.err_rate,
+            "duration": args.duration,
+            "write_interval": args.write_interval,
+            "asyncio": args.asyncio,
+        },
+        "phases": phases,
+    }
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Runs the monitor and Modbus server against a simulated controller and reports latencies as JSON")
+    argparser.add_argument("--transport", choices=("memory", "pty"), default="memory")
+    argparser.add_argument("--device-addr", type=int, nargs='+', default=[1])
+    argparser.add_argument("--modbus-host", type=str, default="127.0.0.1")
+    argparser.add_argument("--modbus-port", type=int, default=15020)
+    argparser.add_argument("--clients", type=int, nargs='+', default=[1, 10])
+    argparser.add_argument("--duration", type=float, default=10.0)
+    argparser.add_argument("--warmup", type=float, default=2.0)
+    argparser.add_argument("--write-interval", type=float, default=0.5, help="0 disables the writer")
+    argparser.add_argument("--latency", type=float, default=0.02)
+    argparser.add_argument("--baud-rate", type=int, default=9600, help="0 disables line-rate pacing")
+    argparser.add_argument("--drop-rate", type=float, default=0.0)
+    argparser.add_argument("--nack-rate", type=float, default=0.0)
+    argparser.add_argument("--err-rate", type=float, default=0.0)
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--asyncio", action='store_true')
+    argparser.add_argument("--output", type=str, help="JSON output file, stdout if omitted")
+
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.asyncio:
+        install_asyncio_reactor()
+    from esmart_modbus.server import start_bus, listen_server, reactor
+
+    controller = SimulatedController(args.device_addr, latency=args.latency, baud_rate=args.baud_rate,
+                                     drop_rate=args.drop_rate, nack_rate=args.nack_rate, err_rate=args.err_rate, seed=args.seed)
+    if args.transport == "pty":
+        path = PtySimulator(controller).start().path
+    else:
+        path = register_controller("benchmark", controller)
+
+    monitors = start_bus(path, args.device_addr, use_asyncio=args.asyncio)
+    listen_server(monitors, args.modbus_host, args.modbus_port)
+
+    results: Dict[str, Any] = {}
+
+    def benchmark() -> None:
+        try:
+            results.update(run_benchmark(args, monitors, controller))
+        finally:
+            reactor.callFromThread(reactor.stop)
+
+    reactor.callInThread(benchmark)
+    reactor.suggestThreadPoolSize(max(args.clients) + 10)
+    reactor.run()
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
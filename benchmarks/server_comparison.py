@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Tuple
+
+from benchmarks.end_to_end import json_safe
+from benchmarks.write_read_latency import summarize
+from esmart_modbus.fast_server import FastModbusServer, serve_async
+from esmart_simulator.controller import SimulatedController
+from esmart_simulator.protocol_esmartsim import register_controller
+
+ReadRequest = struct.Struct(">HHHBBHH")
+ResponseHeader = struct.Struct(">HHHB")
+StartupTimeout = 30.0
+
+
+def serve(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.WARNING)
+
+    controller = SimulatedController(args.device_addr, latency=args.latency, baud_rate=args.baud_rate)
+    path = register_controller("comparison", controller)
+
+    from esmart_modbus.server import start_bus, listen_server, reactor
+
+    monitors = start_bus(path, args.device_addr)
+    listen_server(monitors, args.modbus_host, args.twisted_port)
+
+    server = FastModbusServer({mon.device_addr: mon for mon in monitors}, single=len(monitors) == 1, max_connections=max(args.clients) + 1)
+    th = threading.Thread(target=lambda: asyncio.run(serve_async([], [(server, args.modbus_host, args.fast_port)])))
+    th.daemon = True
+    th.start()
+
+    reactor.run()
+
+
+async def read_registers(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, transaction_id: int, unit: int) -> bool:
+    writer.write(ReadRequest.pack(transaction_id, 0, 6, unit, 4, 1, 12))
+    _, _, length, _ = ResponseHeader.unpack(await reader.readexactly(ResponseHeader.size))
+    pdu = await reader.readexactly(length - 1)
+    return pdu[0] & 0x80 == 0
+
+
+async def wait_ready(host: str, port: int, unit: int) -> None:
+    deadline = time.monotonic() + StartupTimeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                if await read_registers(reader, writer, 0, unit):
+                    return
+            finally:
+                writer.close()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        if time.monotonic() > deadline:
+            raise Exception(f"server on port {port} did not become ready")
+        await asyncio.sleep(0.2)
+
+
+async def run_clients(host: str, port: int, units: List[int], clients: int, duration: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = [0]
+    end = time.monotonic() + duration
+
+    async def client(index: int) -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        transaction_id = 0
+        while time.monotonic() < end:
+            transaction_id = (transaction_id + 1) & 0xffff
+            start = time.monotonic()
+            ok = await read_registers(reader, writer, transaction_id, units[(index + transaction_id) % len(units)])
+            latencies.append(time.monotonic() - start)
+            if not ok:
+                errors[0] += 1
+        writer.close()
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return {
+        "clients": clients,
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "latency": json_safe(summarize(latencies)),
+        "errors": errors[0],
+    }
+
+
+async def compare(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    frontends: List[Tuple[str, int]] = [("twisted", args.twisted_port), ("asyncio", args.fast_port)]
+    for _, port in frontends:
+        await wait_ready(args.modbus_host, port, args.device_addr[0])
+
+    results = []
+    for clients in args.clients:
+        for name, port in frontends:
+            result = await run_clients(args.modbus_host, port, args.device_addr, clients, args.duration)
+            results.append(dict(frontend=name, **result))
+    return results
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Compares the pymodbus and asyncio Modbus TCP frontends on a simulated bus")
+    argparser.add_argument("--device-addr", type=int, nargs='+', default=[1])
+    argparser.add_argument("--modbus-host", type=str, default="127.0.0.1")
+    argparser.add_argument("--twisted-port", type=int, default=15021)
+    argparser.add_argument("--fast-port", type=int, default=15022)
+    argparser.add_argument("--clients", type=int, nargs='+', default=[1, 10, 100])
+    argparser.add_argument("--duration", type=float, default=10.0)
+    argparser.add_argument("--latency", type=float, default=0.02)
+    argparser.add_argument("--baud-rate", type=int, default=9600)
+    argparser.add_argument("--output", type=str, help="JSON output file, stdout if omitted")
+    argparser.add_argument("--serve", action='store_true', help=argparse.SUPPRESS)
+
+    args = argparser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.server_comparison", "--serve"] + sys.argv[1:])
+    try:
+        results = {
+            "config": {
+                "devices": args.device_addr,
+                "duration": args.duration,
+                "latency": args.latency,
+                "baud_rate": args.baud_rate,
+            },
+            "results": asyncio.run(compare(args)),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import statistics
+import threading
+import time
+from typing import List, Dict
+
+from pymodbus.client.sync import ModbusTcpClient
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if len(samples) == 0:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000 if len(samples) > 0 else float("nan"),
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples, default=float("nan")) * 1000,
+    }
+
+
+def run_readers(host: str, port: int, unit: int, clients: int, duration: float, writes_active: threading.Event) -> List[float]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def reader() -> None:
+        client = ModbusTcpClient(host, port)
+        local = []
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            start = time.monotonic()
+            client.read_input_registers(1, 12, unit=unit)
+            local.append(time.monotonic() - start)
+        client.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=reader) for _ in range(clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    writes_active.clear()
+    return latencies
+
+
+def run_writer(host: str, port: int, unit: int, address: int, active: threading.Event) -> List[float]:
+    client = ModbusTcpClient(host, port)
+    value = client.read_holding_registers(address, 1, unit=unit).registers[0]
+    latencies = []
+    while active.is_set():
+        start = time.monotonic()
+        client.write_register(address, value, unit=unit)
+        latencies.append(time.monotonic() - start)
+    client.close()
+    return latencies
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Measures Modbus read latency with and without writes in flight")
+    argparser.add_argument("--modbus-host", type=str, required=True)
+    argparser.add_argument("--modbus-port", type=int, required=True)
+    argparser.add_argument("--unit", type=int, default=1)
+    argparser.add_argument("--clients", type=int, default=4)
+    argparser.add_argument("--duration", type=float, default=10.0)
+    argparser.add_argument("--write-address", type=int, default=1)
+
+    args = argparser.parse_args()
+
+    idle = threading.Event()
+    baseline = run_readers(args.modbus_host, args.modbus_port, args.unit, args.clients, args.duration, idle)
+
+    active = threading.Event()
+    active.set()
+    write_latencies: List[float] = []
+    writer = threading.Thread(target=lambda: write_latencies.extend(run_writer(args.modbus_host, args.modbus_port, args.unit, args.write_address, active)))
+    writer.start()
+    under_writes = run_readers(args.modbus_host, args.modbus_port, args.unit, args.clients, args.duration, active)
+    writer.join()
+
+    for name, samples in (("reads", baseline), ("reads during writes", under_writes), ("writes", write_latencies)):
+        summary = summarize(samples)
+        print(f"{name:>20}: n={summary['count']:<6} mean={summary['mean_ms']:.2f}ms p50={summary['p50_ms']:.2f}ms "
+              f"p99={summary['p99_ms']:.2f}ms max={summary['max_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
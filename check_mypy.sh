@@ -1,2 +1,2 @@
 #!/bin/bash
-mypy -p esmart_device -p esmart_monitor -p esmart_modbus
+mypy -p esmart_device -p esmart_monitor -p esmart_modbus -p benchmarks -p esmart_simulator -p tests
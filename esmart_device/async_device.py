@@ -0,0 +1,107 @@
+import asyncio
+import time
+from typing import Optional, Sequence
+
+import serial
+
+from esmart_device.capture import CaptureWriter, CapturingSerial
+from esmart_device.device import ESmartDeviceBase, ESmartSerialDevice
+from esmart_device.metrics import DeviceMetrics
+from esmart_device.pacing import PacingController
+from esmart_device.protocol import build_set_request_word, build_set_request_words, build_get_request
+
+POLL_INTERVAL = 0.002
+
+
+def port_fileno(ser: serial.SerialBase) -> Optional[int]:
+    try:
+        return ser.fileno()
+    except (AttributeError, OSError):
+        return None
+
+
+class AsyncSerialPort:
+    def __init__(self, path: str, capture: Optional[CaptureWriter] = None) -> None:
+        # only reads are awaited, a request frame is at most a few hundred bytes which the driver's transmit buffer
+        # takes at once, so ser.write returns without waiting for the frame to go out on the wire
+        ser = serial.serial_for_url(path, ESmartSerialDevice.BAUD_RATE, timeout=0)
+        self.ser = ser if capture is None else CapturingSerial(ser, capture)
+        self._fd = port_fileno(ser)
+        self._loop = asyncio.get_running_loop()
+
+    async def wait_readable(self, timeout: float) -> bool:
+        if self._fd is None:
+            # url handlers without a file descriptor (rfc2217://, esmartsim://) are polled
+            deadline = self._loop.time() + timeout
+            while self.ser.in_waiting == 0:
+                if self._loop.time() >= deadline:
+                    return False
+                await asyncio.sleep(POLL_INTERVAL)
+            return True
+
+        # the reader is level-triggered, so it is only registered while a response is awaited,
+        # otherwise stray bytes left between exchanges would wake the loop on every iteration
+        readable: asyncio.Future[bool] = self._loop.create_future()
+
+        def on_wakeup(result: bool) -> None:
+            if not readable.done():
+                readable.set_result(result)
+
+        self._loop.add_reader(self._fd, on_wakeup, True)
+        timer = self._loop.call_later(timeout, on_wakeup, False)
+        try:
+            return await readable
+        finally:
+            timer.cancel()
+            self._loop.remove_reader(self._fd)
+
+    def close(self) -> None:
+        self.ser.close()
+
+
+class AsyncESmartDevice(ESmartDeviceBase):
+    def __init__(self, path: str, *, device_addr: int, pacing: Optional[PacingController] = None, port: Optional[AsyncSerialPort] = None,
+                 metrics: Optional[DeviceMetrics] = None) -> None:
+        self.port = port or AsyncSerialPort(path)
+        super().__init__(path, self.port.ser, device_addr=device_addr, pacing=pacing, metrics=metrics)
+
+    def close(self) -> None:
+        self.port.close()
+
+    async def set_word(self, *, data_item: int, data_offset: int, value: int) -> memoryview:
+        req_data = build_set_request_word(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, value=value)
+        return await self._send_request_for_response(req_data, data_item)
+
+    async def set_words(self, *, data_item: int, data_offset: int, values: Sequence[int]) -> memoryview:
+        req_data = build_set_request_words(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, values=values)
+        return await self._send_request_for_response(req_data, data_item)
+
+    async def get(self, *, data_item: int, data_offset: int, data_length: int) -> memoryview:
+        req_data = build_get_request(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, data_length=data_length)
+        return (await self._send_request_for_response(req_data, data_item))[2:]
+
+    async def _send_request_for_response(self, request_data: bytes, data_item: int) -> memoryview:
+        await asyncio.sleep(self.pacing.delay())
+        with self._exchange(request_data):
+            return await self._read_response(data_item)
+
+    async def _read_response(self, data_item: int) -> memoryview:
+        checksum_errors = self.parser.checksum_errors
+        deadline = time.monotonic() + ESmartSerialDevice.RESPONSE_TIMEOUT
+
+        while True:
+            frame = self.parser.next_frame()
+
+            if frame is None:
+                self._check_deadline(deadline, checksum_errors)
+                count = self.ser.readinto(self.parser.free_space())
+                if count > 0:
+                    self.parser.commit(count)
+                    continue
+
+                if await self.port.wait_readable(ESmartSerialDevice.READ_TIMEOUT):
+                    continue
+                frame = self._resync_after_timeout(checksum_errors)
+
+            if self._is_response(frame, data_item):
+                return frame[1]
@@ -0,0 +1,121 @@
+import struct
+import threading
+import time
+from typing import Iterator, Tuple, Optional, List
+
+import serial
+
+CaptureMagic = b"ESCP"
+CaptureVersion = 1
+FlushSize = 64 * 1024
+
+TX = 0
+RX = 1
+
+header_struct = struct.Struct("<4sId")
+record_struct = struct.Struct("<dBH")
+
+
+class CaptureException(Exception):
+    pass
+
+
+class CaptureWriter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._buffer = bytearray(header_struct.pack(CaptureMagic, CaptureVersion, time.time()))
+        self._file = open(path, "wb", buffering=0)
+
+    def record(self, direction: int, data: bytes) -> None:
+        timestamp = time.perf_counter() - self._start
+        with self._lock:
+            for i in range(0, len(data), 0xffff):
+                chunk = data[i:i + 0xffff]
+                self._buffer += record_struct.pack(timestamp, direction, len(chunk))
+                self._buffer += chunk
+            if len(self._buffer) >= FlushSize:
+                self._flush()
+
+    def _flush(self) -> None:
+        if len(self._buffer) > 0 and not self._file.closed:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+class CapturingSerial(serial.SerialBase):
+    def __init__(self, ser: serial.SerialBase, capture: CaptureWriter) -> None:
+        super().__init__()
+        self.ser = ser
+        self.capture = capture
+        self.is_open = True
+
+    @property
+    def in_waiting(self) -> int:
+        return self.ser.in_waiting
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.ser.read(size)
+        if len(data) > 0:
+            self.capture.record(RX, data)
+        return data
+
+    def write(self, data: bytes) -> Optional[int]:
+        self.capture.record(TX, data)
+        return self.ser.write(data)
+
+    def fileno(self) -> int:
+        return self.ser.fileno()
+
+    def close(self) -> None:
+        self.is_open = False
+        self.capture.flush()
+        self.ser.close()
+
+
+def read_capture(path: str) -> Tuple[float, Iterator[Tuple[float, int, bytes]]]:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < header_struct.size:
+        raise CaptureException(f"{path}: truncated header")
+    magic, version, started_at = header_struct.unpack_from(data, 0)
+    if magic != CaptureMagic or version != CaptureVersion:
+        raise CaptureException(f"{path}: not a capture file")
+
+    def records() -> Iterator[Tuple[float, int, bytes]]:
+        position = header_struct.size
+        while position + record_struct.size <= len(data):
+            timestamp, direction, length = record_struct.unpack_from(data, position)
+            position += record_struct.size
+            if position + length > len(data):
+                break
+            yield timestamp, direction, data[position:position + length]
+            position += length
+
+    return started_at, records()
+
+
+def split_exchanges(records: Iterator[Tuple[float, int, bytes]]) -> Iterator[Tuple[float, bytes, List[Tuple[float, bytes]]]]:
+    tx: Optional[Tuple[float, bytes]] = None
+    rx: List[Tuple[float, bytes]] = []
+    for timestamp, direction, data in records:
+        if direction == TX:
+            if tx is not None:
+                yield tx[0], tx[1], rx
+            tx = timestamp, data
+            rx = []
+        elif tx is not None:
+            rx.append((timestamp, data))
+    if tx is not None:
+        yield tx[0], tx[1], rx
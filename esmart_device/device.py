@@ -1,69 +1,148 @@
+import contextlib
 import serial
 import logging
-from typing import Union, Sequence
-
-from esmart_device.crc import verify_crc
-from esmart_device.exceptions import CommandNotAcknowledgedException, ChecksumException, InvalidCommandException, ReadTimeoutException
-from esmart_device.protocol import build_set_request_word, build_get_request, CMD_NACK, CMD_ERR
+import time
+from typing import Union, Sequence, Optional, Iterator, Tuple
+
+from esmart_device.capture import CaptureWriter, CapturingSerial
+from esmart_device.exceptions import ESmartException, CommandNotAcknowledgedException, ChecksumException, InvalidCommandException, ReadTimeoutException
+from esmart_device.frame_parser import FrameParser
+from esmart_device.metrics import DeviceMetrics
+from esmart_device.pacing import PacingController
+from esmart_device.poll_plan import wire_time
+from esmart_device.protocol import build_set_request_word, build_set_request_words, build_get_request, CMD_NACK, CMD_ERR
 from esmart_device.response_header import ResponseHeader
 
 
-def read_all(ser: serial.Serial, len_to_read: int) -> bytes:
-    buffer = b""
-    while len(buffer) < len_to_read:
-        cur_read = ser.read(len_to_read - len(buffer))
-        if len(cur_read) == 0:
-            raise ReadTimeoutException()
-        buffer += cur_read
-    return buffer
+def bytes_to_str(data: Union[bytes, memoryview, Sequence[int]]) -> str:
+    return ','.join(f'{x:02x}' for x in data)
 
 
-def bytes_to_str(data: Union[bytes, Sequence[int]]) -> str:
-    return ','.join(f'{x:02x}' for x in data)
+def is_response_for(header: ResponseHeader, payload: memoryview, device_addr: Optional[int], data_item: int) -> bool:
+    logging.debug(f"Got response: {header} / {bytes_to_str(payload)}")
 
+    if device_addr is not None and header.device_addr != device_addr:
+        logging.debug(f"Ignoring response from device {header.device_addr}, expected {device_addr}")
+        return False
 
-class ESmartSerialDevice:
-    def __init__(self, path: str, *, device_addr: int) -> None:
-        self.ser = serial.Serial(path, 9600, timeout=0.1)
-        self.device_addr = device_addr
+    if header.cmd == CMD_NACK:
+        raise CommandNotAcknowledgedException()
+    if header.cmd == CMD_ERR:
+        raise InvalidCommandException()
 
-    def close(self) -> None:
-        self.ser.close()
+    if header.data_item != data_item:
+        logging.debug(f"Ignoring response for data item {header.data_item}, expected {data_item}")
+        return False
 
-    def set_word(self, *, data_item: int, data_offset: int, value: int) -> bytes:
-        req_data = build_set_request_word(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, value=value)
-        return self._send_request_for_response(req_data)
+    return True
 
-    def get(self, *, data_item: int, data_offset: int, data_length: int) -> bytes:
-        req_data = build_get_request(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, data_length=data_length)
-        return self._send_request_for_response(req_data)[2:]
 
-    def _send_request_for_response(self, request_data: bytes) -> bytes:
+class ESmartDeviceBase:
+    def __init__(self, path: str, ser: serial.SerialBase, *, device_addr: int, pacing: Optional[PacingController], metrics: Optional[DeviceMetrics]) -> None:
+        self.ser = ser
+        self.device_addr = device_addr
+        self.pacing = pacing or PacingController()
+        self.parser = FrameParser()
+        self.check_device_addr = False
+        self.metrics = metrics or DeviceMetrics(path, device_addr)
+
+    @contextlib.contextmanager
+    def _exchange(self, request_data: bytes) -> Iterator[None]:
+        self.parser.reset()
+
+        start = time.monotonic()
         self.ser.write(request_data)
 
         logging.debug(f"Sending request: {bytes_to_str(request_data)}")
 
-        payload = self._read_response()
+        received_bytes = self.parser.received_bytes
+        discarded_bytes = self.parser.discarded_bytes
+        try:
+            yield
+        except ESmartException as e:
+            self.pacing.on_error()
+            self.metrics.on_error(type(e))
+            raise
+        finally:
+            if self.parser.discarded_bytes != discarded_bytes:
+                logging.info(f"Discarded {self.parser.discarded_bytes - discarded_bytes} bytes while resynchronising")
+                self.metrics.discarded_bytes.inc(self.parser.discarded_bytes - discarded_bytes)
+
+        round_trip = time.monotonic() - start
+        # the gap follows the controller's own turnaround, the time the frames spend on the wire grows with their length
+        frame_bytes = len(request_data) + self.parser.received_bytes - received_bytes
+        self.pacing.on_response(max(0.0, round_trip - wire_time(frame_bytes, baud_rate=ESmartSerialDevice.BAUD_RATE)))
+        self.metrics.round_trip.observe(round_trip)
+
+    def _resync_after_timeout(self, checksum_errors: int) -> Tuple[ResponseHeader, memoryview]:
+        # a stray start mark can claim a length longer than anything still coming, skip it and rescan
+        frame = self.parser.resync()
+        if frame is None:
+            if self.parser.checksum_errors != checksum_errors:
+                raise ChecksumException()
+            raise ReadTimeoutException()
+        return frame
+
+    def _check_deadline(self, deadline: float, checksum_errors: int) -> None:
+        # bus noise can keep every read short of the idle timeout, so the whole response is bounded as well
+        if time.monotonic() > deadline:
+            if self.parser.checksum_errors != checksum_errors:
+                raise ChecksumException()
+            raise ReadTimeoutException()
+
+    def _is_response(self, frame: Tuple[ResponseHeader, memoryview], data_item: int) -> bool:
+        return is_response_for(frame[0], frame[1], self.device_addr if self.check_device_addr else None, data_item)
 
-        return payload
 
-    def _read_response(self) -> bytes:
-        header_bytes = read_all(self.ser, ResponseHeader.packet_size())
+class ESmartSerialDevice(ESmartDeviceBase):
+    BAUD_RATE = 9600
+    READ_TIMEOUT = 0.1
+    RESPONSE_TIMEOUT = 1.0
 
-        header = ResponseHeader.parse(header_bytes)
+    def __init__(self, path: str, *, device_addr: int, pacing: Optional[PacingController] = None, ser: Optional[serial.SerialBase] = None,
+                 metrics: Optional[DeviceMetrics] = None) -> None:
+        super().__init__(path, ser or ESmartSerialDevice.open_port(path), device_addr=device_addr, pacing=pacing, metrics=metrics)
 
-        if header.cmd == CMD_NACK:
-            raise CommandNotAcknowledgedException()
-        if header.cmd == CMD_ERR:
-            raise InvalidCommandException()
+    @staticmethod
+    def open_port(path: str, capture: Optional[CaptureWriter] = None) -> serial.SerialBase:
+        ser = serial.serial_for_url(path, ESmartSerialDevice.BAUD_RATE, timeout=ESmartSerialDevice.READ_TIMEOUT)
+        return ser if capture is None else CapturingSerial(ser, capture)
 
-        payload_with_crc = read_all(self.ser, header.length + 1)
-        payload = payload_with_crc[:-1]
-        crc = payload_with_crc[-1]
+    def close(self) -> None:
+        self.ser.close()
 
-        logging.debug(f"Got response: {bytes_to_str(header_bytes)} / {bytes_to_str(payload)} / {bytes_to_str([crc])}")
+    def set_word(self, *, data_item: int, data_offset: int, value: int) -> memoryview:
+        req_data = build_set_request_word(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, value=value)
+        return self._send_request_for_response(req_data, data_item)
 
-        if not verify_crc(header_bytes, payload, crc):
-            raise ChecksumException()
+    def set_words(self, *, data_item: int, data_offset: int, values: Sequence[int]) -> memoryview:
+        req_data = build_set_request_words(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, values=values)
+        return self._send_request_for_response(req_data, data_item)
 
-        return payload
+    def get(self, *, data_item: int, data_offset: int, data_length: int) -> memoryview:
+        req_data = build_get_request(device_addr=self.device_addr, data_item=data_item, data_offset=data_offset, data_length=data_length)
+        return self._send_request_for_response(req_data, data_item)[2:]
+
+    def _send_request_for_response(self, request_data: bytes, data_item: int) -> memoryview:
+        self.pacing.wait()
+        with self._exchange(request_data):
+            return self._read_response(data_item)
+
+    def _read_response(self, data_item: int) -> memoryview:
+        checksum_errors = self.parser.checksum_errors
+        deadline = time.monotonic() + ESmartSerialDevice.RESPONSE_TIMEOUT
+
+        while True:
+            frame = self.parser.next_frame()
+
+            if frame is None:
+                self._check_deadline(deadline, checksum_errors)
+                space = self.parser.free_space()
+                count = self.ser.readinto(space[:max(1, min(len(space), self.ser.in_waiting))])
+                if count > 0:
+                    self.parser.commit(count)
+                    continue
+                frame = self._resync_after_timeout(checksum_errors)
+
+            if self._is_response(frame, data_item):
+                return frame[1]
@@ -16,3 +16,7 @@ class ChecksumException(ESmartException):
 
 class ReadTimeoutException(ESmartException):
     pass
+
+
+class InvalidFrameException(ESmartException):
+    pass
@@ -0,0 +1,87 @@
+from typing import Optional, Tuple
+
+from esmart_device.crc import calculate_crc
+from esmart_device.protocol import PROTOCOL_STARTING_MARK
+from esmart_device.response_header import ResponseHeader
+
+HEADER_SIZE = ResponseHeader.packet_size()
+MAX_FRAME_SIZE = HEADER_SIZE + 0xff + 1
+
+
+class FrameParser:
+    def __init__(self, buffer_size: int = 4 * MAX_FRAME_SIZE) -> None:
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self.received_bytes = 0
+        self.discarded_bytes = 0
+        self.checksum_errors = 0
+
+    @property
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def reset(self) -> None:
+        self.discarded_bytes += self.buffered
+        self._start = self._end = 0
+
+    def free_space(self) -> memoryview:
+        if self._start > 0:
+            length = self.buffered
+            self._buffer[0:length] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, length
+        if self._end == len(self._buffer):
+            self._discard(1)
+            return self.free_space()
+        return self._view[self._end:]
+
+    def commit(self, count: int) -> None:
+        self._end += count
+        self.received_bytes += count
+
+    def feed(self, data: bytes) -> None:
+        while len(data) > 0:
+            space = self.free_space()
+            chunk = min(len(space), len(data))
+            space[:chunk] = data[:chunk]
+            self.commit(chunk)
+            data = data[chunk:]
+
+    def _discard(self, count: int) -> None:
+        self._start += count
+        self.discarded_bytes += count
+
+    def next_frame(self) -> Optional[Tuple[ResponseHeader, memoryview]]:
+        while True:
+            mark_pos = self._buffer.find(PROTOCOL_STARTING_MARK, self._start, self._end)
+            if mark_pos < 0:
+                self._discard(self.buffered)
+                return None
+            self._discard(mark_pos - self._start)
+
+            if self.buffered < HEADER_SIZE:
+                return None
+
+            length = self._buffer[self._start + HEADER_SIZE - 1]
+            frame_size = HEADER_SIZE + length + 1
+            if self.buffered < frame_size:
+                return None
+
+            frame = self._view[self._start:self._start + frame_size]
+            if calculate_crc(frame[:-1]) != frame[-1]:
+                self.checksum_errors += 1
+                self._discard(1)
+                continue
+
+            header = ResponseHeader.parse(frame[:HEADER_SIZE])
+            self._start += frame_size
+            return header, frame[HEADER_SIZE:-1]
+
+    def resync(self) -> Optional[Tuple[ResponseHeader, memoryview]]:
+        while self.buffered > 0:
+            self._discard(1)
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+        return None
@@ -0,0 +1,148 @@
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Tuple, List, Callable, Sequence, Union, Optional, Type
+
+from esmart_device.exceptions import ESmartException, ReadTimeoutException, ChecksumException
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Gauge:
+    def __init__(self, read: Callable[[], Optional[float]]) -> None:
+        self.read = read
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.last = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if len(items) == 0:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._families: Dict[str, Tuple[str, str, Dict[Labels, Metric]]] = {}
+
+    def _get(self, name: str, help: str, kind: str, labels: Dict[str, str], factory: Callable[[], Metric]) -> Metric:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, _, metrics = self._families.setdefault(name, (kind, help, {}))
+            if key not in metrics:
+                metrics[key] = factory()
+            return metrics[key]
+
+    def counter(self, name: str, help: str, labels: Dict[str, str]) -> Counter:
+        metric = self._get(name, help, "counter", labels, Counter)
+        assert isinstance(metric, Counter)
+        return metric
+
+    def gauge(self, name: str, help: str, labels: Dict[str, str], read: Callable[[], Optional[float]]) -> Gauge:
+        metric = self._get(name, help, "gauge", labels, lambda: Gauge(read))
+        assert isinstance(metric, Gauge)
+        metric.read = read
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Dict[str, str], buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        metric = self._get(name, help, "histogram", labels, lambda: Histogram(buckets))
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            families = [(name, kind, help, list(metrics.items())) for name, (kind, help, metrics) in sorted(self._families.items())]
+
+        lines: List[str] = []
+        for name, kind, help, metrics in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if isinstance(metric, Counter):
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                elif isinstance(metric, Gauge):
+                    value = metric.read()
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                else:
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + [float("inf")], metric.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class DeviceMetrics:
+    def __init__(self, port: str, device_addr: int, metrics_registry: MetricsRegistry = registry) -> None:
+        labels = dict(port=port, device=str(device_addr))
+        self.round_trip = metrics_registry.histogram("esmart_serial_round_trip_seconds", "Serial request round-trip time", labels)
+        self.read_timeouts = metrics_registry.counter("esmart_serial_errors_total", "Failed serial requests", dict(labels, error="timeout"))
+        self.checksum_errors = metrics_registry.counter("esmart_serial_errors_total", "Failed serial requests", dict(labels, error="checksum"))
+        self.protocol_errors = metrics_registry.counter("esmart_serial_errors_total", "Failed serial requests", dict(labels, error="protocol"))
+        self.discarded_bytes = metrics_registry.counter("esmart_serial_discarded_bytes_total", "Bytes skipped while resynchronising", labels)
+
+    def on_error(self, error_type: Type[ESmartException]) -> None:
+        if issubclass(error_type, ReadTimeoutException):
+            self.read_timeouts.inc()
+        elif issubclass(error_type, ChecksumException):
+            self.checksum_errors.inc()
+        else:
+            self.protocol_errors.inc()
+
+
+def start_metrics_server(host: str, port: int, metrics_registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    metrics = metrics_registry or registry
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    th = threading.Thread(target=server.serve_forever, name="esmart-metrics")
+    th.daemon = True
+    th.start()
+    return server
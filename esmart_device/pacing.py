@@ -0,0 +1,47 @@
+import time
+from typing import Optional
+
+DEFAULT_MIN_FRAME_GAP = 0.05
+DEFAULT_MAX_FRAME_GAP = 2.0
+
+
+class PacingController:
+    TURNAROUND_GAP_FACTOR = 0.5
+    TURNAROUND_SMOOTHING = 0.2
+    BACKOFF_FACTOR = 2.0
+    RECOVERY_FACTOR = 0.8
+
+    def __init__(self, *, min_gap: float = DEFAULT_MIN_FRAME_GAP, max_gap: float = DEFAULT_MAX_FRAME_GAP) -> None:
+        self.min_gap = min_gap
+        self.max_gap = max(max_gap, min_gap)
+        self.turnaround: Optional[float] = None
+        self.backoff = 0.0
+        self._last_frame_end = 0.0
+
+    @property
+    def gap(self) -> float:
+        derived = 0.0 if self.turnaround is None else self.turnaround * PacingController.TURNAROUND_GAP_FACTOR
+        return min(self.max_gap, max(self.min_gap, derived) + self.backoff)
+
+    def delay(self) -> float:
+        return max(0.0, self._last_frame_end + self.gap - time.monotonic())
+
+    def wait(self) -> None:
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_response(self, turnaround: float) -> None:
+        if self.turnaround is None:
+            self.turnaround = turnaround
+        else:
+            self.turnaround += (turnaround - self.turnaround) * PacingController.TURNAROUND_SMOOTHING
+
+        self.backoff *= PacingController.RECOVERY_FACTOR
+        if self.backoff < 0.001:
+            self.backoff = 0.0
+        self._last_frame_end = time.monotonic()
+
+    def on_error(self) -> None:
+        self.backoff = min(self.max_gap, max(self.backoff * PacingController.BACKOFF_FACTOR, self.min_gap))
+        self._last_frame_end = time.monotonic()
@@ -0,0 +1,105 @@
+import logging
+from typing import List, Tuple, Sequence, Dict
+
+from esmart_device.protocol import MAX_SET_WORDS
+from esmart_device.registers import ESmartRegister, PollTier, CompiledFrameDecoder
+
+DEFAULT_MAX_GAP_WORDS = 8
+DEFAULT_MAX_FRAME_LENGTH = 128
+
+REQUEST_FRAME_SIZE = 10
+RESPONSE_OVERHEAD_SIZE = 9
+BITS_PER_BYTE = 10
+
+
+class PlannedRead:
+    def __init__(self, data_item: int, data_offset: int, data_length: int, registers: Sequence[Tuple[ESmartRegister, int]],
+                 poll_tier: PollTier) -> None:
+        self.data_item = data_item
+        self.data_offset = data_offset
+        self.data_length = data_length
+        self.registers = list(registers)
+        self.poll_tier = poll_tier
+        self.decoder = CompiledFrameDecoder(self.registers)
+
+    def __str__(self) -> str:
+        return f"item {self.data_item} @ 0x{self.data_offset:02x} +{self.data_length}B ({len(self.registers)} regs, {self.poll_tier.name})"
+
+
+def plan_reads(registers: Sequence[ESmartRegister], *,
+               max_gap_words: int = DEFAULT_MAX_GAP_WORDS,
+               max_frame_length: int = DEFAULT_MAX_FRAME_LENGTH) -> List[PlannedRead]:
+    runs: List[List[ESmartRegister]] = []
+
+    for reg in sorted(registers, key=lambda x: (x.data_item, x.esmart_address)):
+        if len(runs) > 0:
+            run = runs[-1]
+            run_start = run[0].esmart_address
+            run_end = max(x.esmart_address + x.data_size_words for x in run)
+            reg_end = reg.esmart_address + reg.data_size_words
+            if run[0].data_item == reg.data_item and run[0].poll_tier == reg.poll_tier and \
+                    reg.esmart_address - run_end <= max_gap_words and \
+                    (max(run_end, reg_end) - run_start) * 2 <= max_frame_length:
+                run.append(reg)
+                continue
+        runs.append([reg])
+
+    plan = []
+    for run in runs:
+        addr_min = run[0].esmart_address
+        addr_max = max(x.esmart_address + x.data_size_words for x in run)
+        plan.append(PlannedRead(run[0].data_item, addr_min, (addr_max - addr_min) * 2,
+                                [(x, (x.esmart_address - addr_min) * 2) for x in run], run[0].poll_tier))
+    return plan
+
+
+class PlannedWrite:
+    def __init__(self, data_item: int, data_offset: int, writes: Sequence[Tuple[ESmartRegister, int]]) -> None:
+        self.data_item = data_item
+        self.data_offset = data_offset
+        self.writes = list(writes)
+        self.decoder = CompiledFrameDecoder([(reg, (reg.esmart_address - data_offset) * 2) for reg, _ in self.writes])
+        self.data_length = self.decoder.struct.size
+
+    @property
+    def values(self) -> List[int]:
+        return [value for _, value in self.writes]
+
+    def __str__(self) -> str:
+        return ", ".join(f"{reg.name.strip()} -> {value}" for reg, value in self.writes)
+
+
+def plan_writes(writes: Dict[ESmartRegister, int], *, max_words: int = MAX_SET_WORDS) -> List[PlannedWrite]:
+    runs: List[List[Tuple[ESmartRegister, int]]] = []
+
+    for reg, value in sorted(writes.items(), key=lambda x: (x[0].data_item, x[0].esmart_address)):
+        if len(runs) > 0:
+            run = runs[-1]
+            last_reg = run[-1][0]
+            if last_reg.data_item == reg.data_item and \
+                    last_reg.esmart_address + last_reg.data_size_words == reg.esmart_address and \
+                    len(run) < max_words:
+                run.append((reg, value))
+                continue
+        runs.append([(reg, value)])
+
+    return [PlannedWrite(run[0][0].data_item, run[0][0].esmart_address, run) for run in runs]
+
+
+def wire_time(frame_bytes: int, *, baud_rate: int) -> float:
+    return frame_bytes * BITS_PER_BYTE / baud_rate
+
+
+def estimate_read_time(read: PlannedRead, *, baud_rate: int, frame_gap: float) -> float:
+    return wire_time(REQUEST_FRAME_SIZE + RESPONSE_OVERHEAD_SIZE + read.data_length, baud_rate=baud_rate) + frame_gap
+
+
+def estimate_cycle_time(plan: Sequence[PlannedRead], *, baud_rate: int, frame_gap: float) -> float:
+    return sum(estimate_read_time(x, baud_rate=baud_rate, frame_gap=frame_gap) for x in plan)
+
+
+def log_plan(plan: Sequence[PlannedRead], *, baud_rate: int, frame_gap: float) -> None:
+    cycle_time = estimate_cycle_time(plan, baud_rate=baud_rate, frame_gap=frame_gap)
+    logging.info(f"Poll plan: {len(plan)} requests per cycle, expected cycle time {cycle_time:.3f}s")
+    for read in plan:
+        logging.debug(f"  {read}")
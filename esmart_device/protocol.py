@@ -1,4 +1,5 @@
 import struct
+from typing import Sequence
 
 from esmart_device.crc import calculate_crc
 
@@ -14,6 +15,9 @@ CMD_NACK = 0x04
 CMD_EXEC = 0x05
 CMD_ERR = 0x7f
 
+MAX_PAYLOAD_LENGTH = 0xff
+MAX_SET_WORDS = (MAX_PAYLOAD_LENGTH - 2) // 2
+
 
 def build_request(device_addr: int, command_id: int, data_item: int, payload: bytes) -> bytes:
     data = struct.pack("BBBBBB", PROTOCOL_STARTING_MARK, ESMART_DEVICE_TYPE, device_addr, command_id, data_item, len(payload)) + payload
@@ -26,4 +30,9 @@ def build_get_request(*, device_addr: int, data_item: int, data_offset: int, dat
 
 
 def build_set_request_word(*, device_addr: int, data_item: int, data_offset: int, value: int) -> bytes:
-    return build_request(device_addr, CMD_SET, data_item, struct.pack("BB", data_offset, 0) + struct.pack("<H", value))
+    return build_set_request_words(device_addr=device_addr, data_item=data_item, data_offset=data_offset, values=[value])
+
+
+def build_set_request_words(*, device_addr: int, data_item: int, data_offset: int, values: Sequence[int]) -> bytes:
+    assert 0 < len(values) <= MAX_SET_WORDS
+    return build_request(device_addr, CMD_SET, data_item, struct.pack("BB", data_offset, 0) + struct.pack(f"<{len(values)}H", *values))
@@ -1,6 +1,6 @@
 import struct
 from enum import Enum
-from typing import Union, List, Callable
+from typing import Union, List, Callable, Optional, Sequence, Tuple
 
 
 class ModbusRegisterType(Enum):
@@ -9,12 +9,30 @@ class ModbusRegisterType(Enum):
     Coil = 2
 
 
+class PollTier(Enum):
+    Fast = 0
+    Slow = 1
+
+
 class DataType(Enum):
     UInt16 = 0
     Int16 = 1
     UInt32s = 2
 
 
+data_formats = {
+    DataType.UInt16: "<H",
+    DataType.Int16: "<h",
+    DataType.UInt32s: "4s",
+}
+
+field_formats = {
+    DataType.UInt16: "H",
+    DataType.Int16: "h",
+    DataType.UInt32s: "HH",
+}
+
+
 def uint32s_to_int(x: bytes) -> int:
     high: int
     low: int
@@ -26,7 +44,8 @@ class ESmartRegister:
     def __init__(self, name: str, *, esmart_data_item: int, esmart_address: int, data_type: DataType, scale: Union[int, float] = 1,
                  modbus_address: int,
                  modbus_type: ModbusRegisterType,
-                 esmart_to_modbus: Callable[[int], Union[int, bool]] = lambda x: x,
+                 poll_tier: PollTier = PollTier.Fast,
+                 esmart_to_modbus: Optional[Callable[[int], Union[int, bool]]] = None,
                  modbus_to_esmart: Callable[[int], int] = lambda x: x) -> None:
         self.name = name
         self.data_item = esmart_data_item
@@ -35,73 +54,72 @@ class ESmartRegister:
         self.scale = scale
         self.modbus_address = modbus_address
         self.modbus_type = modbus_type
+        self.poll_tier = poll_tier
         self.emart_to_modbus = esmart_to_modbus
         self.modbus_to_esmart = modbus_to_esmart
 
-    @property
-    def data_format(self) -> str:
-        if self.data_type == DataType.Int16:
-            return "<h"
-        if self.data_type == DataType.UInt16:
-            return "<H"
-        if self.data_type == DataType.UInt32s:
-            return "4s"
-
-        raise Exception("invalid data type")
-
-    @property
-    def data_size(self) -> int:
-        return struct.calcsize(self.data_format)
+        self.data_format = data_formats[data_type]
+        self.data_size = struct.calcsize(self.data_format)
+        self.data_size_words = self.data_size // 2
+        self.to_modbus_words = self._compile_to_modbus_words()
 
-    @property
-    def data_size_words(self) -> int:
-        return self.data_size // 2
-
-    def process_raw(self, value: Union[int, bytes]) -> int:
-        if self.data_type == DataType.Int16 and isinstance(value, int):
-            return value
-        if self.data_type == DataType.UInt16 and isinstance(value, int):
-            return value
-        if self.data_type == DataType.UInt32s and isinstance(value, bytes):
-            return uint32s_to_int(value)
-        raise Exception
+    def _compile_to_modbus_words(self) -> Callable[[int], Tuple[int, ...]]:
+        convert = self.emart_to_modbus
+        if self.data_type == DataType.UInt32s:
+            return lambda x: (x & 0xffff, (x >> 16) & 0xffff)
+        if convert is None:
+            return lambda x: (x & 0xffff,)
+        return lambda x: (int(convert(x)) & 0xffff,)
 
     def to_modbus(self, value: int) -> int:
+        if self.emart_to_modbus is None:
+            return value
         return self.emart_to_modbus(value)
 
-    def to_modbus_regs(self, value: int) -> List[int]:
-        modbus_value = self.to_modbus(value)
+    def to_esmart_word(self, value: int) -> int:
+        esmart_value = self.modbus_to_esmart(value)
 
         if self.data_type in (DataType.Int16, DataType.UInt16):
-            return [modbus_value]
-        if self.data_type == DataType.UInt32s:
-            return [(value & 0x0000ffff) >> 0,
-                    (value & 0xffff0000) >> 16]
+            return esmart_value
 
         raise Exception("invalid data type")
 
-    def from_modbus_regs(self, regs: List[int]) -> Union[int, List[int]]:
-        if self.data_type in (DataType.Int16, DataType.UInt16):
-            return regs[0]
-        if self.data_type == DataType.UInt32s:
-            return [(regs[0]) << 0 |
-                    (regs[1]) << 16]
 
-        raise Exception("invalid data type")
+class CompiledFrameDecoder:
+    def __init__(self, registers: Sequence[Tuple[ESmartRegister, int]]) -> None:
+        self.registers = [reg for reg, _ in registers]
 
-    def to_esmart_word(self, value: int) -> int:
-        esmart_value = self.modbus_to_esmart(value)
+        fmt = "<"
+        position = 0
+        field = 0
+        self._fields: List[Tuple[int, bool]] = []
+        for reg, offset in registers:
+            if offset < position:
+                raise Exception("overlapping registers")
+            if offset > position:
+                fmt += f"{offset - position}x"
+            wide = reg.data_type == DataType.UInt32s
+            fmt += field_formats[reg.data_type]
+            self._fields.append((field, wide))
+            field += 2 if wide else 1
+            position = offset + reg.data_size
 
-        if self.data_type in (DataType.Int16, DataType.UInt16):
-            return esmart_value
+        self.struct = struct.Struct(fmt)
+        self._narrow = not any(wide for _, wide in self._fields)
 
-        raise Exception("invalid data type")
+    def decode(self, data: Union[bytes, memoryview]) -> List[int]:
+        raw = self.struct.unpack_from(data)
+        if self._narrow:
+            return list(raw)
+        return [(raw[i] << 16) | raw[i + 1] if wide else raw[i] for i, wide in self._fields]
 
 
 u16 = DataType.UInt16
 s16 = DataType.Int16
 u32 = DataType.UInt32s
 
+slow = PollTier.Slow
+
 esmart_registers = [
     ESmartRegister("        wChgMode", esmart_data_item=0, esmart_address=0x00, data_type=u16, modbus_address=1, modbus_type=ModbusRegisterType.InputRegister),
     ESmartRegister("         wPvVolt", esmart_data_item=0, esmart_address=0x01, data_type=u16, modbus_address=2, modbus_type=ModbusRegisterType.InputRegister),
@@ -116,27 +134,27 @@ esmart_registers = [
     ESmartRegister("      wInnerTemp", esmart_data_item=0, esmart_address=0x0A, data_type=s16, modbus_address=11, modbus_type=ModbusRegisterType.InputRegister),
     ESmartRegister("         wBatCap", esmart_data_item=0, esmart_address=0x0B, data_type=s16, modbus_address=12, modbus_type=ModbusRegisterType.InputRegister),
 
-    ESmartRegister("      dwTotalEng", esmart_data_item=2, esmart_address=0x0E, data_type=u32, modbus_address=13, modbus_type=ModbusRegisterType.InputRegister),
-    ESmartRegister("  dbLoadTotalEng", esmart_data_item=2, esmart_address=0x14, data_type=u32, modbus_address=15, modbus_type=ModbusRegisterType.InputRegister),
+    ESmartRegister("      dwTotalEng", esmart_data_item=2, esmart_address=0x0E, data_type=u32, modbus_address=13, modbus_type=ModbusRegisterType.InputRegister, poll_tier=slow),
+    ESmartRegister("  dbLoadTotalEng", esmart_data_item=2, esmart_address=0x14, data_type=u32, modbus_address=15, modbus_type=ModbusRegisterType.InputRegister, poll_tier=slow),
 
-    ESmartRegister("       wBulkVolt", esmart_data_item=1, esmart_address=0x03, data_type=u16, modbus_address=1, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("      wFloatVolt", esmart_data_item=1, esmart_address=0x04, data_type=u16, modbus_address=2, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("     wMaxChgCurr", esmart_data_item=1, esmart_address=0x05, data_type=u16, modbus_address=3, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("  wMaxDisChgCurr", esmart_data_item=1, esmart_address=0x06, data_type=u16, modbus_address=4, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("wEqualizeChgVolt", esmart_data_item=1, esmart_address=0x07, data_type=u16, modbus_address=5, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("wEqualizeChgTime", esmart_data_item=1, esmart_address=0x08, data_type=u16, modbus_address=6, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("     bLoadUseSel", esmart_data_item=1, esmart_address=0x09, data_type=u16, modbus_address=7, modbus_type=ModbusRegisterType.HoldingRegister),
+    ESmartRegister("       wBulkVolt", esmart_data_item=1, esmart_address=0x03, data_type=u16, modbus_address=1, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("      wFloatVolt", esmart_data_item=1, esmart_address=0x04, data_type=u16, modbus_address=2, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("     wMaxChgCurr", esmart_data_item=1, esmart_address=0x05, data_type=u16, modbus_address=3, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("  wMaxDisChgCurr", esmart_data_item=1, esmart_address=0x06, data_type=u16, modbus_address=4, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("wEqualizeChgVolt", esmart_data_item=1, esmart_address=0x07, data_type=u16, modbus_address=5, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("wEqualizeChgTime", esmart_data_item=1, esmart_address=0x08, data_type=u16, modbus_address=6, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("     bLoadUseSel", esmart_data_item=1, esmart_address=0x09, data_type=u16, modbus_address=7, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
 
-    ESmartRegister("        wLoadOvp", esmart_data_item=7, esmart_address=0x01, data_type=u16, modbus_address=8, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("        wLoadUvp", esmart_data_item=7, esmart_address=0x02, data_type=u16, modbus_address=9, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("         wBatOvp", esmart_data_item=7, esmart_address=0x03, data_type=u16, modbus_address=10, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("         wBatOvB", esmart_data_item=7, esmart_address=0x04, data_type=u16, modbus_address=11, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("         wBatUvp", esmart_data_item=7, esmart_address=0x05, data_type=u16, modbus_address=12, modbus_type=ModbusRegisterType.HoldingRegister),
-    ESmartRegister("         wBatUvB", esmart_data_item=7, esmart_address=0x06, data_type=u16, modbus_address=13, modbus_type=ModbusRegisterType.HoldingRegister),
+    ESmartRegister("        wLoadOvp", esmart_data_item=7, esmart_address=0x01, data_type=u16, modbus_address=8, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("        wLoadUvp", esmart_data_item=7, esmart_address=0x02, data_type=u16, modbus_address=9, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("         wBatOvp", esmart_data_item=7, esmart_address=0x03, data_type=u16, modbus_address=10, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("         wBatOvB", esmart_data_item=7, esmart_address=0x04, data_type=u16, modbus_address=11, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("         wBatUvp", esmart_data_item=7, esmart_address=0x05, data_type=u16, modbus_address=12, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
+    ESmartRegister("         wBatUvB", esmart_data_item=7, esmart_address=0x06, data_type=u16, modbus_address=13, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
 
-    ESmartRegister("  wBacklightTime", esmart_data_item=2, esmart_address=0x16, data_type=u16, modbus_address=14, modbus_type=ModbusRegisterType.HoldingRegister),
+    ESmartRegister("  wBacklightTime", esmart_data_item=2, esmart_address=0x16, data_type=u16, modbus_address=14, modbus_type=ModbusRegisterType.HoldingRegister, poll_tier=slow),
 
-    ESmartRegister("     loadEnabled", esmart_data_item=4, esmart_address=0x01, data_type=u16, modbus_address=1, modbus_type=ModbusRegisterType.Coil,
+    ESmartRegister("     loadEnabled", esmart_data_item=4, esmart_address=0x01, data_type=u16, modbus_address=1, modbus_type=ModbusRegisterType.Coil, poll_tier=slow,
                    esmart_to_modbus=lambda x: x == 5117,
                    modbus_to_esmart=lambda x: 5117 if x else 5118),
 ]
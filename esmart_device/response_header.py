@@ -1,6 +1,8 @@
 import struct
 from dataclasses import dataclass
+from typing import Union
 
+from esmart_device.exceptions import InvalidFrameException
 from esmart_device.protocol import PROTOCOL_STARTING_MARK
 
 
@@ -11,12 +13,14 @@ class ResponseHeader:
     cmd: int
     data_item: int
     length: int
+    device_addr: int
 
     @staticmethod
-    def parse(data: bytes) -> 'ResponseHeader':
+    def parse(data: Union[bytes, memoryview]) -> 'ResponseHeader':
         (mark, device_type, device_addr, cmd, data_item, length) = struct.unpack(ResponseHeader.FMT, data)
-        assert mark == PROTOCOL_STARTING_MARK
-        return ResponseHeader(cmd, data_item, length)
+        if mark != PROTOCOL_STARTING_MARK:
+            raise InvalidFrameException()
+        return ResponseHeader(cmd, data_item, length, device_addr)
 
     @staticmethod
     def packet_size() -> int:
@@ -1,19 +1,52 @@
 import argparse
+import asyncio
 import logging
 
-from esmart_modbus.server import run_server
+from esmart_modbus.fast_server import DEFAULT_MAX_CONNECTIONS
+from esmart_modbus.gateway_config import load_gateway_config, GatewayConfigException
+from esmart_device.metrics import start_metrics_server
+from esmart_device.pacing import DEFAULT_MIN_FRAME_GAP
+from esmart_device.poll_plan import DEFAULT_MAX_GAP_WORDS, DEFAULT_MAX_FRAME_LENGTH
+from esmart_monitor.monitor import FastPollInterval, SlowPollInterval, check_device_paths, exit_on_sigterm
+
+
+def install_asyncio_reactor() -> None:
+    from twisted.internet import asyncioreactor
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    asyncioreactor.install(loop)  # type: ignore[no-untyped-call]
 
 
 def main() -> None:
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("--esmart-port", type=str, required=True)
-    argparser.add_argument("--device-addr", type=int, required=True)
-    argparser.add_argument("--modbus-host", type=str, required=True)
-    argparser.add_argument("--modbus-port", type=int, required=True)
+    argparser.add_argument("--config", type=str)
+    argparser.add_argument("--esmart-port", type=str)
+    argparser.add_argument("--device-addr", type=int, nargs='+')
+    argparser.add_argument("--modbus-host", type=str)
+    argparser.add_argument("--modbus-port", type=int)
+    argparser.add_argument("--max-read-gap", type=int, default=DEFAULT_MAX_GAP_WORDS)
+    argparser.add_argument("--max-read-length", type=int, default=DEFAULT_MAX_FRAME_LENGTH)
+    argparser.add_argument("--min-frame-gap", type=float, default=DEFAULT_MIN_FRAME_GAP)
+    argparser.add_argument("--fast-poll-interval", type=float, default=FastPollInterval.total_seconds())
+    argparser.add_argument("--slow-poll-interval", type=float, default=SlowPollInterval.total_seconds())
+    argparser.add_argument("--max-age", type=float, help="refresh cached values older than this before answering reads")
+    argparser.add_argument("--snapshot-path", type=str, help="shared snapshot file, may contain {device_addr} and {port}")
+    argparser.add_argument("--state-path", type=str, help="last-known state file for warm starts, may contain {device_addr} and {port}")
+    argparser.add_argument("--capture-path", type=str, help="record raw serial traffic for python -m esmart_monitor.replay, may contain {port}")
+    argparser.add_argument("--metrics-host", type=str, default="127.0.0.1")
+    argparser.add_argument("--metrics-port", type=int)
+    argparser.add_argument("--asyncio", action='store_true')
+    argparser.add_argument("--frontend", choices=("twisted", "asyncio"), default="twisted",
+                           help="asyncio serves Modbus TCP straight from the monitor snapshot without pymodbus")
+    argparser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS, help="connection limit of the asyncio frontend")
     argparser.add_argument('--debug', action='store_true')
 
     args = argparser.parse_args()
 
+    if args.config is None and None in (args.esmart_port, args.device_addr, args.modbus_host, args.modbus_port):
+        argparser.error("either --config or --esmart-port, --device-addr, --modbus-host and --modbus-port are required")
+
     logging.basicConfig()
     log = logging.getLogger()
     if args.debug:
@@ -21,7 +54,50 @@ def main() -> None:
     else:
         log.setLevel(logging.INFO)
 
-    run_server(args.esmart_port, args.device_addr, args.modbus_host, args.modbus_port)
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_host, args.metrics_port)
+
+    if args.config is not None:
+        try:
+            config = load_gateway_config(args.config)
+        except GatewayConfigException as e:
+            argparser.error(f"invalid config {args.config}: {e}")
+
+    monitor_kwargs = dict(max_gap_words=args.max_read_gap, max_frame_length=args.max_read_length,
+                          min_frame_gap=args.min_frame_gap,
+                          fast_poll_interval=args.fast_poll_interval, slow_poll_interval=args.slow_poll_interval,
+                          snapshot_path=args.snapshot_path, state_path=args.state_path, capture_path=args.capture_path)
+
+    if args.config is None:
+        try:
+            check_device_paths(args.esmart_port, args.device_addr, monitor_kwargs)
+        except (KeyError, ValueError) as e:
+            argparser.error(f"invalid path option: {e}")
+
+    if args.frontend == "asyncio":
+        from esmart_modbus.fast_server import run_fast_server, run_fast_gateway
+
+        # the Twisted reactor stops on SIGTERM by itself, asyncio.run does not
+        exit_on_sigterm()
+        if args.config is not None:
+            run_fast_gateway(config, use_asyncio=args.asyncio, max_connections=args.max_connections)
+            return
+
+        run_fast_server(args.esmart_port, args.device_addr, args.modbus_host, args.modbus_port,
+                        use_asyncio=args.asyncio, max_age=args.max_age, max_connections=args.max_connections, **monitor_kwargs)
+        return
+
+    if args.asyncio:
+        install_asyncio_reactor()
+
+    from esmart_modbus.server import run_server, run_gateway
+
+    if args.config is not None:
+        run_gateway(config, use_asyncio=args.asyncio)
+        return
+
+    run_server(args.esmart_port, args.device_addr, args.modbus_host, args.modbus_port,
+               use_asyncio=args.asyncio, max_age=args.max_age, **monitor_kwargs)
 
 
 if __name__ == "__main__":
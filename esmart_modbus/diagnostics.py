@@ -0,0 +1,40 @@
+from typing import List
+
+from esmart_device.metrics import registry
+from esmart_monitor.monitor import ESmartMonitor
+
+DiagnosticRegistersBase = 1000
+DiagnosticRegistersCount = 16
+
+
+class ModbusMetrics:
+    def __init__(self, monitor: ESmartMonitor) -> None:
+        labels = dict(port=monitor.bus.path, device=str(monitor.device_addr))
+        self.reads = registry.counter("esmart_modbus_requests_total", "Modbus requests served", dict(labels, op="read"))
+        self.writes = registry.counter("esmart_modbus_requests_total", "Modbus requests served", dict(labels, op="write"))
+        self.rejected = registry.counter("esmart_modbus_rejected_requests_total", "Modbus requests for unknown or stale registers", labels)
+
+
+def diagnostic_words(monitor: ESmartMonitor, metrics: ModbusMetrics) -> List[int]:
+    words: List[int] = []
+
+    def u16(value: float) -> None:
+        words.append(max(0, min(0xffff, int(value))))
+
+    def u32(value: int) -> None:
+        words.extend((value & 0xffff, (value >> 16) & 0xffff))
+
+    device_metrics = monitor.device_metrics
+    snapshot_age = monitor.snapshot_age()
+    u32(device_metrics.round_trip.count)
+    u32(device_metrics.read_timeouts.value)
+    u32(device_metrics.checksum_errors.value)
+    u32(device_metrics.protocol_errors.value)
+    u16(device_metrics.round_trip.last * 1000)
+    u16(monitor.cycle_time.last * 1000)
+    u16(0xffff if snapshot_age is None else snapshot_age * 10)
+    u16(monitor.bus.scheduler.queue_depth)
+    u16(monitor.queued_commands)
+    u32(metrics.reads.value + metrics.writes.value)
+    u16(len(monitor.snapshot.unconfirmed))
+    return words
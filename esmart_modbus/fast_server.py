@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import struct
+from typing import Dict, List, Tuple, Optional, Sequence, Union, Awaitable, Set, Any
+
+from esmart_device.registers import ModbusRegisterType, ESmartRegister, DataType, esmart_registers
+from esmart_modbus.diagnostics import ModbusMetrics, diagnostic_words, DiagnosticRegistersBase, DiagnosticRegistersCount
+from esmart_modbus.gateway_config import GatewayConfig
+from esmart_monitor.async_monitor import AsyncESmartBus, create_bus
+from esmart_monitor.monitor import ESmartMonitor, ESmartBus, Command, RequestFuture, QueueFullException, WriteTimeoutException, RefreshTimeout, WriteTimeout
+
+DEFAULT_MAX_CONNECTIONS = 64
+MaxPduLength = 253
+WriteBufferLimit = 64 * 1024
+
+ReadCoils = 1
+ReadHoldingRegisters = 3
+ReadInputRegisters = 4
+WriteSingleCoil = 5
+WriteSingleRegister = 6
+WriteMultipleRegisters = 16
+
+IllegalFunction = 0x01
+IllegalAddress = 0x02
+IllegalValue = 0x03
+SlaveFailure = 0x04
+SlaveBusy = 0x06
+GatewayNoResponse = 0x0b
+
+read_types = {
+    ReadCoils: ModbusRegisterType.Coil,
+    ReadHoldingRegisters: ModbusRegisterType.HoldingRegister,
+    ReadInputRegisters: ModbusRegisterType.InputRegister,
+}
+max_read_counts = {ReadCoils: 2000, ReadHoldingRegisters: 125, ReadInputRegisters: 125}
+
+mbap_struct = struct.Struct(">HHHB")
+address_struct = struct.Struct(">HH")
+
+registers_by_type = {reg_type: {x.modbus_address: x for x in esmart_registers if x.modbus_type == reg_type} for reg_type in ModbusRegisterType}
+word_registers_by_type = {reg_type: {x.modbus_address + i: x for x in registers.values() for i in range(x.data_size_words)}
+                          for reg_type, registers in registers_by_type.items()}
+
+Response = Union[bytes, Awaitable[bytes]]
+
+
+def exception_response(function_code: int, code: int) -> bytes:
+    return bytes((function_code | 0x80, code))
+
+
+def pack_bits(words: Sequence[int]) -> bytes:
+    data = bytearray((len(words) + 7) // 8)
+    for i, word in enumerate(words):
+        if word:
+            data[i // 8] |= 1 << (i % 8)
+    return bytes(data)
+
+
+class FastModbusServer:
+    def __init__(self, units: Dict[int, ESmartMonitor], *, single: bool = False,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, max_age: Optional[float] = None,
+                 unit_max_ages: Optional[Dict[int, Optional[float]]] = None) -> None:
+        self.units = units
+        self.single = single
+        self.max_connections = max_connections
+        self.connections = 0
+        self._targets = {unit_id: (mon, ModbusMetrics(mon), (unit_max_ages or {}).get(unit_id, max_age)) for unit_id, mon in units.items()}
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        if self.connections >= self.max_connections:
+            logging.warning(f"Rejecting Modbus connection from {peer}, {self.connections} connections open")
+            writer.close()
+            return
+
+        self.connections += 1
+        pending: Set['asyncio.Task[None]'] = set()
+        try:
+            while True:
+                transaction_id, protocol_id, length, unit_id = mbap_struct.unpack(await reader.readexactly(mbap_struct.size))
+                if length < 2 or length > MaxPduLength + 1:
+                    logging.warning(f"Closing Modbus connection from {peer}, invalid frame length {length}")
+                    break
+                pdu = await reader.readexactly(length - 1)
+                if protocol_id != 0:
+                    continue
+
+                response = self.execute(unit_id, pdu)
+                if isinstance(response, bytes):
+                    self._send(writer, transaction_id, unit_id, response)
+                else:
+                    task = asyncio.ensure_future(self._send_later(writer, transaction_id, unit_id, response))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+
+                if writer.transport.get_write_buffer_size() > WriteBufferLimit:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            for pending_task in pending:
+                pending_task.cancel()
+            writer.close()
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, transaction_id: int, unit_id: int, pdu: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(mbap_struct.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+
+    async def _send_later(self, writer: asyncio.StreamWriter, transaction_id: int, unit_id: int, response: Awaitable[bytes]) -> None:
+        self._send(writer, transaction_id, unit_id, await response)
+
+    def execute(self, unit_id: int, pdu: bytes) -> Response:
+        function_code = pdu[0]
+        target = self._targets.get(next(iter(self._targets)) if self.single else unit_id)
+        if target is None:
+            return exception_response(function_code, GatewayNoResponse)
+        mon, metrics, max_age = target
+
+        if function_code in read_types:
+            if len(pdu) != 5:
+                return exception_response(function_code, IllegalValue)
+            address, count = address_struct.unpack_from(pdu, 1)
+            if not 1 <= count <= max_read_counts[function_code]:
+                return exception_response(function_code, IllegalValue)
+
+            refresh = None if max_age is None else self._refresh_for(mon, read_types[function_code], address, count, max_age)
+            if refresh is not None:
+                return self._read_after(refresh, mon, metrics, function_code, address, count)
+            return self._read(mon, metrics, function_code, address, count)
+
+        if function_code in (WriteSingleCoil, WriteSingleRegister):
+            if len(pdu) != 5:
+                return exception_response(function_code, IllegalValue)
+            address, value = address_struct.unpack_from(pdu, 1)
+            if function_code == WriteSingleCoil:
+                if value not in (0x0000, 0xff00):
+                    return exception_response(function_code, IllegalValue)
+                return self._write(mon, metrics, function_code, ModbusRegisterType.Coil, address, [int(value != 0)], pdu)
+            return self._write(mon, metrics, function_code, ModbusRegisterType.HoldingRegister, address, [value], pdu)
+
+        if function_code == WriteMultipleRegisters:
+            if len(pdu) < 6:
+                return exception_response(function_code, IllegalValue)
+            address, count = address_struct.unpack_from(pdu, 1)
+            if not 1 <= count <= 123 or pdu[5] != count * 2 or len(pdu) != 6 + count * 2:
+                return exception_response(function_code, IllegalValue)
+            values = list(struct.unpack_from(f">{count}H", pdu, 6))
+            return self._write(mon, metrics, function_code, ModbusRegisterType.HoldingRegister, address, values, pdu[:5])
+
+        return exception_response(function_code, IllegalFunction)
+
+    @staticmethod
+    def _refresh_for(mon: ESmartMonitor, reg_type: ModbusRegisterType, address: int, count: int, max_age: float) -> Optional[RequestFuture]:
+        word_registers = word_registers_by_type[reg_type]
+        registers = [word_registers[x] for x in range(address, address + count) if x in word_registers]
+        future = mon.refresh_async(registers, max_age=max_age)
+        if future.done() and future.exception() is None:
+            return None
+        return future
+
+    async def _read_after(self, refresh: RequestFuture, mon: ESmartMonitor, metrics: ModbusMetrics,
+                          function_code: int, address: int, count: int) -> bytes:
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(refresh)), RefreshTimeout.total_seconds())
+        except Exception as e:
+            logging.warning(f"Refresh for unit {mon.device_addr} failed: {type(e).__name__}")
+        return self._read(mon, metrics, function_code, address, count)
+
+    def _read(self, mon: ESmartMonitor, metrics: ModbusMetrics, function_code: int, address: int, count: int) -> bytes:
+        metrics.reads.inc()
+
+        if function_code == ReadInputRegisters and address >= DiagnosticRegistersBase:
+            if address + count > DiagnosticRegistersBase + DiagnosticRegistersCount:
+                metrics.rejected.inc()
+                return exception_response(function_code, IllegalAddress)
+            offset = address - DiagnosticRegistersBase
+            words = diagnostic_words(mon, metrics)[offset:offset + count]
+            return bytes((function_code, count * 2)) + struct.pack(f">{count}H", *words)
+
+        image = mon.get_register_image(read_types[function_code])
+        if image is None or not image.is_valid(address, count):
+            metrics.rejected.inc()
+            return exception_response(function_code, IllegalAddress)
+
+        if function_code == ReadCoils:
+            bits = pack_bits(image.words[address:address + count])
+            return bytes((function_code, len(bits))) + bits
+        return bytes((function_code, count * 2)) + image.get_wire_bytes(address, count)
+
+    def _write(self, mon: ESmartMonitor, metrics: ModbusMetrics, function_code: int, reg_type: ModbusRegisterType,
+               address: int, values: List[int], response: bytes) -> Response:
+        image = mon.get_register_image(reg_type)
+        registers = registers_by_type[reg_type]
+        writes: List[Tuple[ESmartRegister, int]] = []
+        for i, value in enumerate(values):
+            reg = registers.get(address + i)
+            if reg is None or reg.data_type != DataType.UInt16:
+                break
+            writes.append((reg, reg.to_esmart_word(value)))
+
+        if image is None or not image.is_valid(address, len(values)) or len(writes) != len(values):
+            metrics.rejected.inc()
+            return exception_response(function_code, IllegalAddress)
+
+        metrics.writes.inc()
+        return self._await_write(mon.submit_write(writes), function_code, response)
+
+    @staticmethod
+    async def _await_write(cmd: Command, function_code: int, response: bytes) -> bytes:
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(cmd.future)), WriteTimeout.total_seconds())
+        except (QueueFullException, WriteTimeoutException):
+            return exception_response(function_code, SlaveBusy)
+        except asyncio.TimeoutError:
+            return exception_response(function_code, SlaveBusy if cmd.cancel_or_expire() else SlaveFailure)
+        except Exception:
+            return exception_response(function_code, SlaveFailure)
+        return response
+
+
+async def serve_async(buses: Sequence[ESmartBus], servers: Sequence[Tuple[FastModbusServer, str, int]]) -> None:
+    tasks = [asyncio.ensure_future(bus.run_async()) for bus in buses if isinstance(bus, AsyncESmartBus)]
+    for server, modbus_host, modbus_port in servers:
+        await server.start(modbus_host, modbus_port)
+        logging.info(f"Serving {len(server.units)} units on {modbus_host}:{modbus_port}")
+    await asyncio.gather(*tasks, asyncio.Event().wait())
+
+
+def run_fast_server(esmart_serial_port_path: str, device_addrs: Sequence[int], modbus_host: str, modbus_port: int, *,
+                    use_asyncio: bool = False, max_age: Optional[float] = None, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                    **monitor_kwargs: Any) -> None:
+    bus, monitors = create_bus(esmart_serial_port_path, device_addrs, use_asyncio=use_asyncio, **monitor_kwargs)
+    server = FastModbusServer({mon.device_addr: mon for mon in monitors}, single=len(monitors) == 1,
+                              max_connections=max_connections, max_age=max_age)
+    asyncio.run(serve_async([bus], [(server, modbus_host, modbus_port)]))
+
+
+def run_fast_gateway(config: GatewayConfig, *, use_asyncio: bool = False, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> None:
+    buses: List[ESmartBus] = []
+    servers: List[Tuple[FastModbusServer, str, int]] = []
+    for (modbus_host, modbus_port), bus_configs in config.listeners().items():
+        units: Dict[int, ESmartMonitor] = {}
+        max_ages: Dict[int, Optional[float]] = {}
+        for bus_config in bus_configs:
+            bus, monitors = create_bus(bus_config.esmart_port, [x.device_addr for x in bus_config.devices], use_asyncio=use_asyncio,
+                                       min_frame_gap=bus_config.min_frame_gap, **bus_config.monitor_kwargs())
+            buses.append(bus)
+            for device, mon in zip(bus_config.devices, monitors):
+                units[device.unit_id] = mon
+                max_ages[device.unit_id] = device.max_age
+        servers.append((FastModbusServer(units, max_connections=max_connections, unit_max_ages=max_ages), modbus_host, modbus_port))
+
+    asyncio.run(serve_async(buses, servers))
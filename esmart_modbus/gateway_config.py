@@ -0,0 +1,183 @@
+import json
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Tuple, Optional, Callable, TypeVar, Collection
+
+from esmart_device.pacing import DEFAULT_MIN_FRAME_GAP
+from esmart_device.poll_plan import DEFAULT_MAX_GAP_WORDS, DEFAULT_MAX_FRAME_LENGTH
+from esmart_monitor.monitor import FastPollInterval, SlowPollInterval, PerDevicePathOptions, format_path
+
+
+T = TypeVar("T")
+
+
+class GatewayConfigException(Exception):
+    pass
+
+
+@dataclass
+class DeviceConfig:
+    device_addr: int
+    unit_id: int
+    max_age: Optional[float] = None
+
+
+@dataclass
+class BusConfig:
+    esmart_port: str
+    devices: List[DeviceConfig]
+    modbus_host: str
+    modbus_port: int
+    max_read_gap: int = DEFAULT_MAX_GAP_WORDS
+    max_read_length: int = DEFAULT_MAX_FRAME_LENGTH
+    min_frame_gap: float = DEFAULT_MIN_FRAME_GAP
+    fast_poll_interval: float = FastPollInterval.total_seconds()
+    slow_poll_interval: float = SlowPollInterval.total_seconds()
+    snapshot_path: Optional[str] = None
+    state_path: Optional[str] = None
+    recorder_path: Optional[str] = None
+    record_interval: float = 0.0
+    capture_path: Optional[str] = None
+
+    @property
+    def listener(self) -> Tuple[str, int]:
+        return self.modbus_host, self.modbus_port
+
+    def monitor_kwargs(self) -> Dict[str, Any]:
+        return dict(max_gap_words=self.max_read_gap, max_frame_length=self.max_read_length,
+                    fast_poll_interval=self.fast_poll_interval, slow_poll_interval=self.slow_poll_interval,
+                    snapshot_path=self.snapshot_path, state_path=self.state_path,
+                    recorder_path=self.recorder_path, record_interval=self.record_interval, capture_path=self.capture_path)
+
+
+@dataclass
+class GatewayConfig:
+    buses: List[BusConfig] = field(default_factory=list)
+
+    def listeners(self) -> Dict[Tuple[str, int], List[BusConfig]]:
+        listeners: Dict[Tuple[str, int], List[BusConfig]] = {}
+        for bus in self.buses:
+            listeners.setdefault(bus.listener, []).append(bus)
+        return listeners
+
+
+bus_options = {
+    "max_read_gap": int,
+    "max_read_length": int,
+    "min_frame_gap": float,
+    "fast_poll_interval": float,
+    "slow_poll_interval": float,
+    "snapshot_path": str,
+    "state_path": str,
+    "recorder_path": str,
+    "record_interval": float,
+    "capture_path": str,
+}
+
+
+device_options = ("device_addr", "unit_id", "max_age")
+bus_keys = ("esmart_port", "devices", "modbus_host", "modbus_port", *bus_options)
+
+
+def check_keys(path: str, data: Any, allowed: Collection[str]) -> Dict[str, Any]:
+    if not isinstance(data, dict):
+        raise GatewayConfigException(f"{path}: expected an object, got {data!r}")
+    unknown = sorted(set(data) - set(allowed))
+    if len(unknown) > 0:
+        raise GatewayConfigException(f"{path}: unknown option {', '.join(unknown)}")
+    return data
+
+
+def convert(path: str, value: Any, conv: Callable[[Any], T]) -> T:
+    try:
+        return conv(value)
+    except (TypeError, ValueError):
+        raise GatewayConfigException(f"{path}: invalid value {value!r}")
+
+
+def parse_device_config(data: Any, path: str) -> DeviceConfig:
+    if isinstance(data, int):
+        return DeviceConfig(device_addr=data, unit_id=data)
+    data = check_keys(path, data, device_options)
+    if "device_addr" not in data:
+        raise GatewayConfigException(f"{path}: missing option device_addr")
+    device_addr = convert(f"{path}.device_addr", data["device_addr"], int)
+    max_age = data.get("max_age")
+    return DeviceConfig(device_addr=device_addr, unit_id=convert(f"{path}.unit_id", data.get("unit_id", device_addr), int),
+                        max_age=None if max_age is None else convert(f"{path}.max_age", max_age, float))
+
+
+def parse_bus_config(data: Any, defaults: Dict[str, Any], path: str) -> BusConfig:
+    data = {**defaults, **check_keys(path, data, bus_keys)}
+    for name in ("esmart_port", "devices", "modbus_host", "modbus_port"):
+        if name not in data:
+            raise GatewayConfigException(f"{path}: missing option {name}")
+    if not isinstance(data["devices"], list):
+        raise GatewayConfigException(f"{path}.devices: expected a list, got {data['devices']!r}")
+
+    return BusConfig(esmart_port=convert(f"{path}.esmart_port", data["esmart_port"], str),
+                     devices=[parse_device_config(x, f"{path}.devices[{i}]") for i, x in enumerate(data["devices"])],
+                     modbus_host=convert(f"{path}.modbus_host", data["modbus_host"], str),
+                     modbus_port=convert(f"{path}.modbus_port", data["modbus_port"], int),
+                     **{name: convert(f"{path}.{name}", data[name], conv) for name, conv in bus_options.items() if name in data})
+
+
+def check_unique_paths(config: GatewayConfig) -> None:
+    for option in PerDevicePathOptions:
+        owners: Dict[str, str] = {}
+        for bus in config.buses:
+            template = getattr(bus, option)
+            if template is None:
+                continue
+            for device in bus.devices:
+                owner = f"{bus.esmart_port} device {device.device_addr}"
+                try:
+                    path = format_path(template, port=bus.esmart_port, device_addr=device.device_addr)
+                except (KeyError, ValueError) as e:
+                    raise GatewayConfigException(f"{option} {template}: invalid placeholder {e}")
+                if path in owners:
+                    raise GatewayConfigException(f"{option} {path} used by both {owners[path]} and {owner}, add {{port}} or {{device_addr}}")
+                owners[path] = owner
+
+    captures: Dict[str, str] = {}
+    for bus in config.buses:
+        if bus.capture_path is None:
+            continue
+        try:
+            path = format_path(bus.capture_path, port=bus.esmart_port)
+        except (KeyError, ValueError) as e:
+            raise GatewayConfigException(f"capture_path {bus.capture_path}: invalid placeholder {e}")
+        if path in captures:
+            raise GatewayConfigException(f"capture_path {path} used by both {captures[path]} and {bus.esmart_port}, add {{port}}")
+        captures[path] = bus.esmart_port
+
+
+def parse_gateway_config(data: Any) -> GatewayConfig:
+    data = check_keys("config", data, (*bus_keys, "buses"))
+    defaults = {k: v for k, v in data.items() if k != "buses"}
+    buses = data.get("buses", [])
+    if not isinstance(buses, list):
+        raise GatewayConfigException(f"buses: expected a list, got {buses!r}")
+    config = GatewayConfig(buses=[parse_bus_config(x, defaults, f"buses[{i}]") for i, x in enumerate(buses)])
+
+    if len(config.buses) == 0:
+        raise GatewayConfigException("no buses configured")
+
+    esmart_ports = [x.esmart_port for x in config.buses]
+    for esmart_port in set(esmart_ports):
+        if esmart_ports.count(esmart_port) > 1:
+            raise GatewayConfigException(f"serial port {esmart_port} configured more than once")
+
+    for (host, port), buses in config.listeners().items():
+        unit_ids = [x.unit_id for bus in buses for x in bus.devices]
+        for unit_id in set(unit_ids):
+            if unit_ids.count(unit_id) > 1:
+                raise GatewayConfigException(f"unit ID {unit_id} used more than once on {host}:{port}")
+
+    check_unique_paths(config)
+
+    return config
+
+
+def load_gateway_config(path: str) -> GatewayConfig:
+    with open(path) as f:
+        return parse_gateway_config(json.load(f))
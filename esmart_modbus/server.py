@@ -1,83 +1,268 @@
-import threading
+import asyncio
+import logging
 import traceback
-from typing import Dict, List, Tuple, Sequence, Any
+from typing import List, Any, Sequence, Dict, Optional, Set
 
 from pymodbus.datastore.store import BaseModbusDataBlock
-from pymodbus.server.asynchronous import StartTcpServer
+from pymodbus.server.asynchronous import ModbusTcpProtocol, ModbusServerFactory
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.exceptions import NoSuchSlaveException
+from pymodbus.pdu import ExceptionResponse, ModbusExceptions
+from twisted.internet import defer
+from twisted.internet import reactor as twisted_reactor
+from twisted.python.failure import Failure
 
-from esmart_monitor.monitor import ESmartMonitor
+from esmart_modbus.diagnostics import ModbusMetrics, diagnostic_words, DiagnosticRegistersBase, DiagnosticRegistersCount
+from esmart_modbus.gateway_config import GatewayConfig
+from esmart_monitor.async_monitor import AsyncESmartBus, create_bus
+from esmart_monitor.monitor import ESmartMonitor, Command, RequestFuture, QueueFullException, WriteTimeoutException, RefreshTimeout, WriteTimeout
 from esmart_device.registers import ModbusRegisterType, ESmartRegister, DataType, esmart_registers
 
+reactor: Any = twisted_reactor
 
-def create_registers(registers: Sequence[Tuple[ESmartRegister, Any]]) -> Dict[int, int]:
-    modbus_values = {}
+RefreshFunctionCodes = (1, 3, 4)
 
-    for reg, value in registers:
-        address = reg.modbus_address
-        value_registers = reg.to_modbus_regs(value)
+bus_tasks: Set['asyncio.Task[None]'] = set()
 
-        for i, value_register in enumerate(value_registers):
-            modbus_values[address + i] = value_register
 
-    return modbus_values
+class PendingWrites:
+    def __init__(self) -> None:
+        self._commands: List[Command] = []
+
+    def add(self, cmd: Command) -> None:
+        self._commands.append(cmd)
+
+    def take(self) -> List[Command]:
+        commands, self._commands = self._commands, []
+        return commands
+
+
+def future_to_deferred(future: RequestFuture) -> 'defer.Deferred[None]':
+    d: defer.Deferred[None] = defer.Deferred()
+
+    def on_done(f: RequestFuture) -> None:
+        if f.cancelled():
+            return
+        if f.exception() is None:
+            reactor.callFromThread(d.callback, None)
+        else:
+            reactor.callFromThread(d.errback, f.exception())
+
+    future.add_done_callback(on_done)
+    return d
+
+
+def write_to_deferred(cmd: Command) -> 'defer.Deferred[None]':
+    def on_timeout(result: Any, timeout: float) -> None:
+        if cmd.cancel_or_expire():
+            raise WriteTimeoutException()
+        raise defer.TimeoutError(timeout)
+
+    d = future_to_deferred(cmd.future)
+    d.addTimeout(WriteTimeout.total_seconds(), reactor, onTimeoutCancel=on_timeout)
+    return d
 
 
 class RegistersBlock(BaseModbusDataBlock):
-    def __init__(self, monitor: ESmartMonitor, reg_type: ModbusRegisterType) -> None:
+    def __init__(self, monitor: ESmartMonitor, reg_type: ModbusRegisterType, pending_writes: PendingWrites, *,
+                 max_age: Optional[float] = None) -> None:
         super().__init__()
         self.monitor = monitor
         self.reg_type = reg_type
+        self.pending_writes = pending_writes
+        self.max_age = max_age
+        self.registers = {x.modbus_address: x for x in esmart_registers if x.modbus_type == reg_type}
+        self.word_registers = {x.modbus_address + i: x for x in self.registers.values() for i in range(x.data_size_words)}
+        self.metrics = ModbusMetrics(monitor)
+
+    def _is_diagnostic(self, address: int) -> bool:
+        return self.reg_type == ModbusRegisterType.InputRegister and address >= DiagnosticRegistersBase
+
+    def refresh_async(self, address: int, count: int) -> Optional[RequestFuture]:
+        if self.max_age is None:
+            return None
+
+        registers = [self.word_registers[x] for x in range(address, address + count) if x in self.word_registers]
+        future = self.monitor.refresh_async(registers, max_age=self.max_age)
+        if future.done() and future.exception() is None:
+            return None
+        return future
 
     def setValues(self, address: int, values: List[int]) -> None:
         assert self.reg_type in (ModbusRegisterType.Coil, ModbusRegisterType.HoldingRegister)
 
-        modbus_reg: ESmartRegister = [x for x in esmart_registers if x.modbus_address == address and x.modbus_type == self.reg_type][0]
+        writes = []
+        for i, value in enumerate(values):
+            modbus_reg: ESmartRegister = self.registers[address + i]
 
-        assert modbus_reg.data_type in (DataType.UInt16,)
+            assert modbus_reg.data_type in (DataType.UInt16,)
 
-        value = values[0]
-        self.monitor.set_word(data_item=modbus_reg.data_item, data_offset=modbus_reg.esmart_address, value=modbus_reg.to_esmart_word(value))
+            writes.append((modbus_reg, modbus_reg.to_esmart_word(value)))
+
+        self.metrics.writes.inc()
+        self.pending_writes.add(self.monitor.submit_write(writes))
 
     def validate(self, address: int, count: int = 1) -> bool:
         try:
-            values = self.monitor.get_values()
-
-            if values is None:
-                return False
+            if self._is_diagnostic(address):
+                valid = address + count <= DiagnosticRegistersBase + DiagnosticRegistersCount
+            else:
+                image = self.monitor.get_register_image(self.reg_type)
+                valid = image is not None and image.is_valid(address, count)
 
-            modbus_values = create_registers([(x[0], x[1]) for x in values if x[0].modbus_type == self.reg_type])
-            return all(i in modbus_values for i in range(address, address + count))
+            if not valid:
+                self.metrics.rejected.inc()
+            return valid
         except:
             traceback.print_exc()
             raise
 
     def getValues(self, address: int, count: int = 1) -> List[int]:
         try:
-            values = self.monitor.get_values()
+            self.metrics.reads.inc()
+
+            if self._is_diagnostic(address):
+                offset = address - DiagnosticRegistersBase
+                return diagnostic_words(self.monitor, self.metrics)[offset:offset + count]
 
-            if values is None:
+            image = self.monitor.get_register_image(self.reg_type)
+
+            if image is None:
                 raise Exception("invalid state")
 
-            modbus_values = create_registers([(x[0], x[1]) for x in values if x[0].modbus_type == self.reg_type])
-            return [modbus_values[i] for i in range(address, address + count)]
+            return image.get_words(address, count)
         except:
             traceback.print_exc()
             raise
 
 
-def run_server(esmart_serial_port_path: str, device_addr: int, modbus_host: str, modbus_port: int) -> None:
-    mon = ESmartMonitor(esmart_serial_port_path, device_addr)
+class ESmartTcpProtocol(ModbusTcpProtocol):
+    factory: 'ESmartServerFactory'
+
+    _request: Any = None
+
+    def _execute(self, request: Any) -> None:
+        refresh = self._refresh_for(request)
+        if refresh is None:
+            self._execute_now(request)
+            return
+
+        def on_refreshed(result: Any) -> None:
+            if isinstance(result, Failure):
+                logging.warning(f"Refresh for unit {request.unit_id} failed: {type(result.value).__name__}")
+            self._execute_now(request)
+
+        d = future_to_deferred(refresh)
+        d.addTimeout(RefreshTimeout.total_seconds(), reactor)
+        d.addBoth(on_refreshed)
+
+    def _execute_now(self, request: Any) -> None:
+        self._request = request
+        super()._execute(request)
+
+    def _refresh_for(self, request: Any) -> Optional[RequestFuture]:
+        if request.function_code not in RefreshFunctionCodes:
+            return None
+
+        try:
+            context = self.factory.store[request.unit_id]
+        except NoSuchSlaveException:
+            return None
 
-    th = threading.Thread(target=mon.run)
-    th.daemon = True
-    th.start()
+        block = context.store[context.decode(request.function_code)]
+        if not isinstance(block, RegistersBlock):
+            return None
+        return block.refresh_async(request.address, request.count)
 
-    ir_block = RegistersBlock(mon, ModbusRegisterType.InputRegister)
-    co_block = RegistersBlock(mon, ModbusRegisterType.Coil)
-    hr_block = RegistersBlock(mon, ModbusRegisterType.HoldingRegister)
+    def _send(self, message: Any) -> Any:
+        writes = self.factory.pending_writes.take()
+        if len(writes) == 0:
+            return super()._send(message)
+
+        request = self._request
+        if hasattr(message, "value") and hasattr(request, "value"):
+            message.value = request.value
+
+        def on_written(_: Any) -> None:
+            super(ESmartTcpProtocol, self)._send(message)
+
+        def on_failed(failure: Failure) -> None:
+            error = failure.value.subFailure.value if isinstance(failure.value, defer.FirstError) else failure.value
+            code = ModbusExceptions.SlaveBusy if isinstance(error, (QueueFullException, WriteTimeoutException)) else ModbusExceptions.SlaveFailure
+            response = ExceptionResponse(message.function_code, code)
+            response.transaction_id = message.transaction_id
+            response.unit_id = message.unit_id
+            super(ESmartTcpProtocol, self)._send(response)
+
+        d = defer.gatherResults([write_to_deferred(x) for x in writes], consumeErrors=True)
+        d.addCallbacks(on_written, on_failed)
+        return None
+
+
+class ESmartServerFactory(ModbusServerFactory):
+    protocol = ESmartTcpProtocol
+
+    def __init__(self, store: ModbusServerContext, pending_writes: PendingWrites) -> None:
+        super().__init__(store)
+        self.pending_writes = pending_writes
+
+
+def create_slave_context(mon: ESmartMonitor, pending_writes: PendingWrites, *, max_age: Optional[float] = None) -> ModbusSlaveContext:
+    ir_block = RegistersBlock(mon, ModbusRegisterType.InputRegister, pending_writes, max_age=max_age)
+    co_block = RegistersBlock(mon, ModbusRegisterType.Coil, pending_writes, max_age=max_age)
+    hr_block = RegistersBlock(mon, ModbusRegisterType.HoldingRegister, pending_writes, max_age=max_age)
     empty = BaseModbusDataBlock()
-    store = ModbusSlaveContext(di=empty, co=co_block, hr=hr_block, ir=ir_block, zero_mode=True)
-    context = ModbusServerContext(slaves=store, single=True)
+    return ModbusSlaveContext(di=empty, co=co_block, hr=hr_block, ir=ir_block, zero_mode=True)
+
+
+def on_bus_task_done(task: 'asyncio.Task[None]') -> None:
+    bus_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Bus task failed", exc_info=task.exception())
+
+
+def start_bus_task(bus: AsyncESmartBus) -> None:
+    task = asyncio.ensure_future(bus.run_async())
+    bus_tasks.add(task)
+    task.add_done_callback(on_bus_task_done)
+
+
+def start_bus(esmart_serial_port_path: str, device_addrs: Sequence[int], *, use_asyncio: bool = False, **monitor_kwargs: Any) -> List[ESmartMonitor]:
+    bus, monitors = create_bus(esmart_serial_port_path, device_addrs, use_asyncio=use_asyncio, **monitor_kwargs)
+    if isinstance(bus, AsyncESmartBus):
+        reactor.callWhenRunning(start_bus_task, bus)
+    return monitors
+
+
+def run_server(esmart_serial_port_path: str, device_addrs: Sequence[int], modbus_host: str, modbus_port: int, *,
+               use_asyncio: bool = False, max_age: Optional[float] = None, **monitor_kwargs: Any) -> None:
+    monitors = start_bus(esmart_serial_port_path, device_addrs, use_asyncio=use_asyncio, **monitor_kwargs)
+    listen_server(monitors, modbus_host, modbus_port, max_age=max_age)
+    reactor.run()
+
+
+def listen_server(monitors: Sequence[ESmartMonitor], modbus_host: str, modbus_port: int, *, max_age: Optional[float] = None) -> None:
+    pending_writes = PendingWrites()
+    if len(monitors) == 1:
+        context = ModbusServerContext(slaves=create_slave_context(monitors[0], pending_writes, max_age=max_age), single=True)
+    else:
+        context = ModbusServerContext(slaves={mon.device_addr: create_slave_context(mon, pending_writes, max_age=max_age) for mon in monitors}, single=False)
+
+    reactor.listenTCP(modbus_port, ESmartServerFactory(context, pending_writes), interface=modbus_host)
+
+
+def run_gateway(config: GatewayConfig, *, use_asyncio: bool = False) -> None:
+    for (modbus_host, modbus_port), buses in config.listeners().items():
+        pending_writes = PendingWrites()
+        slaves: Dict[int, ModbusSlaveContext] = {}
+        for bus in buses:
+            monitors = start_bus(bus.esmart_port, [x.device_addr for x in bus.devices], use_asyncio=use_asyncio,
+                                 min_frame_gap=bus.min_frame_gap, **bus.monitor_kwargs())
+            for device, mon in zip(bus.devices, monitors):
+                slaves[device.unit_id] = create_slave_context(mon, pending_writes, max_age=device.max_age)
+                logging.info(f"Serving {bus.esmart_port} device {device.device_addr} as unit {device.unit_id} on {modbus_host}:{modbus_port}")
+
+        context = ModbusServerContext(slaves=slaves, single=False)
+        reactor.listenTCP(modbus_port, ESmartServerFactory(context, pending_writes), interface=modbus_host)
 
-    StartTcpServer(context, address=(modbus_host, modbus_port))
+    reactor.run()
@@ -1,13 +1,30 @@
 import argparse
 import logging
 
-from esmart_monitor.monitor import ESmartMonitor
+from esmart_device.metrics import start_metrics_server
+from esmart_device.pacing import DEFAULT_MIN_FRAME_GAP
+from esmart_device.poll_plan import DEFAULT_MAX_GAP_WORDS, DEFAULT_MAX_FRAME_LENGTH
+from esmart_monitor.async_monitor import AsyncESmartMonitor
+from esmart_monitor.monitor import ESmartMonitor, FastPollInterval, SlowPollInterval, exit_on_sigterm
 
 
 def main() -> None:
     argparser = argparse.ArgumentParser()
     argparser.add_argument("--port", type=str, required=True)
     argparser.add_argument("--device-addr", type=int, required=True)
+    argparser.add_argument("--max-read-gap", type=int, default=DEFAULT_MAX_GAP_WORDS)
+    argparser.add_argument("--max-read-length", type=int, default=DEFAULT_MAX_FRAME_LENGTH)
+    argparser.add_argument("--min-frame-gap", type=float, default=DEFAULT_MIN_FRAME_GAP)
+    argparser.add_argument("--fast-poll-interval", type=float, default=FastPollInterval.total_seconds())
+    argparser.add_argument("--slow-poll-interval", type=float, default=SlowPollInterval.total_seconds())
+    argparser.add_argument("--snapshot-path", type=str, help="shared snapshot file, may contain {device_addr} and {port}")
+    argparser.add_argument("--state-path", type=str, help="last-known state file for warm starts, may contain {device_addr} and {port}")
+    argparser.add_argument("--recorder-path", type=str, help="time-series directory, may contain {device_addr} and {port}")
+    argparser.add_argument("--record-interval", type=float, default=0.0, help="minimum seconds between recorded rows")
+    argparser.add_argument("--capture-path", type=str, help="record raw serial traffic for python -m esmart_monitor.replay, may contain {port}")
+    argparser.add_argument("--metrics-host", type=str, default="127.0.0.1")
+    argparser.add_argument("--metrics-port", type=int)
+    argparser.add_argument("--asyncio", action='store_true')
     argparser.add_argument('--debug', action='store_true')
 
     args = argparser.parse_args()
@@ -19,7 +36,16 @@ def main() -> None:
     else:
         log.setLevel(logging.INFO)
 
-    mon = ESmartMonitor(args.port, args.device_addr)
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_host, args.metrics_port)
+
+    monitor_class = AsyncESmartMonitor if args.asyncio else ESmartMonitor
+    mon = monitor_class(args.port, args.device_addr, max_gap_words=args.max_read_gap, max_frame_length=args.max_read_length,
+                        min_frame_gap=args.min_frame_gap,
+                        fast_poll_interval=args.fast_poll_interval, slow_poll_interval=args.slow_poll_interval,
+                        snapshot_path=args.snapshot_path, recorder_path=args.recorder_path, record_interval=args.record_interval,
+                        state_path=args.state_path, capture_path=args.capture_path)
+    exit_on_sigterm()
     mon.run()
 
 
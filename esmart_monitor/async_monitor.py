@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Optional, Any, Callable, List, Sequence, Tuple
+
+from esmart_device.async_device import AsyncESmartDevice, AsyncSerialPort
+from esmart_device.exceptions import ESmartException, ReadTimeoutException
+from esmart_device.pacing import DEFAULT_MIN_FRAME_GAP
+from esmart_monitor.monitor import ESmartBus, ESmartMonitor, DeviceSteps, UpdateInterval, RequestFuture
+
+
+class AsyncESmartBus(ESmartBus):
+    def __init__(self, path: str, **kwargs: Any) -> None:
+        super().__init__(path, **kwargs)
+        self._jobs_available = asyncio.Event()
+
+    def run(self) -> None:
+        asyncio.run(self.run_async())
+
+    async def run_async(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        def on_submit() -> None:
+            loop.call_soon_threadsafe(self._jobs_available.set)
+
+        self.scheduler.on_submit = on_submit
+
+        while True:
+            port = None
+            try:
+                logging.info("Creating new serial port connection")
+                port = AsyncSerialPort(self.path, self.capture)
+                for mon in self.async_monitors:
+                    mon._async_dev = AsyncESmartDevice(self.path, device_addr=mon.device_addr, pacing=self.pacing, port=port, metrics=mon.device_metrics)
+                    mon._async_dev.check_device_addr = len(self.monitors) > 1
+                while True:
+                    try:
+                        await self._execute_next_job_async()
+                    except ReadTimeoutException:
+                        logging.error("Read timeout exception")
+                    except ESmartException as e:
+                        logging.error(f"Protocol error: {type(e).__name__}")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(UpdateInterval.total_seconds())
+            finally:
+                for mon in self.async_monitors:
+                    mon._async_dev = None
+                if port is not None:
+                    port.close()
+
+    @property
+    def async_monitors(self) -> List['AsyncESmartMonitor']:
+        return [x for x in self.monitors if isinstance(x, AsyncESmartMonitor)]
+
+    async def _execute_next_job_async(self) -> None:
+        while True:
+            job = self.scheduler.pop_due_job()
+            if job is not None:
+                break
+
+            # a timer rather than wait_for, which drops a cancellation arriving together with the event and leaves the bus running
+            self._jobs_available.clear()
+            delay = self.scheduler.time_to_next_job()
+            timer = None if delay is None else asyncio.get_running_loop().call_later(delay, self._jobs_available.set)
+            try:
+                await self._jobs_available.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+        logging.debug(f"Dispatching [{job}], queue depth {self.scheduler.queue_depth}")
+        failed = True
+        try:
+            await job.action()
+            failed = False
+        finally:
+            self._rearm_job(job, failed)
+
+
+class AsyncESmartMonitor(ESmartMonitor):
+    bus_class = AsyncESmartBus
+
+    def __init__(self, path: str, device_addr: int, **kwargs: Any) -> None:
+        self._async_dev: Optional[AsyncESmartDevice] = None
+        super().__init__(path, device_addr, **kwargs)
+
+    def _action(self, steps: Callable[..., DeviceSteps], *args: Any) -> Callable[[], Any]:
+        return lambda: self._run_steps_async(steps(*args))
+
+    # requests, results and timers all live on the bus event loop, so the monitor must be called from that loop
+    def _create_future(self) -> RequestFuture:
+        return asyncio.get_running_loop().create_future()
+
+    def _call_later(self, delay: float, callback: Callable[[], None]) -> None:
+        asyncio.get_running_loop().call_later(delay, callback)
+
+    def _gather(self, futures: Sequence[RequestFuture]) -> RequestFuture:
+        if len(futures) == 1:
+            return futures[0]
+        return asyncio.gather(*(asyncio.wrap_future(x) for x in futures))
+
+    async def run_async(self) -> None:
+        assert isinstance(self._bus, AsyncESmartBus)
+        await self._bus.run_async()
+
+    async def _run_steps_async(self, steps: DeviceSteps) -> None:
+        if self._async_dev is None:
+            raise Exception("device not initialized")
+
+        try:
+            call = next(steps)
+            while True:
+                try:
+                    result = await call(self._async_dev)
+                except BaseException as e:
+                    call = steps.throw(e)
+                else:
+                    call = steps.send(result)
+        except StopIteration:
+            pass
+
+
+def create_bus(path: str, device_addrs: Sequence[int], *,
+               use_asyncio: bool = False, min_frame_gap: float = DEFAULT_MIN_FRAME_GAP, **monitor_kwargs: Any) -> Tuple[ESmartBus, List[ESmartMonitor]]:
+    # a thread bus starts polling right away, an asyncio bus is returned idle for the caller to run on its event loop
+    if use_asyncio:
+        async_bus, async_monitors = AsyncESmartMonitor.create_bus(path, device_addrs, min_frame_gap=min_frame_gap, **monitor_kwargs)
+        return async_bus, list(async_monitors)
+
+    bus, monitors = ESmartMonitor.create_bus(path, device_addrs, min_frame_gap=min_frame_gap, **monitor_kwargs)
+    th = threading.Thread(target=bus.run, name=f"esmart-bus {path}")
+    th.daemon = True
+    th.start()
+    return bus, monitors
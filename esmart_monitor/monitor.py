@@ -1,151 +1,781 @@
+import asyncio
+import atexit
+import concurrent.futures
 import datetime
 import enum
+import functools
+import heapq
+import itertools
 import logging
+import math
+import os
 import queue
-import struct
+import re
+import signal
 import threading
 import time
 import traceback
-import itertools
-from threading import Event
-from typing import Optional, Any, Tuple, cast, Dict, List
+import types
+from concurrent.futures import Future
+from typing import Optional, Any, Tuple, Dict, List, Sequence, Set, Callable, Iterable, Generator, Union
 
+from esmart_device.capture import CaptureWriter
 from esmart_device.device import ESmartSerialDevice
-from esmart_device.exceptions import ReadTimeoutException
-from esmart_device.registers import ESmartRegister, get_register, esmart_registers
+from esmart_device.metrics import DeviceMetrics, registry
+from esmart_device.exceptions import ESmartException, ChecksumException, ReadTimeoutException, CommandNotAcknowledgedException, InvalidCommandException
+from esmart_device.pacing import PacingController, DEFAULT_MIN_FRAME_GAP
+from esmart_device.poll_plan import PlannedRead, PlannedWrite, plan_reads, plan_writes, log_plan, estimate_cycle_time, DEFAULT_MAX_GAP_WORDS, DEFAULT_MAX_FRAME_LENGTH
+from esmart_device.registers import ESmartRegister, ModbusRegisterType, PollTier, get_register, esmart_registers
+from esmart_monitor.register_image import RegisterImage
+from esmart_monitor.snapshot import MonitorSnapshot
+from esmart_monitor.subscription import Subscription, Changes
+from esmart_monitor.recorder import TimeSeriesRecorder
+from esmart_monitor.shared_snapshot import SnapshotWriter
+from esmart_monitor.state_file import save_state, load_state
 
 
 class RequestFailedException(Exception):
     pass
 
 
+class QueueFullException(RequestFailedException):
+    pass
+
+
+class VerifyMismatchException(RequestFailedException):
+    pass
+
+
+class RefreshTimeoutException(RequestFailedException):
+    pass
+
+
+class WriteTimeoutException(RequestFailedException):
+    pass
+
+
 ValueHoldTime = datetime.timedelta(seconds=2)
 UpdateInterval = datetime.timedelta(seconds=1)
 StaleValueTime = datetime.timedelta(seconds=10)
+RefreshTimeout = StaleValueTime
+WriteTimeout = datetime.timedelta(seconds=5)
+FastPollInterval = datetime.timedelta(seconds=0)
+SlowPollInterval = datetime.timedelta(seconds=30)
+MaxQueuedCommands = 32
+WriteRetries = 5
+PriorityAgingTime = datetime.timedelta(seconds=1)
+StateSaveInterval = datetime.timedelta(seconds=60)
+# only applies to fast telemetry, older readings would be served as if they were live; settings and counters are restored at any age
+MaxStateAge = StaleValueTime * 3
 
+PerDevicePathOptions = ("snapshot_path", "state_path", "recorder_path")
+
+
+class JobPriority(enum.IntEnum):
+    Write = 0
+    Verify = 1
+    Refresh = 2
+    FastPoll = 3
+    SlowPoll = 4
 
-class Command:
-    def __init__(self, register: ESmartRegister, value: Any):
-        self.event = Event()
-        self.register = register
-        self.value = value
-        self.success = False
-        self.event = threading.Event()
+
+class Job:
+    def __init__(self, name: str, priority: JobPriority, action: Callable[[], Any], *,
+                 deadline: float = 0.0, interval: Optional[float] = None) -> None:
+        self.name = name
+        self.priority = priority
+        self.action = action
+        self.deadline = deadline
+        self.interval = interval
 
     def __str__(self) -> str:
-        return f"{self.register.name} -> {self.value}"
+        return f"{self.name} ({self.priority.name})"
 
 
-class ESmartMonitor:
-    def __init__(self, path: str, device_addr: int):
-        self._dev: Optional[ESmartSerialDevice] = None
-        self._path = path
-        self._device_addr = device_addr
-        self._state_last_update: Optional[datetime.datetime] = None
+class BusScheduler:
+    def __init__(self, aging_time: float = PriorityAgingTime.total_seconds()) -> None:
+        self._aging_time = aging_time
+        self._jobs: List[Tuple[float, int, int, Job]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self.dispatch_delays: Dict[JobPriority, float] = {}
+        self.on_submit: Optional[Callable[[], None]] = None
 
-        self._commands_queue: queue.Queue[Command] = queue.Queue()
+    @property
+    def queue_depth(self) -> int:
+        now = time.monotonic()
+        with self._cond:
+            return sum(1 for deadline, _, _, _ in self._jobs if deadline <= now)
 
-        self._values: List[Tuple[ESmartRegister, Any]] = []
+    def _effective_priority(self, job: Job, now: float) -> int:
+        if job.priority <= JobPriority.Refresh:
+            return job.priority
+        return max(int(JobPriority.Refresh) + 1, job.priority - int((now - job.deadline) / self._aging_time))
 
-        self._pending_updates: Dict[ESmartRegister, Tuple[float, int]] = {}
+    def submit(self, job: Job) -> None:
+        with self._cond:
+            heapq.heappush(self._jobs, (job.deadline, job.priority, next(self._counter), job))
+            self._cond.notify()
+        if self.on_submit is not None:
+            self.on_submit()
 
-        self._update_lock = threading.Lock()
+    def pop_due_job(self) -> Optional[Job]:
+        with self._cond:
+            now = time.monotonic()
+            due = [x for x in self._jobs if x[0] <= now]
+            if len(due) == 0:
+                return None
 
-    def _execute_commands(self) -> None:
-        while True:
-            try:
-                cmd = self._commands_queue.get_nowait()
-                self._execute_command_retry(cmd)
-            except queue.Empty:
-                break
+            entry = min(due, key=lambda x: (self._effective_priority(x[3], now), x[0], x[2]))
+            self._jobs.remove(entry)
+            heapq.heapify(self._jobs)
+            job = entry[3]
+            self.dispatch_delays[job.priority] = now - job.deadline
+            return job
 
-    def _execute_command_retry(self, cmd: Command) -> None:
-        if self._dev is None:
-            raise Exception("device not initialized")
+    def time_to_next_job(self) -> Optional[float]:
+        with self._cond:
+            if len(self._jobs) == 0:
+                return None
+            return max(0.0, self._jobs[0][0] - time.monotonic())
 
-        logging.info(f"Executing command [{cmd}]")
+    def next_job(self) -> Job:
+        with self._cond:
+            while True:
+                job = self.pop_due_job()
+                if job is not None:
+                    return job
+                self._cond.wait(self.time_to_next_job())
 
-        for i in range(5):
-            try:
-                self._dev.set_word(data_item=cmd.register.data_item, data_offset=cmd.register.esmart_address, value=cast(int, cmd.value))
-                cmd.success = True
-                cmd.event.set()
-                logging.info(f"Command [{cmd}] completed")
-                self._pending_updates[cmd.register] = (time.time() + ValueHoldTime.total_seconds(), cmd.value)
-                time.sleep(0.2)
+
+# the thread monitor hands results across threads, the asyncio monitor keeps them on its event loop
+RequestFuture = Union['Future[Any]', 'asyncio.Future[Any]']
+
+
+class Command:
+    def __init__(self, writes: Sequence[Tuple[ESmartRegister, int]], timeout: float = WriteTimeout.total_seconds(), *,
+                 future: Optional[RequestFuture] = None):
+        self.writes = list(writes)
+        self.future: RequestFuture = future or Future()
+        self.enqueued = time.monotonic()
+        self.expires = self.enqueued + timeout
+        self.started = False
+
+    def start(self) -> bool:
+        if isinstance(self.future, Future):
+            self.started = self.future.set_running_or_notify_cancel()
+        else:
+            # asyncio futures have no running state, without the flag a late cancel would succeed on a write already sent
+            self.started = not self.future.cancelled()
+        return self.started
+
+    def expire(self, now: float) -> bool:
+        if self.future.cancelled():
+            return True
+        if now < self.expires:
+            return False
+        # the client has given up on this write, applying it later would surprise it
+        logging.warning(f"Command [{self}] dropped after {(now - self.enqueued) * 1000:.0f} ms in queue")
+        if self.start():
+            self.future.set_exception(WriteTimeoutException())
+        return True
+
+    def cancel_or_expire(self) -> bool:
+        # a write still queued is dropped, one already on the bus runs to completion
+        return not self.started and self.future.cancel()
+
+    def __str__(self) -> str:
+        return ", ".join(f"{reg.name.strip()} -> {value}" for reg, value in self.writes)
+
+
+# a device operation is a generator yielding device calls, the sync and async monitors only differ in how they run the calls
+DeviceCall = Callable[[Any], Any]
+DeviceSteps = Generator[DeviceCall, Any, None]
+
+
+def gather_futures(futures: Sequence[RequestFuture]) -> RequestFuture:
+    if len(futures) == 1:
+        return futures[0]
+
+    result: Future[Any] = Future()
+    if len(futures) == 0:
+        result.set_result(None)
+        return result
+
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def on_done(f: RequestFuture) -> None:
+        with lock:
+            if result.done():
+                return
+            error = f.exception()
+            if error is not None:
+                result.set_exception(error)
                 return
-            except ReadTimeoutException:
-                logging.info(f"Command [{cmd}] timed out, retrying")
-                time.sleep(0.2)
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                result.set_result(None)
 
-        cmd.event.set()
-        logging.info(f"Command [{cmd}] failed")
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
 
-    def run(self) -> None:
-        while True:
-            try:
-                logging.info("Creating new serial port connection")
-                self._dev = ESmartSerialDevice(self._path, device_addr=self._device_addr)
-                while True:
-                    try:
-                        new_values = []
-                        for data_item, regs_for_item_it in itertools.groupby(esmart_registers, lambda x: x.data_item):
-                            regs_for_item: List[ESmartRegister] = list(regs_for_item_it)
-                            addr_min = min(x.esmart_address for x in regs_for_item)
-                            addr_max = max(x.esmart_address + (x.data_size // 2) for x in regs_for_item)
 
-                            self._execute_commands()
+def exit_on_sigterm() -> None:
+    # SIGTERM kills the process without running the atexit hooks that save the state file, capture and recorder
+    def on_sigterm(signum: int, frame: Optional[types.FrameType]) -> None:
+        raise SystemExit(128 + signum)
 
-                            d = self._dev.get(data_item=data_item, data_offset=addr_min, data_length=(addr_max - addr_min) * 2)
-                            time.sleep(0.2)
+    signal.signal(signal.SIGTERM, on_sigterm)
 
-                            for reg in regs_for_item:
-                                reg_data = reg.process_raw(struct.unpack_from(reg.data_format, d, (reg.esmart_address - addr_min) * 2)[0])
 
-                                new_values.append((reg, reg_data))
+def port_name(port: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", os.path.basename(port.rstrip("/")))
 
-                        with self._update_lock:
-                            self._values = new_values
-                            self._state_last_update = datetime.datetime.utcnow()
 
-                        for reg, val in new_values:
-                            logging.debug(f"{reg.name} {reg.to_modbus(val)}")
+def format_path(template: str, *, port: str, device_addr: Optional[int] = None) -> str:
+    fields: Dict[str, Any] = dict(port=port_name(port))
+    if device_addr is not None:
+        fields["device_addr"] = device_addr
+    return template.format(**fields)
 
+
+def check_device_paths(port: str, device_addrs: Sequence[int], options: Dict[str, Any]) -> None:
+    for option in PerDevicePathOptions:
+        template = options.get(option)
+        if template is None:
+            continue
+        paths = [format_path(template, port=port, device_addr=x) for x in device_addrs]
+        if len(set(paths)) < len(paths):
+            raise ValueError(f"{option} {template} resolves to the same file for several devices, add {{device_addr}}")
+
+
+class ESmartBus:
+    def __init__(self, path: str, *, min_frame_gap: float = DEFAULT_MIN_FRAME_GAP, capture_path: Optional[str] = None) -> None:
+        self.path = path
+        self.capture: Optional[CaptureWriter] = None
+        if capture_path is not None:
+            self.capture = CaptureWriter(format_path(capture_path, port=path))
+            atexit.register(self.capture.close)
+        self.scheduler = BusScheduler()
+        self.pacing = PacingController(min_gap=min_frame_gap)
+        self.monitors: List[ESmartMonitor] = []
+
+        labels = dict(port=path)
+        registry.gauge("esmart_bus_queue_depth", "Jobs due on the bus", labels, lambda: self.scheduler.queue_depth)
+        registry.gauge("esmart_bus_frame_gap_seconds", "Current gap between serial frames", labels, lambda: self.pacing.gap)
+        for priority in JobPriority:
+            registry.gauge("esmart_bus_dispatch_delay_seconds", "Time the last job of this priority waited past its deadline",
+                           dict(labels, priority=priority.name.lower()), functools.partial(self.scheduler.dispatch_delays.get, priority))
+
+    def add_monitor(self, monitor: 'ESmartMonitor') -> None:
+        self.monitors.append(monitor)
+
+        cycle_time = sum(estimate_cycle_time(x.plan, baud_rate=ESmartSerialDevice.BAUD_RATE, frame_gap=self.pacing.gap) for x in self.monitors)
+        logging.info(f"Bus {self.path}: {len(self.monitors)} controllers, expected cycle time {cycle_time:.3f}s")
+
+    def run(self) -> None:
+        while True:
+            ser = None
+            try:
+                logging.info("Creating new serial port connection")
+                ser = ESmartSerialDevice.open_port(self.path, self.capture)
+                for mon in self.monitors:
+                    mon._dev = ESmartSerialDevice(self.path, device_addr=mon.device_addr, pacing=self.pacing, ser=ser, metrics=mon.device_metrics)
+                    mon._dev.check_device_addr = len(self.monitors) > 1
+                while True:
+                    try:
+                        self._execute_next_job()
                     except KeyboardInterrupt:
                         break
                     except ReadTimeoutException:
                         logging.error("Read timeout exception")
-                        time.sleep(UpdateInterval.total_seconds())
+                    except ESmartException as e:
+                        logging.error(f"Protocol error: {type(e).__name__}")
             except KeyboardInterrupt:
                 break
-            except:
+            except Exception:
                 traceback.print_exc()
                 time.sleep(UpdateInterval.total_seconds())
             finally:
-                if self._dev is not None:
-                    self._dev.close()
+                for mon in self.monitors:
+                    mon._dev = None
+                if ser is not None:
+                    ser.close()
 
-    def get_values(self) -> Optional[List[Tuple[ESmartRegister, Any]]]:
+    def _execute_next_job(self) -> None:
+        job = self.scheduler.next_job()
+        logging.debug(f"Dispatching [{job}], queue depth {self.scheduler.queue_depth}")
+        failed = True
+        try:
+            job.action()
+            failed = False
+        finally:
+            self._rearm_job(job, failed)
+
+    def _rearm_job(self, job: Job, failed: bool) -> None:
+        if job.interval is not None:
+            job.deadline = time.monotonic() + (max(job.interval, UpdateInterval.total_seconds()) if failed else job.interval)
+            self.scheduler.submit(job)
+
+
+class ESmartMonitor:
+    bus_class = ESmartBus
+
+    def __init__(self, path: str, device_addr: int, *,
+                 bus: Optional[ESmartBus] = None,
+                 max_gap_words: int = DEFAULT_MAX_GAP_WORDS,
+                 max_frame_length: int = DEFAULT_MAX_FRAME_LENGTH,
+                 min_frame_gap: float = DEFAULT_MIN_FRAME_GAP,
+                 fast_poll_interval: float = FastPollInterval.total_seconds(),
+                 slow_poll_interval: float = SlowPollInterval.total_seconds(),
+                 snapshot_path: Optional[str] = None,
+                 recorder_path: Optional[str] = None,
+                 record_interval: float = 0.0,
+                 state_path: Optional[str] = None,
+                 max_state_age: float = MaxStateAge.total_seconds(),
+                 capture_path: Optional[str] = None):
+        self._dev: Optional[ESmartSerialDevice] = None
+        self.device_addr = device_addr
+
+        self._bus = bus or self.bus_class(path, min_frame_gap=min_frame_gap, capture_path=capture_path)
+        assert self._bus.path == path
+
+        self._commands_queue: queue.Queue[Command] = queue.Queue(maxsize=MaxQueuedCommands)
+        self._commands_job_scheduled = False
+        self._scheduler = self._bus.scheduler
+
+        labels = dict(port=path, device=str(device_addr))
+        self.device_metrics = DeviceMetrics(path, device_addr)
+        self.cycle_time = registry.histogram("esmart_poll_cycle_seconds", "Time between consecutive polls of the first fast read", labels)
+        self._write_failures = registry.counter("esmart_write_failures_total", "Write commands that were not acknowledged", labels)
+        self._verify_mismatches = registry.counter("esmart_write_mismatches_total", "Write commands not confirmed by the read-back", labels)
+        registry.gauge("esmart_snapshot_age_seconds", "Time since the newest register value was read", labels, self.snapshot_age)
+        registry.gauge("esmart_queued_commands", "Write commands waiting for the bus", labels, self._commands_queue.qsize)
+        self._last_cycle: Optional[float] = None
+
+        self._update_lock = threading.Lock()
+        self._refreshes: Dict[PlannedRead, Tuple[RequestFuture, float]] = {}
+        self._queued_refreshes: Set[PlannedRead] = set()
+        self._subscriptions: Tuple[Subscription, ...] = ()
+        self._overlay_expiry = math.inf
+
+        self._shared_snapshot: Optional[SnapshotWriter] = None
+        if snapshot_path is not None:
+            self._shared_snapshot = SnapshotWriter(format_path(snapshot_path, port=path, device_addr=device_addr))
+
+        self._recorder: Optional[TimeSeriesRecorder] = None
+        self._record_interval = record_interval
+        self._last_record = 0.0
+        if recorder_path is not None:
+            self._recorder = TimeSeriesRecorder(format_path(recorder_path, port=path, device_addr=device_addr))
+
+        self.plan = plan_reads(esmart_registers, max_gap_words=max_gap_words, max_frame_length=max_frame_length)
+        log_plan(self.plan, baud_rate=ESmartSerialDevice.BAUD_RATE, frame_gap=self._bus.pacing.gap)
+        self._register_reads = {reg: read for read in self.plan for reg, _ in read.registers}
+        self._cycle_read = next((x for x in self.plan if x.poll_tier == PollTier.Fast), self.plan[0])
+
+        self._poll_intervals = {PollTier.Fast: fast_poll_interval, PollTier.Slow: slow_poll_interval}
+        self._stale_times = {tier: interval + StaleValueTime.total_seconds() for tier, interval in self._poll_intervals.items()}
+        self._snapshot = MonitorSnapshot.empty(self._stale_times)
+
+        self._state_path: Optional[str] = None
+        self._last_state_save = time.time()
+        if state_path is not None:
+            self._state_path = format_path(state_path, port=path, device_addr=device_addr)
+            restored = load_state(self._state_path, max_age=max_state_age)
+            if len(restored) > 0:
+                logging.info(f"Restored {len(restored)} values from {self._state_path}, serving them as unconfirmed")
+                self._snapshot = self._snapshot.with_restored(restored, time.time())
+            atexit.register(self._save_state)
+
+        # slow reads start after the first fast cycle so that live data replaces restored values first
+        now = time.monotonic()
+        fast_cycle_time = estimate_cycle_time([x for x in self.plan if x.poll_tier == PollTier.Fast],
+                                              baud_rate=ESmartSerialDevice.BAUD_RATE, frame_gap=self._bus.pacing.gap)
+        for read in self.plan:
+            fast = read.poll_tier == PollTier.Fast
+            self._scheduler.submit(Job(f"[{device_addr}] read {read}", JobPriority.FastPoll if fast else JobPriority.SlowPoll, self._action(self._read_steps, read),
+                                       deadline=now if fast else now + fast_cycle_time, interval=self._poll_intervals[read.poll_tier]))
+
+        self._bus.add_monitor(self)
+
+    @classmethod
+    def create_bus(cls, path: str, device_addrs: Sequence[int], *,
+                   min_frame_gap: float = DEFAULT_MIN_FRAME_GAP, capture_path: Optional[str] = None,
+                   **kwargs: Any) -> Tuple[ESmartBus, List['ESmartMonitor']]:
+        check_device_paths(path, device_addrs, kwargs)
+        bus = cls.bus_class(path, min_frame_gap=min_frame_gap, capture_path=capture_path)
+        return bus, [cls(path, device_addr, bus=bus, **kwargs) for device_addr in device_addrs]
+
+    @property
+    def bus(self) -> ESmartBus:
+        return self._bus
+
+    def _action(self, steps: Callable[..., DeviceSteps], *args: Any) -> Callable[[], Any]:
+        return lambda: self._run_steps(steps(*args))
+
+    def _run_steps(self, steps: DeviceSteps) -> None:
+        if self._dev is None:
+            raise Exception("device not initialized")
+
+        try:
+            call = next(steps)
+            while True:
+                try:
+                    result = call(self._dev)
+                except BaseException as e:
+                    call = steps.throw(e)
+                else:
+                    call = steps.send(result)
+        except StopIteration:
+            pass
+
+    def _drain_commands(self) -> List[Command]:
+        commands: List[Command] = []
+        while True:
+            try:
+                commands.append(self._commands_queue.get_nowait())
+            except queue.Empty:
+                return commands
+
+    def _take_commands(self) -> Tuple[List[Command], Dict[ESmartRegister, int]]:
+        now = time.monotonic()
         with self._update_lock:
-            if self._state_last_update is None or \
-                    datetime.datetime.utcnow() - self._state_last_update > StaleValueTime:
-                return None
+            self._commands_job_scheduled = False
+            commands = [cmd for cmd in self._drain_commands() if not cmd.expire(now) and cmd.start()]
+
+        merged_writes: Dict[ESmartRegister, int] = {}
+        for cmd in commands:
+            logging.info(f"Executing command [{cmd}] after {(now - cmd.enqueued) * 1000:.0f} ms in queue")
+            merged_writes.update(cmd.writes)
+
+        return commands, merged_writes
+
+    def _complete_commands(self, commands: List[Command], failed_registers: Set[ESmartRegister],
+                           mismatched_registers: Optional[Set[ESmartRegister]] = None) -> None:
+        for cmd in commands:
+            if any(reg in failed_registers for reg, _ in cmd.writes):
+                logging.info(f"Command [{cmd}] failed")
+                self._write_failures.inc()
+                cmd.future.set_exception(RequestFailedException())
+            elif mismatched_registers is not None and any(reg in mismatched_registers for reg, _ in cmd.writes):
+                logging.info(f"Command [{cmd}] not confirmed by the device")
+                self._verify_mismatches.inc()
+                cmd.future.set_exception(VerifyMismatchException())
+            else:
+                logging.info(f"Command [{cmd}] completed")
+                cmd.future.set_result(None)
+
+    def _store_write(self, write: PlannedWrite) -> None:
+        hold_until = time.time() + ValueHoldTime.total_seconds()
+        with self._update_lock:
+            self._publish(self._snapshot.with_writes(write.writes, hold_until))
+
+    def _schedule_verify(self, writes: List[PlannedWrite], commands: List[Command], failed_registers: Set[ESmartRegister]) -> None:
+        if len(writes) == 0:
+            self._complete_commands(commands, failed_registers)
+            return
+
+        self._scheduler.submit(Job(f"[{self.device_addr}] verify", JobPriority.Verify, self._action(self._verify_steps, writes, commands, failed_registers),
+                                   deadline=time.monotonic()))
+
+    def _store_verify(self, write: PlannedWrite, d: memoryview) -> Set[ESmartRegister]:
+        timestamp = time.time()
+        values = write.decoder.decode(d)
+
+        mismatched_registers = set()
+        pending = self._snapshot.pending
+        for (reg, expected), value in zip(write.writes, values):
+            if reg in pending:
+                expected = pending[reg][0]
+            if value != expected:
+                logging.warning(f"Write verification mismatch on {reg.name.strip()}: wrote {expected}, device reports {value}")
+                mismatched_registers.add(reg)
+
+        with self._update_lock:
+            self._publish(self._snapshot.with_reads(list(zip(write.decoder.registers, values)), timestamp, verified=True))
+
+        return mismatched_registers
+
+    def _commands_steps(self) -> DeviceSteps:
+        commands, merged_writes = self._take_commands()
+        if len(commands) == 0:
+            return
+
+        failed_registers: Set[ESmartRegister] = set()
+        written: List[PlannedWrite] = []
+        try:
+            for write in plan_writes(merged_writes):
+                if (yield from self._write_retry_steps(write)):
+                    written.append(write)
+                else:
+                    failed_registers.update(reg for reg, _ in write.writes)
+        except:
+            self._complete_commands(commands, set(merged_writes))
+            raise
+
+        self._schedule_verify(written, commands, failed_registers)
+
+    def _verify_steps(self, writes: List[PlannedWrite], commands: List[Command], failed_registers: Set[ESmartRegister]) -> DeviceSteps:
+        mismatched_registers: Set[ESmartRegister] = set()
+        try:
+            for write in writes:
+                d = yield lambda dev: dev.get(data_item=write.data_item, data_offset=write.data_offset, data_length=write.data_length)
+                mismatched_registers.update(self._store_verify(write, d))
+        finally:
+            self._complete_commands(commands, failed_registers, mismatched_registers)
+
+    def _write_retry_steps(self, write: PlannedWrite) -> Generator[DeviceCall, Any, bool]:
+        for i in range(WriteRetries):
+            try:
+                yield lambda dev: dev.set_words(data_item=write.data_item, data_offset=write.data_offset, values=write.values)
+                self._store_write(write)
+                return True
+            except (ReadTimeoutException, ChecksumException) as e:
+                logging.info(f"Write [{write}] failed with {type(e).__name__}, retrying")
+            except (CommandNotAcknowledgedException, InvalidCommandException) as e:
+                # the device rejected this frame, the rest of the batch still goes out
+                logging.info(f"Write [{write}] rejected with {type(e).__name__}")
+                return False
+
+        return False
+
+    def run(self) -> None:
+        self._bus.run()
+
+    def _read_steps(self, read: PlannedRead) -> DeviceSteps:
+        d = yield lambda dev: dev.get(data_item=read.data_item, data_offset=read.data_offset, data_length=read.data_length)
+        self._store_read(read, d)
+
+    def _refresh_action(self, read: PlannedRead) -> Callable[[], Any]:
+        run = self._action(self._refresh_steps, read)
+
+        def action() -> Any:
+            with self._update_lock:
+                self._queued_refreshes.discard(read)
+            return run()
+        return action
+
+    def _refresh_steps(self, read: PlannedRead) -> DeviceSteps:
+        if read not in self._refreshes:
+            return
+
+        try:
+            yield from self._read_steps(read)
+        except Exception as e:
+            self._complete_refresh(read, e)
+            raise
+
+    def _complete_refresh(self, read: PlannedRead, error: Optional[Exception]) -> None:
+        with self._update_lock:
+            entry = self._refreshes.pop(read, None)
+
+        if entry is not None:
+            if error is None:
+                entry[0].set_result(None)
             else:
-                merged_values = self._values
-                for i, (reg, _) in enumerate(list(merged_values)):
-                    if reg in self._pending_updates:
-                        v = self._pending_updates[reg]
-                        if time.time() < v[0]:
-                            merged_values[i] = (reg, v[1])
+                entry[0].set_exception(error)
+
+    def _store_read(self, read: PlannedRead, d: memoryview) -> None:
+        timestamp = time.time()
+        values = read.decoder.decode(d)
+
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for reg, value in zip(read.decoder.registers, values):
+                logging.debug(f"{reg.name} {reg.to_modbus(value)}")
+
+        with self._update_lock:
+            self._publish(self._snapshot.with_reads(list(zip(read.decoder.registers, values)), timestamp))
+
+        if read is self._cycle_read:
+            now = time.monotonic()
+            if self._last_cycle is not None:
+                self.cycle_time.observe(now - self._last_cycle)
+            self._last_cycle = now
+            self._record(timestamp)
+            if timestamp - self._last_state_save >= StateSaveInterval.total_seconds():
+                self._save_state()
+
+        self._complete_refresh(read, None)
+
+    def _record(self, timestamp: float) -> None:
+        if self._recorder is None or timestamp - self._last_record < self._record_interval:
+            return
+        values = [(reg, value) for reg, value, _ in self._snapshot.get_timestamped_values(now=timestamp)]
+        if len(values) > 0:
+            self._recorder.append(timestamp, values)
+            self._last_record = timestamp
+
+    def _save_state(self) -> None:
+        if self._state_path is None:
+            return
+        self._last_state_save = time.time()
+        values = [(reg, value, timestamp) for reg, (value, timestamp) in self._snapshot.values.items()]
+        if len(values) == 0:
+            return
+        try:
+            save_state(self._state_path, values)
+        except OSError as e:
+            logging.warning(f"Failed to save state to {self._state_path}: {e}")
+
+    def _publish(self, snapshot: MonitorSnapshot) -> None:
+        changed = snapshot.changed_since(self._snapshot.version)
+        self._snapshot = snapshot
+        if self._shared_snapshot is not None:
+            self._shared_snapshot.publish(snapshot.get_timestamped_values(include_stale=True))
+        if changed:
+            for sub in self._subscriptions:
+                sub.notify()
+            if any(sub.closed for sub in self._subscriptions):
+                self._subscriptions = tuple(x for x in self._subscriptions if not x.closed)
+        self._schedule_overlay_expiry(snapshot)
+
+    def _schedule_overlay_expiry(self, snapshot: MonitorSnapshot) -> None:
+        # a failed read-back or a stalled bus publishes nothing, so lapsed write overlays are dropped on a timer
+        if snapshot.pending_until >= self._overlay_expiry:
+            return
+        self._overlay_expiry = snapshot.pending_until
+        self._call_later(max(0.0, snapshot.pending_until - time.time()), self._expire_overlays)
+
+    def _call_later(self, delay: float, callback: Callable[[], None]) -> None:
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def _create_future(self) -> RequestFuture:
+        return Future()
+
+    def _gather(self, futures: Sequence[RequestFuture]) -> RequestFuture:
+        return gather_futures(futures)
+
+    def _expire_overlays(self) -> None:
+        with self._update_lock:
+            self._overlay_expiry = math.inf
+            if self._snapshot.pending_until <= time.time():
+                self._publish(self._snapshot.with_expired_writes())
+            else:
+                self._schedule_overlay_expiry(self._snapshot)
+
+    def subscribe(self, callback: Optional[Callable[[Changes], None]] = None, *,
+                  registers: Optional[Iterable[ESmartRegister]] = None,
+                  deadbands: Optional[Dict[ESmartRegister, float]] = None) -> Subscription:
+        sub = Subscription(lambda: self._snapshot, registers=registers, deadbands=deadbands, on_close=self._drop_subscription)
+        with self._update_lock:
+            self._subscriptions = self._subscriptions + (sub,)
 
-                return merged_values
+        if callback is not None:
+            th = threading.Thread(target=sub.run_callback, args=(callback,), name=f"esmart-subscription {self.device_addr}")
+            th.daemon = True
+            th.start()
+        return sub
 
-    def set_word(self, *, data_item: int, data_offset: int, value: int) -> None:
-        reg = get_register(data_item, data_offset)
+    def _drop_subscription(self, sub: Subscription) -> None:
+        with self._update_lock:
+            self._subscriptions = tuple(x for x in self._subscriptions if x is not sub)
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        sub.close()
+
+    @property
+    def snapshot(self) -> MonitorSnapshot:
+        return self._snapshot
+
+    def changed_since(self, version: int) -> bool:
+        return self._snapshot.changed_since(version)
+
+    def snapshot_age(self) -> Optional[float]:
+        values = self._snapshot.values
+        if len(values) == 0:
+            return None
+        return time.time() - max(timestamp for _, timestamp in values.values())
+
+    @property
+    def queued_commands(self) -> int:
+        return self._commands_queue.qsize()
 
-        cmd = Command(reg, value)
+    def get_register_image(self, reg_type: ModbusRegisterType) -> Optional[RegisterImage]:
+        return self._snapshot.images.get(reg_type)
+
+    def get_timestamped_values(self, *, include_stale: bool = False) -> List[Tuple[ESmartRegister, Any, float]]:
+        return self._snapshot.get_timestamped_values(include_stale=include_stale)
+
+    def refresh_async(self, registers: Iterable[ESmartRegister], *, max_age: float) -> RequestFuture:
+        now = time.time()
+        values = self._snapshot.values
+        reads = set(self._register_reads[reg] for reg in registers
+                    if reg in self._register_reads and (reg not in values or now - values[reg][1] > max_age))
+
+        futures: List[RequestFuture] = []
+        expired: List[RequestFuture] = []
+        now = time.monotonic()
         with self._update_lock:
-            self._commands_queue.put(cmd)
-        cmd.event.wait()
-        if not cmd.success:
-            raise RequestFailedException()
+            for read in reads:
+                entry = self._refreshes.get(read)
+                # the bus may be stuck reopening the port, do not let new callers join a refresh that never ran
+                if entry is not None and now > entry[1]:
+                    expired.append(entry[0])
+                    entry = None
+                if entry is None:
+                    entry = self._refreshes[read] = self._create_future(), now + RefreshTimeout.total_seconds()
+                    # the job of a timed out refresh is still queued while the port is down, the new refresh waits for it
+                    if read not in self._queued_refreshes:
+                        self._queued_refreshes.add(read)
+                        self._scheduler.submit(Job(f"[{self.device_addr}] refresh {read}", JobPriority.Refresh, self._refresh_action(read),
+                                                   deadline=now))
+                futures.append(entry[0])
+
+        for future in expired:
+            future.set_exception(RefreshTimeoutException())
+        return self._gather(futures)
+
+    def refresh(self, registers: Iterable[ESmartRegister], *, max_age: float, timeout: Optional[float] = None) -> None:
+        future = self.refresh_async(registers, max_age=max_age)
+        assert isinstance(future, Future)
+        future.result(timeout)
+
+    def get_values(self) -> Optional[List[Tuple[ESmartRegister, Any]]]:
+        values = [(reg, value) for reg, value, _ in self.get_timestamped_values()]
+        if len(values) == 0:
+            return None
+        return values
+
+    def _purge_commands(self) -> None:
+        now = time.monotonic()
+        for cmd in self._drain_commands():
+            if not cmd.expire(now):
+                self._commands_queue.put_nowait(cmd)
+
+    def submit_write(self, writes: Sequence[Tuple[ESmartRegister, int]], *, timeout: float = WriteTimeout.total_seconds()) -> Command:
+        cmd = Command(writes, timeout, future=self._create_future())
+        with self._update_lock:
+            if self._commands_queue.full():
+                # while the bus is down nothing takes commands, make room by dropping the ones nobody waits for
+                self._purge_commands()
+            try:
+                self._commands_queue.put_nowait(cmd)
+            except queue.Full:
+                logging.warning(f"Command [{cmd}] rejected, {self._commands_queue.qsize()} commands already queued")
+                cmd.future.set_exception(QueueFullException())
+                return cmd
+
+            if not self._commands_job_scheduled:
+                self._commands_job_scheduled = True
+                self._scheduler.submit(Job(f"[{self.device_addr}] write", JobPriority.Write, self._action(self._commands_steps), deadline=time.monotonic()))
+        return cmd
+
+    def set_words_async(self, writes: Sequence[Tuple[ESmartRegister, int]], *, timeout: float = WriteTimeout.total_seconds()) -> RequestFuture:
+        return self.submit_write(writes, timeout=timeout).future
+
+    def set_word_async(self, *, data_item: int, data_offset: int, value: int, timeout: float = WriteTimeout.total_seconds()) -> RequestFuture:
+        return self.set_words_async([(get_register(data_item, data_offset), value)], timeout=timeout)
+
+    def set_word(self, *, data_item: int, data_offset: int, value: int, timeout: float = WriteTimeout.total_seconds()) -> None:
+        cmd = self.submit_write([(get_register(data_item, data_offset), value)], timeout=timeout)
+        assert isinstance(cmd.future, Future)
+        try:
+            cmd.future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            cmd.cancel_or_expire()
+            raise WriteTimeoutException()
@@ -0,0 +1,271 @@
+import argparse
+import atexit
+import itertools
+import mmap
+import os
+import struct
+import time
+from array import array
+from datetime import timedelta
+from typing import List, Tuple, Sequence, Optional, Dict
+
+from esmart_device.registers import ESmartRegister, DataType, esmart_registers
+from esmart_monitor.shared_snapshot import layout_hash
+
+RecorderMagic = b"ESTS"
+SegmentSuffix = ".ests"
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+DefaultSegmentAge = timedelta(days=7)
+DefaultFlushInterval = timedelta(seconds=60)
+FlushSize = 4096
+
+header_struct = struct.Struct("<4sIIId")
+timestamp_struct = struct.Struct("<d")
+
+mask_tables = [bytes(int(x & (1 << bit) != 0) for x in range(256)) for bit in range(8)]
+
+column_formats = {
+    DataType.UInt16: "H",
+    DataType.Int16: "h",
+    DataType.UInt32s: "I",
+}
+
+
+class RecorderException(Exception):
+    pass
+
+
+class RowLayout:
+    def __init__(self, registers: Sequence[ESmartRegister]) -> None:
+        self.registers = list(registers)
+        self.hash = layout_hash(self.registers)
+        self.mask_size = (len(self.registers) + 7) // 8
+        self.row_struct = struct.Struct(f"<d{self.mask_size}s" + "".join(column_formats[x.data_type] for x in self.registers))
+        self.row_size = self.row_struct.size
+
+        self.offsets: Dict[ESmartRegister, int] = {}
+        position = timestamp_struct.size + self.mask_size
+        for reg in self.registers:
+            self.offsets[reg] = position
+            position += struct.calcsize(column_formats[reg.data_type])
+
+    def pack(self, timestamp: float, values: Sequence[Tuple[ESmartRegister, int]]) -> bytes:
+        present = dict(values)
+        mask = bytearray(self.mask_size)
+        columns = []
+        for i, reg in enumerate(self.registers):
+            value = present.get(reg)
+            if value is not None:
+                mask[i // 8] |= 1 << (i % 8)
+            columns.append(value or 0)
+        return self.row_struct.pack(timestamp, bytes(mask), *columns)
+
+
+def segment_path(directory: str, segment_id: int) -> str:
+    return os.path.join(directory, f"{segment_id}{SegmentSuffix}")
+
+
+def list_segments(directory: str) -> List[Tuple[int, str]]:
+    names = [x for x in os.listdir(directory) if x.endswith(SegmentSuffix) and x[:-len(SegmentSuffix)].isdigit()]
+    return sorted((int(x[:-len(SegmentSuffix)]), os.path.join(directory, x)) for x in names)
+
+
+class TimeSeriesRecorder:
+    def __init__(self, directory: str, registers: Sequence[ESmartRegister] = esmart_registers, *,
+                 max_segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 max_segment_age: float = DefaultSegmentAge.total_seconds(),
+                 flush_interval: float = DefaultFlushInterval.total_seconds()) -> None:
+        self.directory = directory
+        self.layout = RowLayout(registers)
+        self.max_segment_size = max_segment_size
+        self.max_segment_age = max_segment_age
+        self.flush_interval = flush_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self._file: Optional[int] = None
+        self._segment_start = 0.0
+        self._segment_size = 0
+        self._buffer = bytearray()
+        self._last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def _open_segment(self, timestamp: float) -> None:
+        self._close_segment()
+        # segments are named by their start in microseconds, so they sort in time order, a segment already
+        # opened in the same microsecond (or before a restart) is never reused, the next free id is taken instead
+        segment_id = int(timestamp * 1000000)
+        while True:
+            try:
+                self._file = os.open(segment_path(self.directory, segment_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except FileExistsError:
+                segment_id += 1
+        header = header_struct.pack(RecorderMagic, self.layout.hash, self.layout.row_size, len(self.layout.registers), timestamp)
+        os.write(self._file, header)
+        self._segment_start = timestamp
+        self._segment_size = len(header)
+
+    def _close_segment(self) -> None:
+        self.flush()
+        if self._file is not None:
+            os.close(self._file)
+            self._file = None
+
+    def append(self, timestamp: float, values: Sequence[Tuple[ESmartRegister, int]]) -> None:
+        if self._file is None or self._segment_size + len(self._buffer) + self.layout.row_size > self.max_segment_size or \
+                timestamp - self._segment_start >= self.max_segment_age:
+            self._open_segment(timestamp)
+
+        self._buffer += self.layout.pack(timestamp, values)
+        if len(self._buffer) >= FlushSize or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if self._file is None or len(self._buffer) == 0:
+            return
+        os.write(self._file, self._buffer)
+        self._segment_size += len(self._buffer)
+        self._buffer.clear()
+
+    def close(self) -> None:
+        self._close_segment()
+
+
+class SegmentReader:
+    def __init__(self, path: str, registers: Sequence[ESmartRegister] = esmart_registers) -> None:
+        self.path = path
+        self.layout = RowLayout(registers)
+        self._mm: Optional[mmap.mmap] = None
+        self.rows = 0
+
+        with open(path, "rb") as f:
+            header = f.read(header_struct.size)
+        if len(header) != header_struct.size:
+            raise RecorderException(f"{path}: truncated header")
+        magic, hash, row_size, count, self.start = header_struct.unpack(header)
+        if magic != RecorderMagic or hash != self.layout.hash or row_size != self.layout.row_size or count != len(self.layout.registers):
+            raise RecorderException(f"{path}: segment layout does not match registers")
+        self.refresh()
+
+    def refresh(self) -> None:
+        size = os.stat(self.path).st_size
+        rows = (size - header_struct.size) // self.layout.row_size
+        if rows == self.rows and self._mm is not None:
+            return
+        self.close()
+        self.rows = rows
+        if rows > 0:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), header_struct.size + rows * self.layout.row_size, access=mmap.ACCESS_READ)
+
+    def _timestamp(self, row: int) -> float:
+        assert self._mm is not None
+        value: float = timestamp_struct.unpack_from(self._mm, header_struct.size + row * self.layout.row_size)[0]
+        return value
+
+    def _search(self, timestamp: float, *, after: bool) -> int:
+        low, high = 0, self.rows
+        while low < high:
+            mid = (low + high) // 2
+            value = self._timestamp(mid)
+            if value < timestamp or (after and value == timestamp):
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def row_range(self, start: Optional[float] = None, end: Optional[float] = None) -> Tuple[int, int]:
+        first = 0 if start is None else self._search(start, after=False)
+        last = self.rows if end is None else self._search(end, after=True)
+        return first, max(first, last)
+
+    def _lane(self, first: int, last: int, offset: int, width: int) -> bytes:
+        assert self._mm is not None
+        row_size = self.layout.row_size
+        begin = header_struct.size + first * row_size + offset
+        end = header_struct.size + last * row_size
+        if width == 1:
+            return self._mm[begin:end:row_size]
+        data = bytearray(width * (last - first))
+        for i in range(width):
+            data[i::width] = self._mm[begin + i:end:row_size]
+        return bytes(data)
+
+    def column(self, reg: ESmartRegister, start: Optional[float] = None, end: Optional[float] = None) -> Tuple['array[float]', 'array[int]']:
+        timestamps: array[float] = array("d")
+        values: array[int] = array(column_formats[reg.data_type])
+        first, last = self.row_range(start, end)
+        if first == last:
+            return timestamps, values
+
+        timestamps.frombytes(self._lane(first, last, 0, timestamps.itemsize))
+        values.frombytes(self._lane(first, last, self.layout.offsets[reg], values.itemsize))
+
+        index = self.layout.registers.index(reg)
+        flags = self._lane(first, last, timestamp_struct.size + index // 8, 1).translate(mask_tables[index % 8])
+        if flags.count(0) > 0:
+            timestamps = array("d", itertools.compress(timestamps, flags))
+            values = array(values.typecode, itertools.compress(values, flags))
+        return timestamps, values
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+class TimeSeriesReader:
+    def __init__(self, directory: str, registers: Sequence[ESmartRegister] = esmart_registers) -> None:
+        self.directory = directory
+        self.registers = registers
+        self._segments: Dict[str, SegmentReader] = {}
+
+    def _segment(self, path: str) -> SegmentReader:
+        segment = self._segments.get(path)
+        if segment is None:
+            segment = self._segments[path] = SegmentReader(path, self.registers)
+        return segment
+
+    def column(self, reg: ESmartRegister, start: Optional[float] = None, end: Optional[float] = None) -> Tuple['array[float]', 'array[int]']:
+        # the file names only give the order, the exact start timestamps come from the segment headers
+        segments = [self._segment(path) for _, path in list_segments(self.directory)]
+        timestamps: array[float] = array("d")
+        values: array[int] = array(column_formats[reg.data_type])
+        for i, segment in enumerate(segments):
+            next_start = segments[i + 1].start if i + 1 < len(segments) else None
+            if (end is not None and segment.start > end) or (start is not None and next_start is not None and next_start < start):
+                continue
+
+            segment.refresh()
+            segment_timestamps, segment_values = segment.column(reg, start, end)
+            timestamps += segment_timestamps
+            values += segment_values
+        return timestamps, values
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--path", type=str, required=True)
+    argparser.add_argument("--register", type=str, required=True)
+    argparser.add_argument("--since", type=float, help="seconds before now")
+
+    args = argparser.parse_args()
+
+    reg = next((x for x in esmart_registers if x.name.strip() == args.register), None)
+    if reg is None:
+        argparser.error(f"unknown register {args.register}")
+
+    reader = TimeSeriesReader(args.path)
+    timestamps, values = reader.column(reg, None if args.since is None else time.time() - args.since)
+    for timestamp, value in zip(timestamps, values):
+        print(f"{timestamp:.3f},{reg.to_modbus(value)}")
+
+
+if __name__ == "__main__":
+    main()
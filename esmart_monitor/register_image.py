@@ -0,0 +1,59 @@
+import sys
+import time
+from array import array
+from typing import Dict, List, Sequence, Tuple, Any, Optional
+
+from esmart_device.registers import ModbusRegisterType, ESmartRegister, esmart_registers
+
+
+def _image_size(reg_type: ModbusRegisterType) -> int:
+    return max((x.modbus_address + x.data_size_words for x in esmart_registers if x.modbus_type == reg_type), default=0)
+
+
+image_sizes: Dict[ModbusRegisterType, int] = {reg_type: _image_size(reg_type) for reg_type in ModbusRegisterType}
+
+
+class RegisterImage:
+    def __init__(self, size: int) -> None:
+        self.words = array("H", bytes(2 * size))
+        self.expires = array("d", bytes(8 * size))
+        self._wire: Optional[bytes] = None
+
+    def copy(self) -> 'RegisterImage':
+        image = RegisterImage(0)
+        image.words = array("H", self.words)
+        image.expires = array("d", self.expires)
+        return image
+
+    def set_register(self, reg: ESmartRegister, value: Any, expires: float) -> None:
+        self._wire = None
+        for i, word in enumerate(reg.to_modbus_words(value)):
+            self.words[reg.modbus_address + i] = word
+            self.expires[reg.modbus_address + i] = expires
+
+    def is_valid(self, address: int, count: int = 1, now: Optional[float] = None) -> bool:
+        if address < 0 or count < 0 or address + count > len(self.expires):
+            return False
+        if count == 0:
+            return True
+        return min(self.expires[address:address + count]) >= (time.time() if now is None else now)
+
+    def get_words(self, address: int, count: int = 1) -> List[int]:
+        return self.words[address:address + count].tolist()
+
+    def get_wire_bytes(self, address: int, count: int = 1) -> bytes:
+        if self._wire is None:
+            words = array("H", self.words)
+            if sys.byteorder == "little":
+                words.byteswap()
+            self._wire = words.tobytes()
+        return self._wire[address * 2:(address + count) * 2]
+
+
+def build_register_images(values: Sequence[Tuple[ESmartRegister, Any, float]]) -> Dict[ModbusRegisterType, RegisterImage]:
+    images = {reg_type: RegisterImage(size) for reg_type, size in image_sizes.items()}
+
+    for reg, value, expires in values:
+        images[reg.modbus_type].set_register(reg, value, expires)
+
+    return images
@@ -0,0 +1,166 @@
+import argparse
+import cProfile
+import logging
+import pstats
+import time
+from typing import List, Tuple, Dict, Sequence, Optional
+
+import serial
+
+from esmart_device.capture import read_capture, split_exchanges
+from esmart_device.device import ESmartSerialDevice
+from esmart_device.exceptions import ESmartException
+from esmart_device.frame_parser import FrameParser
+from esmart_device.pacing import PacingController
+from esmart_device.poll_plan import PlannedRead
+from esmart_device.protocol import CMD_GET
+from esmart_monitor.monitor import ESmartMonitor
+
+ReplayPortPath = "replay://"
+
+
+class ReplaySerial(serial.SerialBase):
+    def __init__(self) -> None:
+        super().__init__()
+        self.is_open = True
+        self._chunks: List[Tuple[float, bytes]] = []
+        self._rx = bytearray()
+        self._clock = 0.0
+
+    def load(self, timestamp: float, chunks: Sequence[Tuple[float, bytes]]) -> None:
+        self._clock = timestamp
+        self._chunks = list(reversed(chunks))
+        self._rx.clear()
+
+    def _next_chunk(self) -> bool:
+        if len(self._chunks) == 0 or self._chunks[-1][0] - self._clock > ESmartSerialDevice.READ_TIMEOUT:
+            return False
+        self._clock, data = self._chunks.pop()
+        self._rx += data
+        return True
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx)
+
+    def read(self, size: int = 1) -> bytes:
+        if len(self._rx) == 0 and not self._next_chunk():
+            return b""
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def write(self, data: bytes) -> Optional[int]:
+        return len(data)
+
+
+class ReplayStats:
+    def __init__(self) -> None:
+        self.exchanges = 0
+        self.stored = 0
+        self.skipped = 0
+        self.errors: Dict[str, int] = {}
+        self.captured_duration = 0.0
+        self.elapsed = 0.0
+
+    def __str__(self) -> str:
+        errors = ", ".join(f"{name} {count}" for name, count in sorted(self.errors.items())) or "none"
+        speedup = self.captured_duration / self.elapsed if self.elapsed > 0 else float("inf")
+        return (f"{self.exchanges} exchanges, {self.stored} reads stored, {self.skipped} skipped, errors: {errors}; "
+                f"{self.captured_duration:.1f}s of traffic replayed in {self.elapsed:.3f}s ({speedup:.0f}x)")
+
+
+def capture_device_addrs(path: str) -> List[int]:
+    _, records = read_capture(path)
+    parser = FrameParser()
+    addrs = set()
+    for _, tx, _ in split_exchanges(records):
+        parser.feed(tx)
+        frame = parser.next_frame()
+        if frame is not None:
+            addrs.add(frame[0].device_addr)
+        parser.reset()
+    return sorted(addrs)
+
+
+def replay_capture(path: str, monitors: Sequence[ESmartMonitor]) -> ReplayStats:
+    _, records = read_capture(path)
+    stats = ReplayStats()
+    ser = ReplaySerial()
+    pacing = PacingController(min_gap=0.0, max_gap=0.0)
+
+    devices: Dict[int, Tuple[ESmartMonitor, ESmartSerialDevice]] = {}
+    reads: Dict[Tuple[int, int, int, int], PlannedRead] = {}
+    for mon in monitors:
+        dev = ESmartSerialDevice(ReplayPortPath, device_addr=mon.device_addr, pacing=pacing, ser=ser, metrics=mon.device_metrics)
+        dev.check_device_addr = len(monitors) > 1
+        devices[mon.device_addr] = mon, dev
+        for planned in mon.plan:
+            reads[(mon.device_addr, planned.data_item, planned.data_offset, planned.data_length)] = planned
+
+    parser = FrameParser()
+    first: Optional[float] = None
+    start = time.perf_counter()
+    for timestamp, tx, rx in split_exchanges(records):
+        first = timestamp if first is None else first
+        stats.captured_duration = timestamp - first
+        stats.exchanges += 1
+
+        parser.feed(tx)
+        frame = parser.next_frame()
+        parser.reset()
+        if frame is None or frame[0].cmd != CMD_GET or len(frame[1]) < 3 or frame[0].device_addr not in devices:
+            stats.skipped += 1
+            continue
+
+        header, payload = frame
+        data_offset, _, data_length = payload[:3]
+        mon, dev = devices[header.device_addr]
+        ser.load(timestamp, rx)
+        try:
+            data = dev.get(data_item=header.data_item, data_offset=data_offset, data_length=data_length)
+        except ESmartException as e:
+            stats.errors[type(e).__name__] = stats.errors.get(type(e).__name__, 0) + 1
+            continue
+
+        read = reads.get((header.device_addr, header.data_item, data_offset, data_length))
+        if read is None:
+            stats.skipped += 1
+            continue
+        mon._store_read(read, data)
+        stats.stored += 1
+
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Replays a bus capture through the parser and monitor as fast as possible")
+    argparser.add_argument("--capture", type=str, required=True)
+    argparser.add_argument("--device-addr", type=int, nargs='+', help="devices to replay, all devices in the capture by default")
+    argparser.add_argument("--repeat", type=int, default=1)
+    argparser.add_argument("--profile", action='store_true')
+    argparser.add_argument('--debug', action='store_true')
+
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    device_addrs = args.device_addr or capture_device_addrs(args.capture)
+    _, monitors = ESmartMonitor.create_bus(ReplayPortPath, device_addrs)
+
+    profiler = cProfile.Profile() if args.profile else None
+    for i in range(args.repeat):
+        if profiler is not None:
+            profiler.enable()
+        stats = replay_capture(args.capture, monitors)
+        if profiler is not None:
+            profiler.disable()
+        print(stats)
+
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import List, Tuple, Any, Sequence, Optional
+
+from esmart_device.registers import ESmartRegister, esmart_registers
+
+SnapshotMagic = b"ESNP"
+MaxReadRetries = 1000
+
+header_struct = struct.Struct("<4sIQd")
+seq_struct = struct.Struct("<Q")
+seq_offset = 8
+slot_format = "qd"
+
+
+class SnapshotException(Exception):
+    pass
+
+
+def layout_hash(registers: Sequence[ESmartRegister]) -> int:
+    layout = ";".join(f"{x.name.strip()}:{x.data_item}:{x.esmart_address}:{x.data_type.name}" for x in registers)
+    return zlib.crc32(layout.encode())
+
+
+class SnapshotLayout:
+    def __init__(self, registers: Sequence[ESmartRegister]) -> None:
+        self.registers = list(registers)
+        self.hash = layout_hash(self.registers)
+        self.body_struct = struct.Struct("<" + slot_format * len(self.registers))
+        self.body_offset = header_struct.size
+        self.size = header_struct.size + self.body_struct.size
+
+
+class SnapshotWriter:
+    def __init__(self, path: str, registers: Sequence[ESmartRegister] = esmart_registers) -> None:
+        self.path = path
+        self.layout = SnapshotLayout(registers)
+        self._indexes = {reg: i for i, reg in enumerate(self.layout.registers)}
+        self._seq = 0
+
+        # overwrite the file in place rather than replacing it, readers attached before a restart keep the same inode mapped
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.layout.size)
+            self._mm = mmap.mmap(fd, self.layout.size)
+        finally:
+            os.close(fd)
+
+        seq_struct.pack_into(self._mm, seq_offset, self._seq + 1)
+        self._mm[self.layout.body_offset:self.layout.size] = bytes(self.layout.body_struct.size)
+        header_struct.pack_into(self._mm, 0, SnapshotMagic, self.layout.hash, self._seq, 0.0)
+
+    def publish(self, values: Sequence[Tuple[ESmartRegister, int, float]]) -> None:
+        slots: List[Any] = [0, 0.0] * len(self.layout.registers)
+        for reg, value, timestamp in values:
+            i = self._indexes[reg] * 2
+            slots[i] = value
+            slots[i + 1] = timestamp
+        body = self.layout.body_struct.pack(*slots)
+
+        seq_struct.pack_into(self._mm, seq_offset, self._seq + 1)
+        self._mm[self.layout.body_offset:self.layout.size] = body
+        self._seq += 2
+        header_struct.pack_into(self._mm, 0, SnapshotMagic, self.layout.hash, self._seq, time.time())
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+class SnapshotReader:
+    def __init__(self, path: str, registers: Sequence[ESmartRegister] = esmart_registers) -> None:
+        self.path = path
+        self.layout = SnapshotLayout(registers)
+
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size != self.layout.size:
+                raise SnapshotException(f"{path}: unexpected snapshot size")
+            self._mm = mmap.mmap(f.fileno(), self.layout.size, access=mmap.ACCESS_READ)
+
+        magic, hash, _, _ = header_struct.unpack_from(self._mm, 0)
+        if magic != SnapshotMagic or hash != self.layout.hash:
+            raise SnapshotException(f"{path}: snapshot layout does not match registers")
+
+    def read(self) -> Tuple[int, float, Tuple[Any, ...]]:
+        for i in range(MaxReadRetries):
+            seq_before = seq_struct.unpack_from(self._mm, seq_offset)[0]
+            if seq_before % 2 == 1:
+                time.sleep(0)
+                continue
+            body = self._mm[self.layout.body_offset:self.layout.size]
+            _, _, seq_after, published_at = header_struct.unpack_from(self._mm, 0)
+            if seq_before == seq_after:
+                return seq_after, published_at, self.layout.body_struct.unpack(body)
+
+        raise SnapshotException(f"{self.path}: no consistent snapshot after {MaxReadRetries} attempts")
+
+    def get_timestamped_values(self, *, max_age: Optional[float] = None) -> List[Tuple[ESmartRegister, int, float]]:
+        _, _, slots = self.read()
+        now = time.time()
+        return [(reg, slots[i * 2], slots[i * 2 + 1])
+                for i, reg in enumerate(self.layout.registers)
+                if slots[i * 2 + 1] > 0 and (max_age is None or now - slots[i * 2 + 1] <= max_age)]
+
+    def get_values(self, *, max_age: Optional[float] = None) -> Optional[List[Tuple[ESmartRegister, int]]]:
+        values = [(reg, value) for reg, value, _ in self.get_timestamped_values(max_age=max_age)]
+        if len(values) == 0:
+            return None
+        return values
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--path", type=str, required=True)
+    argparser.add_argument("--max-age", type=float)
+    argparser.add_argument("--watch", type=float)
+
+    args = argparser.parse_args()
+
+    reader = SnapshotReader(args.path)
+    while True:
+        now = time.time()
+        for reg, value, timestamp in reader.get_timestamped_values(max_age=args.max_age):
+            print(f"{reg.name} {reg.to_modbus(value):>10} {now - timestamp:6.1f}s")
+        if args.watch is None:
+            break
+        print()
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import math
+import time
+from typing import Dict, Tuple, List, Sequence, Optional
+
+from esmart_device.registers import ESmartRegister, ModbusRegisterType, PollTier
+from esmart_monitor.register_image import RegisterImage, build_register_images
+
+
+class MonitorSnapshot:
+    def __init__(self, *, version: int, changed_version: int, stale_times: Dict[PollTier, float],
+                 values: Dict[ESmartRegister, Tuple[int, float]],
+                 pending: Dict[ESmartRegister, Tuple[int, float]],
+                 versions: Dict[ESmartRegister, int],
+                 images: Dict[ModbusRegisterType, RegisterImage],
+                 unconfirmed: Optional[Dict[ESmartRegister, float]] = None) -> None:
+        self.version = version
+        self.changed_version = changed_version
+        self.stale_times = stale_times
+        self.values = values
+        self.pending = pending
+        self.versions = versions
+        self.images = images
+        self.unconfirmed = unconfirmed or {}
+        self.pending_until = min((hold_until for _, hold_until in pending.values()), default=math.inf)
+
+    @classmethod
+    def empty(cls, stale_times: Dict[PollTier, float]) -> 'MonitorSnapshot':
+        return cls(version=0, changed_version=0, stale_times=stale_times, values={}, pending={}, versions={}, images=build_register_images([]))
+
+    def value(self, reg: ESmartRegister, now: Optional[float] = None) -> Optional[int]:
+        pending = self.pending.get(reg)
+        if pending is not None and pending[1] > (time.time() if now is None else now):
+            return pending[0]
+        entry = self.values.get(reg)
+        return None if entry is None else entry[0]
+
+    def _published_value(self, reg: ESmartRegister) -> Optional[int]:
+        if reg in self.pending:
+            return self.pending[reg][0]
+        entry = self.values.get(reg)
+        return None if entry is None else entry[0]
+
+    def changed_since(self, version: int) -> bool:
+        return self.changed_version > version
+
+    def changed_registers(self, version: int) -> List[ESmartRegister]:
+        return [reg for reg, reg_version in self.versions.items() if reg_version > version]
+
+    def is_fresh(self, reg: ESmartRegister, now: float) -> bool:
+        entry = self.values.get(reg)
+        if entry is None:
+            return False
+        if reg in self.unconfirmed:
+            return now <= self.unconfirmed[reg]
+        return now - entry[1] <= self.stale_times[reg.poll_tier]
+
+    def get_timestamped_values(self, *, include_stale: bool = False, now: Optional[float] = None) -> List[Tuple[ESmartRegister, int, float]]:
+        now = time.time() if now is None else now
+        return [(reg, self.pending[reg][0] if reg in self.pending and now < self.pending[reg][1] else value, timestamp)
+                for reg, (value, timestamp) in self.values.items()
+                if include_stale or self.is_fresh(reg, now)]
+
+    def with_restored(self, restored: Sequence[Tuple[ESmartRegister, int, float]], now: float) -> 'MonitorSnapshot':
+        values = dict(self.values)
+        unconfirmed = dict(self.unconfirmed)
+        for reg, value, timestamp in restored:
+            values[reg] = (value, timestamp)
+            unconfirmed[reg] = now + self.stale_times[reg.poll_tier]
+        return self._derive(values, self.pending, [reg for reg, _, _ in restored], unconfirmed)
+
+    def with_reads(self, reads: Sequence[Tuple[ESmartRegister, int]], timestamp: float, *, verified: bool = False) -> 'MonitorSnapshot':
+        values = dict(self.values)
+        pending = self.pending
+        unconfirmed = self.unconfirmed
+        for reg, value in reads:
+            values[reg] = (value, timestamp)
+            if reg in pending and (verified or timestamp >= pending[reg][1]):
+                if pending is self.pending:
+                    pending = dict(pending)
+                del pending[reg]
+            if reg in unconfirmed:
+                if unconfirmed is self.unconfirmed:
+                    unconfirmed = dict(unconfirmed)
+                del unconfirmed[reg]
+        return self._derive(values, pending, [reg for reg, _ in reads], unconfirmed)
+
+    def with_writes(self, writes: Sequence[Tuple[ESmartRegister, int]], hold_until: float) -> 'MonitorSnapshot':
+        pending = dict(self.pending)
+        for reg, value in writes:
+            pending[reg] = (value, hold_until)
+        return self._derive(self.values, pending, [reg for reg, _ in writes], self.unconfirmed)
+
+    def with_expired_writes(self) -> 'MonitorSnapshot':
+        return self._derive(self.values, self.pending, [], self.unconfirmed)
+
+    def _derive(self, values: Dict[ESmartRegister, Tuple[int, float]], pending: Dict[ESmartRegister, Tuple[int, float]],
+                registers: Sequence[ESmartRegister], unconfirmed: Dict[ESmartRegister, float]) -> 'MonitorSnapshot':
+        now = time.time()
+        expired = [reg for reg, (_, hold_until) in pending.items() if hold_until <= now]
+        if len(expired) > 0:
+            pending = {reg: entry for reg, entry in pending.items() if entry[1] > now}
+            registers = list(registers) + expired
+
+        images = dict(self.images)
+        for reg_type in set(reg.modbus_type for reg in registers):
+            images[reg_type] = images[reg_type].copy()
+
+        snapshot = MonitorSnapshot(version=self.version + 1, changed_version=self.changed_version, stale_times=self.stale_times,
+                                   values=values, pending=pending, versions=self.versions, images=images, unconfirmed=unconfirmed)
+
+        for reg in registers:
+            if reg not in values:
+                continue
+            value = snapshot.value(reg, now)
+            assert value is not None
+            expires = unconfirmed[reg] if reg in unconfirmed else values[reg][1] + self.stale_times[reg.poll_tier]
+            images[reg.modbus_type].set_register(reg, value, expires)
+
+            if reg not in self.values or value != self._published_value(reg):
+                if snapshot.versions is self.versions:
+                    snapshot.versions = dict(self.versions)
+                snapshot.versions[reg] = snapshot.version
+                snapshot.changed_version = snapshot.version
+
+        return snapshot
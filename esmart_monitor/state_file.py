@@ -0,0 +1,76 @@
+import json
+import logging
+import math
+import os
+import time
+from typing import List, Tuple, Sequence, Any
+
+from esmart_device.registers import ESmartRegister, PollTier, DataType, esmart_registers
+from esmart_monitor.shared_snapshot import layout_hash
+
+StateVersion = 1
+
+value_ranges = {
+    DataType.UInt16: (0, 0xffff),
+    DataType.Int16: (-0x8000, 0x7fff),
+    DataType.UInt32s: (0, 0xffffffff),
+}
+
+
+def save_state(path: str, values: Sequence[Tuple[ESmartRegister, int, float]], registers: Sequence[ESmartRegister] = esmart_registers) -> None:
+    state = {
+        "version": StateVersion,
+        "layout": layout_hash(registers),
+        "saved_at": time.time(),
+        "values": {reg.name.strip(): [value, timestamp] for reg, value, timestamp in values},
+    }
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _valid_entry(reg: ESmartRegister, entry: Any) -> bool:
+    if not isinstance(entry, list) or len(entry) != 2 or any(isinstance(x, bool) for x in entry):
+        return False
+    value, timestamp = entry
+    low, high = value_ranges[reg.data_type]
+    return isinstance(value, int) and low <= value <= high and isinstance(timestamp, (int, float)) and math.isfinite(timestamp)
+
+
+def load_state(path: str, *, max_age: float, registers: Sequence[ESmartRegister] = esmart_registers) -> List[Tuple[ESmartRegister, int, float]]:
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable state file {path}: {e}")
+        return []
+
+    if not isinstance(state, dict) or state.get("version") != StateVersion or state.get("layout") != layout_hash(registers):
+        logging.warning(f"Ignoring state file {path}: register layout changed")
+        return []
+
+    saved = state.get("values")
+    if not isinstance(saved, dict):
+        logging.warning(f"Ignoring state file {path}: no values")
+        return []
+
+    # a hand-edited or damaged file must not keep the monitor from starting, only the broken entries are dropped
+    now = time.time()
+    values = []
+    for reg in registers:
+        name = reg.name.strip()
+        entry = saved.get(name)
+        if entry is None:
+            continue
+        if not _valid_entry(reg, entry):
+            logging.warning(f"Ignoring invalid value of {name} in state file {path}: {entry!r}")
+            continue
+        value, timestamp = entry
+        if reg.poll_tier == PollTier.Fast and now - timestamp > max_age:
+            continue
+        values.append((reg, value, float(timestamp)))
+    return values
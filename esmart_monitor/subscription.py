@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Callable, Optional, Dict, List, Tuple, Set, Iterable, AsyncIterator, Any
+
+from esmart_device.registers import ESmartRegister
+from esmart_monitor.snapshot import MonitorSnapshot
+
+Changes = List[Tuple[ESmartRegister, int]]
+
+
+class Subscription:
+    def __init__(self, get_snapshot: Callable[[], MonitorSnapshot], *,
+                 registers: Optional[Iterable[ESmartRegister]] = None,
+                 deadbands: Optional[Dict[ESmartRegister, float]] = None,
+                 on_close: Optional[Callable[['Subscription'], None]] = None) -> None:
+        self._get_snapshot = get_snapshot
+        self._on_close = on_close
+        self.registers: Optional[Set[ESmartRegister]] = None if registers is None else set(registers)
+        self.deadbands = dict(deadbands or {})
+
+        self._version = 0
+        self._delivered: Dict[ESmartRegister, int] = {}
+        self._dirty = True
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def notify(self) -> None:
+        with self._cond:
+            self._dirty = True
+            self._cond.notify_all()
+        loop = self._loop
+        if loop is not None and self._event is not None:
+            try:
+                loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError as e:
+                logging.warning(f"Closing subscription, its event loop is gone: {e}")
+                self._loop = None
+                self._closed = True
+
+    def close(self) -> None:
+        if self._on_close is not None:
+            self._on_close(self)
+        self._closed = True
+        self.notify()
+
+    def take_changes(self) -> Changes:
+        with self._cond:
+            self._dirty = False
+            snapshot = self._get_snapshot()
+            if not snapshot.changed_since(self._version):
+                return []
+
+            changes: Changes = []
+            for reg in snapshot.changed_registers(self._version):
+                if self.registers is not None and reg not in self.registers:
+                    continue
+                value = snapshot.value(reg)
+                if value is None:
+                    continue
+                last = self._delivered.get(reg)
+                if last is not None and abs(value - last) <= self.deadbands.get(reg, 0):
+                    continue
+                self._delivered[reg] = value
+                changes.append((reg, value))
+
+            self._version = snapshot.version
+            return changes
+
+    def get_changes(self, timeout: Optional[float] = None) -> Changes:
+        with self._cond:
+            while not self._dirty and not self._closed:
+                if not self._cond.wait(timeout):
+                    return []
+        return self.take_changes()
+
+    def run_callback(self, callback: Callable[[Changes], None]) -> None:
+        while not self._closed:
+            changes = self.get_changes()
+            if len(changes) == 0:
+                continue
+            try:
+                callback(changes)
+            except:
+                traceback.print_exc()
+
+    async def aclose(self) -> None:
+        self.close()
+
+    async def __aenter__(self) -> 'Subscription':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    def __aiter__(self) -> AsyncIterator[Changes]:
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        return self
+
+    async def __anext__(self) -> Changes:
+        assert self._event is not None
+        while not self._closed:
+            self._event.clear()
+            changes = self.take_changes()
+            if len(changes) > 0:
+                return changes
+            await self._event.wait()
+        raise StopAsyncIteration
@@ -0,0 +1,38 @@
+import argparse
+import logging
+import time
+
+from esmart_simulator.controller import SimulatedController
+from esmart_simulator.pty_simulator import PtySimulator
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--device-addr", type=int, nargs='+', default=[1])
+    argparser.add_argument("--latency", type=float, default=0.02)
+    argparser.add_argument("--baud-rate", type=int, default=9600, help="0 disables line-rate pacing")
+    argparser.add_argument("--drop-rate", type=float, default=0.0)
+    argparser.add_argument("--nack-rate", type=float, default=0.0)
+    argparser.add_argument("--err-rate", type=float, default=0.0)
+    argparser.add_argument("--seed", type=int)
+    argparser.add_argument('--debug', action='store_true')
+
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    controller = SimulatedController(args.device_addr, latency=args.latency, baud_rate=args.baud_rate,
+                                     drop_rate=args.drop_rate, nack_rate=args.nack_rate, err_rate=args.err_rate, seed=args.seed)
+    simulator = PtySimulator(controller).start()
+    logging.info(f"Simulating devices {args.device_addr} on {simulator.path}")
+
+    try:
+        while True:
+            time.sleep(10)
+            logging.info(f"{controller.requests} requests, {controller.nacks} NACKs, {controller.errors} errors, {controller.dropped_bytes} dropped bytes")
+    except KeyboardInterrupt:
+        simulator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import random
+import struct
+from typing import Dict, List, Tuple, Optional, Sequence
+
+from esmart_device.frame_parser import FrameParser
+from esmart_device.protocol import build_request, CMD_ACK, CMD_GET, CMD_SET, CMD_NACK, CMD_ERR
+from esmart_device.registers import ESmartRegister, DataType, esmart_registers, uint32s_to_int
+from esmart_device.response_header import ResponseHeader
+
+DATA_ITEM_SIZE = 256
+BITS_PER_BYTE = 10
+
+default_values = {
+    "wChgMode": 2,
+    "wPvVolt": 365,
+    "mBatVolt": 132,
+    "wChgCurr": 54,
+    "wOutVolt": 132,
+    "wLoadVolt": 131,
+    "wLoadCurr": 12,
+    "wChgPower": 71,
+    "wLoadPower": 15,
+    "wBatTemp": 21,
+    "wInnerTemp": 28,
+    "wBatCap": 87,
+    "dwTotalEng": 123456,
+    "dbLoadTotalEng": 23456,
+    "wBulkVolt": 144,
+    "wFloatVolt": 138,
+    "wMaxChgCurr": 200,
+    "wMaxDisChgCurr": 200,
+    "wEqualizeChgVolt": 146,
+    "wEqualizeChgTime": 60,
+    "bLoadUseSel": 0,
+    "wLoadOvp": 160,
+    "wLoadUvp": 105,
+    "wBatOvp": 160,
+    "wBatOvB": 150,
+    "wBatUvp": 105,
+    "wBatUvB": 120,
+    "wBacklightTime": 30,
+    "loadEnabled": 5117,
+}
+
+dynamic_registers = ("wPvVolt", "mBatVolt", "wChgCurr", "wChgPower")
+
+
+class SimulatedController:
+    def __init__(self, device_addrs: Sequence[int] = (1,), *,
+                 latency: float = 0.02,
+                 baud_rate: Optional[int] = 9600,
+                 drop_rate: float = 0.0,
+                 nack_rate: float = 0.0,
+                 err_rate: float = 0.0,
+                 dynamic: bool = True,
+                 seed: Optional[int] = None) -> None:
+        self.latency = latency
+        self.baud_rate = baud_rate
+        self.drop_rate = drop_rate
+        self.nack_rate = nack_rate
+        self.err_rate = err_rate
+        self.dynamic = dynamic
+
+        self._random = random.Random(seed)
+        self._parser = FrameParser()
+        self.memory: Dict[int, Dict[int, bytearray]] = {addr: {} for addr in device_addrs}
+
+        self.requests = 0
+        self.dropped_bytes = 0
+        self.nacks = 0
+        self.errors = 0
+
+        for addr in device_addrs:
+            for reg in esmart_registers:
+                self.set_register(addr, reg, default_values.get(reg.name.strip(), 0))
+
+    def _data_item(self, device_addr: int, data_item: int) -> bytearray:
+        return self.memory[device_addr].setdefault(data_item, bytearray(DATA_ITEM_SIZE))
+
+    def set_register(self, device_addr: int, reg: ESmartRegister, value: int) -> None:
+        offset = reg.esmart_address * 2
+        if reg.data_type == DataType.UInt32s:
+            data = struct.pack("<HH", (value >> 16) & 0xffff, value & 0xffff)
+        else:
+            data = struct.pack(reg.data_format, value)
+        self._data_item(device_addr, reg.data_item)[offset:offset + len(data)] = data
+
+    def get_register(self, device_addr: int, reg: ESmartRegister) -> int:
+        offset = reg.esmart_address * 2
+        data = bytes(self._data_item(device_addr, reg.data_item)[offset:offset + reg.data_size])
+        if reg.data_type == DataType.UInt32s:
+            return uint32s_to_int(data)
+        value: int = struct.unpack(reg.data_format, data)[0]
+        return value
+
+    def transfer_time(self, size: int) -> float:
+        if not self.baud_rate:
+            return 0.0
+        return size * BITS_PER_BYTE / self.baud_rate
+
+    def process(self, data: bytes) -> List[Tuple[float, bytes]]:
+        self._parser.feed(data)
+
+        responses = []
+        while True:
+            frame = self._parser.next_frame()
+            if frame is None:
+                break
+
+            header, payload = frame
+            response = self.handle_request(header, bytes(payload))
+            if response is None:
+                continue
+
+            request_size = len(payload) + 7
+            delay = self.transfer_time(request_size) + self.latency + self.transfer_time(len(response))
+            responses.append((delay, self._inject_drops(response)))
+        return responses
+
+    def handle_request(self, header: ResponseHeader, payload: bytes) -> Optional[bytes]:
+        if header.device_addr not in self.memory:
+            return None
+
+        self.requests += 1
+        addr = header.device_addr
+
+        if self._random.random() < self.nack_rate:
+            self.nacks += 1
+            return build_request(addr, CMD_NACK, header.data_item, b"")
+        if self._random.random() < self.err_rate:
+            self.errors += 1
+            return build_request(addr, CMD_ERR, header.data_item, b"")
+
+        item = self._data_item(addr, header.data_item)
+        if header.cmd == CMD_GET and len(payload) >= 3:
+            offset, _, length = payload[:3]
+            if self.dynamic and header.data_item == 0:
+                self._update_dynamic(addr)
+            return build_request(addr, CMD_ACK, header.data_item, bytes([offset, 0]) + bytes(item[offset * 2:offset * 2 + length]))
+
+        if header.cmd == CMD_SET and len(payload) >= 2:
+            offset = payload[0]
+            values = payload[2:]
+            item[offset * 2:offset * 2 + len(values)] = values
+            return build_request(addr, CMD_ACK, header.data_item, bytes([offset, 0]))
+
+        self.errors += 1
+        return build_request(addr, CMD_ERR, header.data_item, b"")
+
+    def _update_dynamic(self, device_addr: int) -> None:
+        for reg in esmart_registers:
+            if reg.name.strip() in dynamic_registers:
+                value = self.get_register(device_addr, reg) + self._random.choice((-1, 0, 1))
+                self.set_register(device_addr, reg, max(0, value))
+
+    def _inject_drops(self, response: bytes) -> bytes:
+        if self.drop_rate <= 0 or self._random.random() >= self.drop_rate:
+            return response
+        self.dropped_bytes += 1
+        position = self._random.randrange(len(response))
+        return response[:position] + response[position + 1:]
@@ -0,0 +1,90 @@
+import threading
+import time
+from typing import Dict, List, Tuple, Optional
+from urllib.parse import urlparse
+
+import serial
+
+from esmart_simulator.controller import SimulatedController
+
+URL_SCHEME = "esmartsim"
+
+controllers: Dict[str, SimulatedController] = {}
+
+
+def register_controller(name: str, controller: SimulatedController) -> str:
+    if "esmart_simulator" not in serial.protocol_handler_packages:
+        serial.protocol_handler_packages.append("esmart_simulator")
+    controllers[name] = controller
+    return f"{URL_SCHEME}://{name}"
+
+
+class Serial(serial.SerialBase):
+    def open(self) -> None:
+        if self.port is None:
+            raise serial.SerialException("Port must be configured before it can be used.")
+        url = urlparse(self.port)
+        if url.scheme != URL_SCHEME or url.netloc not in controllers:
+            raise serial.SerialException(f"{self.port}: no simulated controller registered")
+
+        self.controller = controllers[url.netloc]
+        self._cond = threading.Condition()
+        self._rx = bytearray()
+        self._scheduled: List[Tuple[float, bytes]] = []
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def _reconfigure_port(self) -> None:
+        pass
+
+    def _deliver(self, now: float) -> Optional[float]:
+        while len(self._scheduled) > 0 and self._scheduled[0][0] <= now:
+            self._rx += self._scheduled.pop(0)[1]
+        return self._scheduled[0][0] if len(self._scheduled) > 0 else None
+
+    @property
+    def in_waiting(self) -> int:
+        with self._cond:
+            self._deliver(time.monotonic())
+            return len(self._rx)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise serial.SerialException("port not open")
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                next_due = self._deliver(now)
+                if len(self._rx) > 0 or (deadline is not None and now >= deadline):
+                    break
+                waits = [x - now for x in (next_due, deadline) if x is not None]
+                self._cond.wait(min(waits) if len(waits) > 0 else None)
+
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise serial.SerialException("port not open")
+
+        now = time.monotonic()
+        with self._cond:
+            start = self._scheduled[-1][0] if len(self._scheduled) > 0 else now
+            for delay, response in self.controller.process(bytes(data)):
+                start = max(start, now + delay)
+                self._scheduled.append((start, response))
+            self._cond.notify_all()
+        return len(data)
+
+    def reset_input_buffer(self) -> None:
+        with self._cond:
+            self._rx.clear()
+            self._scheduled.clear()
+
+    def reset_output_buffer(self) -> None:
+        pass
@@ -0,0 +1,43 @@
+import logging
+import os
+import pty
+import threading
+import time
+import tty
+
+from esmart_simulator.controller import SimulatedController
+
+
+class PtySimulator:
+    def __init__(self, controller: SimulatedController) -> None:
+        self.controller = controller
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._run, name="esmart-simulator")
+        self._thread.daemon = True
+
+    def start(self) -> 'PtySimulator':
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while True:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+
+            now = time.monotonic()
+            for delay, response in self.controller.process(data):
+                time.sleep(max(0.0, now + delay - time.monotonic()))
+                try:
+                    os.write(self._master, response)
+                except OSError as e:
+                    logging.info(f"Simulator write failed: {e}")
+                    return
+
+    def close(self) -> None:
+        os.close(self._master)
+        os.close(self._slave)
@@ -1,9 +1,17 @@
+from typing import Union, Dict
+
 from pymodbus.datastore.store import BaseModbusDataBlock
 
 
 class ModbusSlaveContext:
+    store: Dict[str, BaseModbusDataBlock]
+
     def __init__(self, di: BaseModbusDataBlock, co: BaseModbusDataBlock, hr: BaseModbusDataBlock, ir: BaseModbusDataBlock, zero_mode: bool): ...
 
+    def decode(self, fx: int) -> str: ...
+
 
 class ModbusServerContext:
-    def __init__(self, slaves: ModbusSlaveContext, single: bool): ...
+    def __init__(self, slaves: Union[ModbusSlaveContext, Dict[int, ModbusSlaveContext]], single: bool): ...
+
+    def __getitem__(self, slave: int) -> ModbusSlaveContext: ...
@@ -0,0 +1,4 @@
+class ModbusException(Exception): ...
+
+
+class NoSuchSlaveException(ModbusException): ...
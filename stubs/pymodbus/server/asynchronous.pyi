@@ -0,0 +1,22 @@
+from typing import Any
+
+from pymodbus.datastore import ModbusServerContext
+from twisted.internet.protocol import Protocol, ServerFactory
+
+
+def StartTcpServer(context: ModbusServerContext, address: Any = None, **kwargs: Any) -> None: ...
+
+
+class ModbusTcpProtocol(Protocol):
+    def connectionMade(self) -> None: ...
+
+    def _execute(self, request: Any) -> None: ...
+
+    def _send(self, message: Any) -> Any: ...
+
+
+class ModbusServerFactory(ServerFactory):
+    protocol: Any
+    store: ModbusServerContext
+
+    def __init__(self, store: ModbusServerContext, framer: Any = None, identity: Any = None, **kwargs: Any) -> None: ...
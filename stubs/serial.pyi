@@ -1,8 +1,38 @@
-class Serial:
-    def __init__(self, path: str, baudrate: int, *, timeout: float) -> None: ...
+from typing import Optional, List, Any
+
+protocol_handler_packages: List[str]
+
+
+class SerialException(IOError): ...
+
+
+class SerialBase:
+    def __init__(self, port: Optional[str] = None, baudrate: int = 9600, *, timeout: Optional[float] = None, **kwargs: Any) -> None: ...
+
+    port: Optional[str]
+    is_open: bool
+    timeout: Optional[float]
+
+    @property
+    def in_waiting(self) -> int: ...
+
+    def read(self, size: int = 1) -> bytes: ...
 
-    def read(self, count: int) -> bytes: ...
+    def readinto(self, buffer: memoryview) -> int: ...
 
-    def write(self, data: bytes) -> None: ...
+    def write(self, data: bytes) -> Optional[int]: ...
+
+    def fileno(self) -> int: ...
+
+    def reset_input_buffer(self) -> None: ...
+
+    def reset_output_buffer(self) -> None: ...
 
     def close(self) -> None: ...
+
+
+class Serial(SerialBase):
+    def __init__(self, path: str, baudrate: int, *, timeout: float) -> None: ...
+
+
+def serial_for_url(url: str, baudrate: int, *, timeout: float) -> SerialBase: ...
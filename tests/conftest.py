@@ -0,0 +1,14 @@
+import pytest
+
+from esmart_simulator.controller import SimulatedController
+from tests.simulation import attach, unused_port
+
+
+@pytest.fixture
+def controller() -> SimulatedController:
+    return SimulatedController([1], latency=0.002, baud_rate=0, dynamic=False, seed=0)
+
+
+@pytest.fixture
+def port(controller: SimulatedController) -> str:
+    return attach(controller, unused_port())
@@ -0,0 +1,42 @@
+import asyncio
+import contextlib
+import itertools
+import time
+from typing import Callable, AsyncIterator, Dict, Any
+
+from esmart_device.registers import ESmartRegister, esmart_registers
+from esmart_monitor.async_monitor import AsyncESmartMonitor
+from esmart_simulator.controller import SimulatedController
+from esmart_simulator.protocol_esmartsim import register_controller, URL_SCHEME
+
+registers: Dict[str, ESmartRegister] = {x.name.strip(): x for x in esmart_registers}
+
+fast_monitor_kwargs: Dict[str, Any] = dict(min_frame_gap=0.001, fast_poll_interval=0.05, slow_poll_interval=0.5)
+
+_port_names = itertools.count()
+
+
+def unused_port() -> str:
+    return f"{URL_SCHEME}://test-{next(_port_names)}"
+
+
+def attach(controller: SimulatedController, port: str) -> str:
+    return register_controller(port[len(URL_SCHEME) + 3:], controller)
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+@contextlib.asynccontextmanager
+async def running(monitor: AsyncESmartMonitor) -> AsyncIterator[AsyncESmartMonitor]:
+    task = asyncio.ensure_future(monitor.run_async())
+    try:
+        yield monitor
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
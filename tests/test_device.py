@@ -0,0 +1,69 @@
+import asyncio
+import time
+from typing import List, Tuple
+
+import pytest
+
+from esmart_device.async_device import AsyncESmartDevice
+from esmart_device.device import ESmartSerialDevice
+from esmart_device.exceptions import ReadTimeoutException
+from esmart_device.protocol import PROTOCOL_STARTING_MARK
+from esmart_simulator.controller import SimulatedController
+from tests.simulation import attach, unused_port
+
+# a start mark whose header claims a 255 byte payload that never arrives
+stray_frame_start = bytes((PROTOCOL_STARTING_MARK, 1, 1, 0, 0, 0xff))
+
+
+class StrayMarkController(SimulatedController):
+    def process(self, data: bytes) -> List[Tuple[float, bytes]]:
+        return [(delay, stray_frame_start + response) for delay, response in super().process(data)]
+
+
+class NoisyController(SimulatedController):
+    def process(self, data: bytes) -> List[Tuple[float, bytes]]:
+        return [(i * 0.02, b"\x00") for i in range(1, 150)]
+
+
+def test_read_resyncs_past_stray_start_mark() -> None:
+    controller = StrayMarkController([1], latency=0.002, baud_rate=0, dynamic=False)
+    dev = ESmartSerialDevice(attach(controller, unused_port()), device_addr=1)
+
+    assert bytes(dev.get(data_item=0, data_offset=1, data_length=4)) == bytes((109, 1, 132, 0))
+    assert dev.parser.discarded_bytes >= len(stray_frame_start)
+    assert bytes(dev.get(data_item=0, data_offset=2, data_length=2)) == bytes((132, 0))
+    dev.close()
+
+
+def test_read_times_out_on_constant_noise(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ESmartSerialDevice, "RESPONSE_TIMEOUT", 0.3)
+    controller = NoisyController([1], latency=0.002, baud_rate=0, dynamic=False)
+    port = attach(controller, unused_port())
+
+    dev = ESmartSerialDevice(port, device_addr=1)
+    start = time.monotonic()
+    with pytest.raises(ReadTimeoutException):
+        dev.get(data_item=0, data_offset=1, data_length=4)
+    assert time.monotonic() - start < 1.0
+    dev.close()
+
+    async def run() -> None:
+        async_dev = AsyncESmartDevice(port, device_addr=1)
+        start = time.monotonic()
+        with pytest.raises(ReadTimeoutException):
+            await async_dev.get(data_item=0, data_offset=1, data_length=4)
+        assert time.monotonic() - start < 1.0
+        async_dev.close()
+
+    asyncio.run(run())
+
+
+def test_async_device_reads_url_port(controller: SimulatedController, port: str) -> None:
+    async def run() -> bytes:
+        dev = AsyncESmartDevice(port, device_addr=1)
+        try:
+            return bytes(await dev.get(data_item=0, data_offset=1, data_length=4))
+        finally:
+            dev.close()
+
+    assert asyncio.run(run()) == bytes((109, 1, 132, 0))
@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+import pathlib
+import struct
+import time
+
+import pytest
+
+from esmart_modbus import fast_server
+from esmart_modbus.fast_server import FastModbusServer, mbap_struct, SlaveBusy, IllegalAddress
+from esmart_monitor.async_monitor import AsyncESmartMonitor
+from esmart_monitor.state_file import save_state
+from esmart_simulator.controller import SimulatedController
+from tests.simulation import registers, fast_monitor_kwargs, unused_port, wait_until, running
+
+
+class ModbusConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.transaction_id = 0
+
+    @classmethod
+    async def open(cls, server: asyncio.AbstractServer) -> 'ModbusConnection':
+        assert isinstance(server, asyncio.Server)
+        host, port = server.sockets[0].getsockname()[:2]
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, pdu: bytes, unit_id: int = 1) -> bytes:
+        self.transaction_id += 1
+        self.writer.write(mbap_struct.pack(self.transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+        transaction_id, _, length, _ = mbap_struct.unpack(await self.reader.readexactly(mbap_struct.size))
+        assert transaction_id == self.transaction_id
+        return await self.reader.readexactly(length - 1)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def test_reads_and_writes_through_the_simulator(controller: SimulatedController, port: str) -> None:
+    mon = AsyncESmartMonitor(port, 1, **fast_monitor_kwargs)
+    bulk_volt = registers["wBulkVolt"]
+
+    async def run() -> None:
+        async with running(mon):
+            server = await FastModbusServer({1: mon}, single=True).start("127.0.0.1", 0)
+            client = await ModbusConnection.open(server)
+
+            await wait_until(lambda: bulk_volt in mon.snapshot.values and registers["wPvVolt"] in mon.snapshot.values)
+            assert await client.request(struct.pack(">BHH", 4, 2, 2)) == struct.pack(">BBHH", 4, 4, 365, 132)
+            assert await client.request(struct.pack(">BHH", 4, 500, 1)) == bytes((0x84, IllegalAddress))
+
+            write = struct.pack(">BHH", 6, bulk_volt.modbus_address, 150)
+            assert await client.request(write) == write
+            assert await client.request(struct.pack(">BHH", 3, bulk_volt.modbus_address, 1)) == struct.pack(">BBH", 3, 2, 150)
+
+            client.close()
+            server.close()
+
+    asyncio.run(run())
+    assert controller.get_register(1, bulk_volt) == 150
+
+
+def test_write_with_bus_down_answers_busy(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    monkeypatch.setattr(fast_server, "WriteTimeout", datetime.timedelta(seconds=0.2))
+    bulk_volt = registers["wBulkVolt"]
+    state_path = str(tmp_path / "state.json")
+    save_state(state_path, [(bulk_volt, 144, time.time())])
+    mon = AsyncESmartMonitor(unused_port(), 1, state_path=state_path, **fast_monitor_kwargs)
+
+    async def run() -> None:
+        server = await FastModbusServer({1: mon}, single=True).start("127.0.0.1", 0)
+        client = await ModbusConnection.open(server)
+
+        assert await client.request(struct.pack(">BHH", 3, bulk_volt.modbus_address, 1)) == struct.pack(">BBH", 3, 2, 144)
+        assert await client.request(struct.pack(">BHH", 6, bulk_volt.modbus_address, 150)) == bytes((0x86, SlaveBusy))
+
+        client.close()
+        server.close()
+
+    asyncio.run(run())
+    assert mon.snapshot.value(bulk_volt) == 144
@@ -0,0 +1,42 @@
+from typing import Any, Dict
+
+import pytest
+
+from esmart_modbus.gateway_config import parse_gateway_config, GatewayConfigException
+
+
+def config(**bus: Any) -> Dict[str, Any]:
+    return {"modbus_host": "localhost", "modbus_port": 5000, "buses": [{"esmart_port": "/dev/ttyUSB0", "devices": [1], **bus}]}
+
+
+def test_parses_defaults_and_devices() -> None:
+    gateway = parse_gateway_config({**config(devices=[1, {"device_addr": 2, "unit_id": "12", "max_age": 5}]), "slow_poll_interval": 60})
+
+    bus = gateway.buses[0]
+    assert [(x.device_addr, x.unit_id, x.max_age) for x in bus.devices] == [(1, 1, None), (2, 12, 5.0)]
+    assert bus.listener == ("localhost", 5000)
+    assert bus.slow_poll_interval == 60.0
+
+
+@pytest.mark.parametrize("data, message", [
+    ({**config(), "modbus_port": "http"}, "buses[0].modbus_port: invalid value 'http'"),
+    (config(devices=[{"device_addr": 1, "unit_id": None}]), "buses[0].devices[0].unit_id: invalid value None"),
+    (config(devices=[{"unit_id": 3}]), "buses[0].devices[0]: missing option device_addr"),
+    (config(devices=[{"device_addr": 1, "unitid": 3}]), "buses[0].devices[0]: unknown option unitid"),
+    (config(min_frame_gap=[0.1]), "buses[0].min_frame_gap: invalid value [0.1]"),
+    (config(slow_pol_interval=60), "buses[0]: unknown option slow_pol_interval"),
+    (config(devices=1), "buses[0].devices: expected a list, got 1"),
+    ({**config(), "snapshot": "/tmp/x"}, "config: unknown option snapshot"),
+    ({"modbus_host": "localhost", "buses": [{"esmart_port": "/dev/ttyUSB0", "devices": [1]}]}, "buses[0]: missing option modbus_port"),
+    ({**config(), "buses": []}, "no buses configured"),
+])
+def test_rejects_invalid_config(data: Dict[str, Any], message: str) -> None:
+    with pytest.raises(GatewayConfigException) as e:
+        parse_gateway_config(data)
+    assert str(e.value) == message
+
+
+def test_rejects_shared_per_device_paths() -> None:
+    data = config(devices=[1, 2], state_path="/tmp/state.json")
+    with pytest.raises(GatewayConfigException, match="state_path /tmp/state.json used by both"):
+        parse_gateway_config(data)
@@ -0,0 +1,54 @@
+from esmart_device.metrics import MetricsRegistry
+from esmart_modbus.diagnostics import ModbusMetrics, diagnostic_words, DiagnosticRegistersCount
+from esmart_monitor.monitor import ESmartMonitor
+from tests.simulation import registers, fast_monitor_kwargs, unused_port
+
+
+def test_render_exposition_format() -> None:
+    metrics = MetricsRegistry()
+    metrics.counter("requests_total", "Requests", dict(port='a"b\\c\nd')).inc(3)
+    metrics.gauge("depth", "Queue depth", dict(port="x"), lambda: 1.5)
+    metrics.gauge("age", "Snapshot age", dict(port="x"), lambda: None)
+    latency = metrics.histogram("latency_seconds", "Latency", {}, buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    assert metrics.render() == "\n".join([
+        "# HELP age Snapshot age",
+        "# TYPE age gauge",
+        "# HELP depth Queue depth",
+        "# TYPE depth gauge",
+        'depth{port="x"} 1.5',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{port="a\\"b\\\\c\\nd"} 3',
+    ]) + "\n"
+
+
+def test_diagnostic_words_layout() -> None:
+    mon = ESmartMonitor(unused_port(), 1, **fast_monitor_kwargs)
+    metrics = ModbusMetrics(mon)
+    mon.device_metrics.round_trip.observe(0.0125)
+    mon.device_metrics.read_timeouts.inc(0x12345)
+    mon.device_metrics.checksum_errors.inc(2)
+    mon.device_metrics.protocol_errors.inc(1)
+    mon.cycle_time.observe(70.0)
+    mon.submit_write([(registers["wBulkVolt"], 150)])
+    metrics.reads.inc(3)
+    metrics.writes.inc(0x10000)
+
+    words = diagnostic_words(mon, metrics)
+
+    assert len(words) == DiagnosticRegistersCount
+    assert words[:8] == [1, 0, 0x2345, 0x1, 2, 0, 1, 0]
+    # last round trip in milliseconds, the cycle time saturates at the word limit and no snapshot yet reads as 0xffff
+    assert words[8:11] == [12, 0xffff, 0xffff]
+    assert 0 < words[11] <= len(mon.plan)
+    assert words[12:] == [1, 3, 1, 0]
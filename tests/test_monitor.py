@@ -0,0 +1,229 @@
+import asyncio
+import datetime
+import pathlib
+import struct
+import time
+from concurrent.futures import Future
+from typing import Optional, Tuple
+
+import pytest
+
+from esmart_device.protocol import CMD_SET, CMD_GET, CMD_NACK, build_request
+from esmart_device.registers import ModbusRegisterType
+from esmart_device.response_header import ResponseHeader
+from esmart_monitor.async_monitor import AsyncESmartMonitor
+from esmart_monitor import monitor as monitor_module
+from esmart_monitor.monitor import ESmartMonitor, JobPriority, RequestFuture, RequestFailedException, WriteTimeoutException, RefreshTimeoutException, \
+    VerifyMismatchException
+from esmart_monitor.state_file import save_state
+from esmart_simulator.controller import SimulatedController
+from tests.simulation import registers, fast_monitor_kwargs, attach, unused_port, wait_until, running
+
+
+class NackingController(SimulatedController):
+    def __init__(self, nack_data_item: int) -> None:
+        super().__init__([1], latency=0.002, baud_rate=0, dynamic=False)
+        self.nack_data_item = nack_data_item
+
+    def handle_request(self, header: ResponseHeader, payload: bytes) -> Optional[bytes]:
+        if header.cmd == CMD_SET and header.data_item == self.nack_data_item:
+            return build_request(header.device_addr, CMD_NACK, header.data_item, b"")
+        return super().handle_request(header, payload)
+
+
+class ClampingController(SimulatedController):
+    # acknowledges every write but stores at most the given value, like a controller enforcing its limits
+    def __init__(self, limit: int) -> None:
+        super().__init__([1], latency=0.002, baud_rate=0, dynamic=False)
+        self.limit = limit
+
+    def handle_request(self, header: ResponseHeader, payload: bytes) -> Optional[bytes]:
+        if header.cmd == CMD_SET:
+            words = struct.unpack_from(f"<{(len(payload) - 2) // 2}H", payload, 2)
+            payload = payload[:2] + struct.pack(f"<{len(words)}H", *(min(x, self.limit) for x in words))
+        return super().handle_request(header, payload)
+
+
+class StallingController(SimulatedController):
+    def __init__(self) -> None:
+        super().__init__([1], latency=0.002, baud_rate=0, dynamic=False)
+        self.stalled = False
+
+    def handle_request(self, header: ResponseHeader, payload: bytes) -> Optional[bytes]:
+        if self.stalled and header.cmd == CMD_GET:
+            return None
+        if header.cmd == CMD_SET:
+            self.stalled = True
+        return super().handle_request(header, payload)
+
+
+def refresh_jobs(mon: ESmartMonitor) -> int:
+    # poll jobs fall due while the test runs, so only the queued refresh jobs are counted
+    return sum(1 for _, _, _, job in mon.bus.scheduler._jobs if job.priority == JobPriority.Refresh)
+
+
+def failure(future: RequestFuture) -> Optional[type]:
+    error = future.exception(5) if isinstance(future, Future) else future.exception()
+    return None if error is None else type(error)
+
+
+def test_write_with_bus_down_is_never_applied(controller: SimulatedController) -> None:
+    port = unused_port()
+    mon = AsyncESmartMonitor(port, 1, **fast_monitor_kwargs)
+
+    async def run() -> RequestFuture:
+        async with running(mon):
+            abandoned = mon.submit_write([(registers["wBulkVolt"], 150)])
+            done, _ = await asyncio.wait([asyncio.wrap_future(abandoned.future)], timeout=0.1)
+            assert len(done) == 0 and abandoned.cancel_or_expire()
+
+            expired = mon.set_words_async([(registers["wFloatVolt"], 139)], timeout=0.1)
+            await asyncio.sleep(0.2)
+            attach(controller, port)
+            await wait_until(lambda: registers["wBulkVolt"] in mon.snapshot.values)
+            await wait_until(expired.done)
+            return expired
+
+    expired = asyncio.run(run())
+    assert failure(expired) is WriteTimeoutException
+    assert mon.queued_commands == 0
+    assert controller.get_register(1, registers["wBulkVolt"]) == 144
+    assert controller.get_register(1, registers["wFloatVolt"]) == 138
+
+
+def test_full_write_queue_drops_expired_commands() -> None:
+    mon = ESmartMonitor(unused_port(), 1, **fast_monitor_kwargs)
+
+    with pytest.raises(WriteTimeoutException):
+        mon.set_word(data_item=1, data_offset=registers["wBulkVolt"].esmart_address, value=150, timeout=0.05)
+    expired = [mon.set_words_async([(registers["wBulkVolt"], 140 + i)], timeout=0.05) for i in range(monitor_module.MaxQueuedCommands)]
+    time.sleep(0.1)
+    queued = mon.set_words_async([(registers["wBulkVolt"], 150)])
+
+    assert not queued.done()
+    assert mon.queued_commands == 1
+    assert all(failure(x) is WriteTimeoutException for x in expired)
+
+
+def test_nack_fails_only_the_rejected_frame() -> None:
+    controller = NackingController(nack_data_item=7)
+    mon = AsyncESmartMonitor(attach(controller, unused_port()), 1, **fast_monitor_kwargs)
+
+    async def run() -> Tuple[RequestFuture, RequestFuture]:
+        applied = mon.set_words_async([(registers["wBulkVolt"], 150)])
+        rejected = mon.set_words_async([(registers["wLoadOvp"], 161)])
+        async with running(mon):
+            await wait_until(lambda: applied.done() and rejected.done())
+        return applied, rejected
+
+    applied, rejected = asyncio.run(run())
+    assert failure(applied) is None
+    assert failure(rejected) is RequestFailedException
+    assert controller.get_register(1, registers["wBulkVolt"]) == 150
+    assert controller.get_register(1, registers["wLoadOvp"]) == 160
+    assert mon.snapshot.value(registers["wBulkVolt"]) == 150
+
+
+def test_warm_start_serves_restored_values_until_confirmed(controller: SimulatedController, tmp_path: pathlib.Path) -> None:
+    state_path = f"{tmp_path}/state-{{device_addr}}.json"
+    now = time.time()
+    save_state(state_path.format(device_addr=1), [
+        (registers["wPvVolt"], 300, now - 5),
+        (registers["mBatVolt"], 120, now - 3600),
+        (registers["wBulkVolt"], 141, now - 2 * 86400),
+    ])
+
+    port = unused_port()
+    mon = AsyncESmartMonitor(port, 1, state_path=state_path, **fast_monitor_kwargs)
+    input_image = mon.get_register_image(ModbusRegisterType.InputRegister)
+    holding_image = mon.get_register_image(ModbusRegisterType.HoldingRegister)
+    assert input_image is not None and holding_image is not None
+
+    # stale fast telemetry is dropped, settings are restored whatever their age
+    assert set(mon.snapshot.unconfirmed) == {registers["wPvVolt"], registers["wBulkVolt"]}
+    assert input_image.is_valid(registers["wPvVolt"].modbus_address)
+    assert input_image.words[registers["wPvVolt"].modbus_address] == 300
+    assert not input_image.is_valid(registers["mBatVolt"].modbus_address)
+    assert holding_image.words[registers["wBulkVolt"].modbus_address] == 141
+
+    async def run() -> None:
+        attach(controller, port)
+        async with running(mon):
+            await wait_until(lambda: len(mon.snapshot.unconfirmed) == 0)
+
+    asyncio.run(run())
+    assert mon.snapshot.value(registers["wPvVolt"]) == 365
+    assert mon.snapshot.value(registers["wBulkVolt"]) == 144
+
+
+def test_write_overlay_expires_without_read_back(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(monitor_module, "ValueHoldTime", datetime.timedelta(seconds=0.3))
+    controller = StallingController()
+    mon = AsyncESmartMonitor(attach(controller, unused_port()), 1, **fast_monitor_kwargs)
+    reg = registers["wBulkVolt"]
+
+    def image_word() -> Optional[int]:
+        image = mon.get_register_image(ModbusRegisterType.HoldingRegister)
+        return image.words[reg.modbus_address] if image is not None and image.is_valid(reg.modbus_address) else None
+
+    async def run() -> None:
+        async with running(mon):
+            await wait_until(lambda: image_word() == 144)
+            mon.set_words_async([(reg, 150)])
+            await wait_until(lambda: image_word() == 150)
+            await asyncio.sleep(0.5)
+
+    asyncio.run(run())
+    assert controller.stalled
+    assert mon.snapshot.pending == {}
+    assert mon.snapshot.value(reg) == 144
+    assert image_word() == 144
+
+
+def test_concurrent_refreshes_share_one_read(controller: SimulatedController, port: str) -> None:
+    mon = AsyncESmartMonitor(port, 1, **fast_monitor_kwargs)
+    pv_volt = registers["wPvVolt"]
+
+    async def run() -> None:
+        first = mon.refresh_async([pv_volt], max_age=0)
+        second = mon.refresh_async([pv_volt, registers["mBatVolt"]], max_age=0)
+        assert second is first
+        assert refresh_jobs(mon) == 1
+
+        async with running(mon):
+            await asyncio.wait_for(asyncio.wrap_future(first), 5)
+            assert mon.refresh_async([pv_volt], max_age=60).done()
+
+    asyncio.run(run())
+    assert mon.snapshot.value(pv_volt) == 365
+
+
+def test_refreshes_with_bus_down_keep_one_job_per_read(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(monitor_module, "RefreshTimeout", datetime.timedelta(0))
+    mon = ESmartMonitor(unused_port(), 1, **fast_monitor_kwargs)
+    reads = {mon.plan[0], mon.plan[-1]}
+    refreshed = [reg for read in reads for reg, _ in read.registers]
+
+    futures = [mon.refresh_async(refreshed, max_age=0) for _ in range(200)]
+
+    assert refresh_jobs(mon) == len(reads)
+    assert all(failure(x) is RefreshTimeoutException for x in futures[:-1])
+
+
+def test_write_not_confirmed_by_read_back_fails() -> None:
+    controller = ClampingController(limit=148)
+    mon = AsyncESmartMonitor(attach(controller, unused_port()), 1, **fast_monitor_kwargs)
+    bulk_volt, float_volt = registers["wBulkVolt"], registers["wFloatVolt"]
+
+    async def run() -> Tuple[RequestFuture, RequestFuture]:
+        async with running(mon):
+            clamped = mon.set_words_async([(bulk_volt, 150)])
+            confirmed = mon.set_words_async([(float_volt, 139)])
+            await wait_until(lambda: clamped.done() and confirmed.done())
+        return clamped, confirmed
+
+    clamped, confirmed = asyncio.run(run())
+    assert failure(clamped) is VerifyMismatchException
+    assert failure(confirmed) is None
+    assert mon.snapshot.value(bulk_volt) == 148
+    assert mon.snapshot.pending == {}
@@ -0,0 +1,38 @@
+import pytest
+
+from esmart_device.pacing import PacingController
+
+
+def test_gap_follows_smoothed_turnaround_above_the_floor() -> None:
+    pacing = PacingController(min_gap=0.01, max_gap=1.0)
+    assert pacing.gap == 0.01
+
+    pacing.on_response(0.1)
+    assert pacing.gap == pytest.approx(0.05)
+    pacing.on_response(0.2)
+    assert pacing.turnaround == pytest.approx(0.12)
+    assert pacing.gap == pytest.approx(0.06)
+
+    for _ in range(50):
+        pacing.on_response(0.0)
+    assert pacing.gap == 0.01
+
+
+def test_errors_back_off_from_the_floor_and_recover() -> None:
+    pacing = PacingController(min_gap=0.01, max_gap=0.1)
+
+    pacing.on_error()
+    assert pacing.backoff == 0.01
+    pacing.on_error()
+    pacing.on_error()
+    assert pacing.backoff == pytest.approx(0.04)
+    for _ in range(5):
+        pacing.on_error()
+    assert pacing.gap == 0.1
+
+    pacing.on_response(0.0)
+    assert pacing.backoff == pytest.approx(0.08)
+    for _ in range(30):
+        pacing.on_response(0.0)
+    assert pacing.backoff == 0.0
+    assert pacing.gap == 0.01
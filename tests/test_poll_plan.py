@@ -0,0 +1,25 @@
+from esmart_device.registers import ESmartRegister, DataType, PollTier, ModbusRegisterType
+from esmart_device.poll_plan import plan_reads
+
+
+def register(data_item: int, esmart_address: int, data_type: DataType = DataType.UInt16, poll_tier: PollTier = PollTier.Fast) -> ESmartRegister:
+    return ESmartRegister(f"r{data_item}_{esmart_address}", esmart_data_item=data_item, esmart_address=esmart_address, data_type=data_type,
+                          modbus_address=esmart_address, modbus_type=ModbusRegisterType.InputRegister, poll_tier=poll_tier)
+
+
+def test_plan_reads_merges_within_gap_and_frame_limits() -> None:
+    near, far, wide = register(0, 0), register(0, 3), register(0, 20, DataType.UInt32s)
+    other_item, slow = register(1, 0), register(0, 4, poll_tier=PollTier.Slow)
+
+    plan = plan_reads([wide, far, near, other_item, slow], max_gap_words=2, max_frame_length=64)
+
+    assert [(x.data_item, x.data_offset, x.data_length, x.poll_tier) for x in plan] == [
+        (0, 0, 8, PollTier.Fast),
+        (0, 4, 2, PollTier.Slow),
+        (0, 20, 4, PollTier.Fast),
+        (1, 0, 2, PollTier.Fast),
+    ]
+    assert plan[0].registers == [(near, 0), (far, 6)]
+
+    split = plan_reads([near, far], max_gap_words=2, max_frame_length=6)
+    assert [(x.data_offset, x.data_length) for x in split] == [(0, 2), (3, 2)]
@@ -0,0 +1,35 @@
+import pathlib
+
+from esmart_monitor.recorder import TimeSeriesRecorder, TimeSeriesReader, list_segments
+from tests.simulation import registers
+
+pv_volt, bat_volt = registers["wPvVolt"], registers["mBatVolt"]
+
+
+def test_round_trip_across_segment_rotation(tmp_path: pathlib.Path) -> None:
+    directory = str(tmp_path)
+    recorder = TimeSeriesRecorder(directory, [pv_volt, bat_volt], max_segment_size=64)
+    # three rows fit in a segment, so every segment starts within the same second
+    timestamps = [100.0 + i / 10 for i in range(10)]
+    for i, timestamp in enumerate(timestamps):
+        recorder.append(timestamp, [(pv_volt, 300 + i)] if i % 3 == 2 else [(pv_volt, 300 + i), (bat_volt, 130 + i)])
+    recorder.close()
+
+    # a restart within the same microsecond opens a new segment instead of truncating the last one
+    restarted = TimeSeriesRecorder(directory, [pv_volt, bat_volt])
+    restarted.append(100.9, [(pv_volt, 399)])
+    restarted.close()
+
+    assert len(list_segments(directory)) == 5
+    reader = TimeSeriesReader(directory, [pv_volt, bat_volt])
+    all_timestamps, values = reader.column(pv_volt)
+    assert list(all_timestamps) == timestamps + [100.9]
+    assert list(values) == list(range(300, 310)) + [399]
+
+    # a range starting inside a segment keeps that segment's rows at or after the start
+    assert list(reader.column(pv_volt, start=100.4)[0]) == timestamps[4:] + [100.9]
+    assert list(reader.column(pv_volt, start=100.3, end=100.6)[1]) == [303, 304, 305, 306]
+    bat_timestamps, bat_values = reader.column(bat_volt, start=100.1, end=100.8)
+    assert list(bat_timestamps) == [100.1, 100.3, 100.4, 100.6, 100.7]
+    assert list(bat_values) == [131, 133, 134, 136, 137]
+    reader.close()
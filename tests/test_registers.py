@@ -0,0 +1,25 @@
+import struct
+
+import pytest
+
+from esmart_device.registers import CompiledFrameDecoder, DataType, uint32s_to_int
+from tests.simulation import registers
+
+
+def test_decoder_unpacks_signed_and_wide_registers() -> None:
+    signed = next(x for x in registers.values() if x.data_type == DataType.Int16)
+    wide = registers["dwTotalEng"]
+    narrow = registers["wPvVolt"]
+    decoder = CompiledFrameDecoder([(signed, 0), (wide, 4), (narrow, 8)])
+
+    data = struct.pack("<hH", -5, 0xffff) + struct.pack("<HH", 0x0001, 0x86a0) + struct.pack("<H", 365)
+    assert decoder.decode(data) == [-5, 100000, 365]
+    assert decoder.decode(memoryview(data)) == [-5, 100000, 365]
+    assert uint32s_to_int(data[4:8]) == 100000
+
+    assert CompiledFrameDecoder([(signed, 0), (narrow, 2)]).decode(struct.pack("<hH", -32768, 65535)) == [-32768, 65535]
+
+
+def test_decoder_rejects_overlapping_registers() -> None:
+    with pytest.raises(Exception, match="overlapping"):
+        CompiledFrameDecoder([(registers["dwTotalEng"], 0), (registers["wPvVolt"], 2)])
@@ -0,0 +1,100 @@
+import pathlib
+import struct
+import time
+from typing import Any, List, Tuple, Sequence
+
+import pytest
+from pymodbus.datastore import ModbusServerContext
+from twisted.internet.task import Clock
+
+from esmart_device.registers import ESmartRegister
+from esmart_modbus import server
+from esmart_modbus.server import ESmartServerFactory, ESmartTcpProtocol, PendingWrites, create_slave_context
+from esmart_monitor.monitor import ESmartMonitor, Command, RequestFuture, QueueFullException, WriteTimeout
+from esmart_monitor.state_file import save_state
+from tests.simulation import registers, fast_monitor_kwargs, unused_port
+
+SlaveBusy = 6
+
+
+class ImmediateReactor(Clock):
+    def callFromThread(self, f: Any, *args: Any) -> None:
+        f(*args)
+
+
+class RecordingTransport:
+    def __init__(self) -> None:
+        self.written = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.written += data
+
+    def getHost(self) -> str:
+        return "test"
+
+
+class TwistedConnection:
+    def __init__(self, factory: ESmartServerFactory) -> None:
+        self.transport = RecordingTransport()
+        self.protocol = ESmartTcpProtocol()
+        self.protocol.factory = factory
+        transport: Any = self.transport
+        self.protocol.transport = transport
+        self.protocol.connectionMade()
+        self.transaction_id = 0
+
+    def send(self, pdu: bytes, unit_id: int = 1) -> None:
+        self.transaction_id += 1
+        self.protocol.dataReceived(struct.pack(">HHHB", self.transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+
+    def response(self) -> bytes:
+        data = bytes(self.transport.written)
+        self.transport.written.clear()
+        if len(data) == 0:
+            return data
+        transaction_id, _, length, _ = struct.unpack(">HHHB", data[:7])
+        assert transaction_id == self.transaction_id and len(data) == length + 6
+        return data[7:]
+
+
+def test_writes_answer_once_the_monitor_completes_them(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    clock = ImmediateReactor()
+    monkeypatch.setattr(server, "reactor", clock)
+
+    bulk_volt, float_volt, load = registers["wBulkVolt"], registers["wFloatVolt"], registers["loadEnabled"]
+    state_path = str(tmp_path / "state.json")
+    save_state(state_path, [(bulk_volt, 144, time.time()), (float_volt, 138, time.time()), (load, 5118, time.time())])
+    mon = ESmartMonitor(unused_port(), 1, state_path=state_path, **fast_monitor_kwargs)
+
+    submitted: List[Tuple[List[Tuple[ESmartRegister, int]], RequestFuture]] = []
+
+    def submit_write(writes: Sequence[Tuple[ESmartRegister, int]]) -> Command:
+        cmd = Command(writes)
+        submitted.append((cmd.writes, cmd.future))
+        return cmd
+
+    monkeypatch.setattr(mon, "submit_write", submit_write)
+    pending_writes = PendingWrites()
+    connection = TwistedConnection(ESmartServerFactory(ModbusServerContext(slaves=create_slave_context(mon, pending_writes), single=True), pending_writes))
+
+    write_single = struct.pack(">BHH", 6, bulk_volt.modbus_address, 150)
+    connection.send(write_single)
+    assert connection.response() == b""
+    assert submitted[-1][0] == [(bulk_volt, 150)]
+    submitted[-1][1].set_result(None)
+    assert connection.response() == write_single
+
+    connection.send(struct.pack(">BHHBHH", 16, bulk_volt.modbus_address, 2, 4, 151, 139))
+    assert submitted[-1][0] == [(bulk_volt, 151), (float_volt, 139)]
+    submitted[-1][1].set_result(None)
+    assert connection.response() == struct.pack(">BHH", 16, bulk_volt.modbus_address, 2)
+
+    connection.send(struct.pack(">BHH", 5, load.modbus_address, 0xff00))
+    assert submitted[-1][0] == [(load, 5117)]
+    submitted[-1][1].set_exception(QueueFullException())
+    assert connection.response() == bytes((0x85, SlaveBusy))
+
+    connection.send(write_single)
+    clock.advance(WriteTimeout.total_seconds())
+    assert submitted[-1][1].cancelled()
+    assert connection.response() == bytes((0x86, SlaveBusy))
@@ -0,0 +1,79 @@
+import pathlib
+import struct
+from typing import Any, Callable, List, Tuple
+
+import pytest
+
+from esmart_monitor import shared_snapshot
+from esmart_monitor.shared_snapshot import SnapshotWriter, SnapshotReader, SnapshotException, seq_struct, seq_offset
+from tests.simulation import registers
+
+tracked = [registers["wPvVolt"], registers["mBatVolt"], registers["wBulkVolt"]]
+
+
+def test_reader_sees_published_values_across_writer_restart(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "snapshot")
+    writer = SnapshotWriter(path, tracked)
+    reader = SnapshotReader(path, tracked)
+    assert reader.get_values() is None
+
+    writer.publish([(registers["wPvVolt"], 365, 100.0), (registers["wBulkVolt"], 144, 200.0)])
+    seq, _, _ = reader.read()
+    assert seq == 2
+    assert reader.get_timestamped_values() == [(registers["wPvVolt"], 365, 100.0), (registers["wBulkVolt"], 144, 200.0)]
+    writer.close()
+
+    restarted = SnapshotWriter(path, tracked)
+    restarted.publish([(registers["mBatVolt"], 132, 300.0)])
+    assert reader.get_values() == [(registers["mBatVolt"], 132)]
+    restarted.close()
+    reader.close()
+
+
+class InterleavedSeq:
+    # runs a writer step right after each sequence read, between the reader's checks
+    def __init__(self, steps: List[Callable[[], None]]) -> None:
+        self.steps = steps
+
+    def unpack_from(self, buffer: Any, offset: int = 0) -> Tuple[Any, ...]:
+        value = seq_struct.unpack_from(buffer, offset)
+        if len(self.steps) > 0:
+            self.steps.pop(0)()
+        return value
+
+    def pack_into(self, buffer: Any, offset: int, *values: Any) -> None:
+        seq_struct.pack_into(buffer, offset, *values)
+
+
+def test_reader_retries_a_torn_read(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = str(tmp_path / "snapshot")
+    writer = SnapshotWriter(path, tracked)
+    writer.publish([(reg, 1, 1.0) for reg in tracked])
+    reader = SnapshotReader(path, tracked)
+
+    def start_write() -> None:
+        seq_struct.pack_into(writer._mm, seq_offset, 3)
+        writer._mm[writer.layout.body_offset:writer.layout.body_offset + 16] = struct.pack("<qd", 2, 2.0)
+
+    def finish_write() -> None:
+        writer.publish([(reg, 2, 2.0) for reg in tracked])
+
+    monkeypatch.setattr(shared_snapshot, "seq_struct", InterleavedSeq([start_write, finish_write]))
+    seq, _, slots = reader.read()
+    assert seq == 4
+    assert slots == (2, 2.0) * len(tracked)
+    writer.close()
+    reader.close()
+
+
+def test_reader_gives_up_while_a_write_never_finishes(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(shared_snapshot, "MaxReadRetries", 10)
+    path = str(tmp_path / "snapshot")
+    writer = SnapshotWriter(path, tracked)
+    reader = SnapshotReader(path, tracked)
+
+    seq_struct.pack_into(writer._mm, seq_offset, 1)
+    with pytest.raises(SnapshotException):
+        reader.read()
+    writer.close()
+    reader.close()
@@ -0,0 +1,37 @@
+import json
+import pathlib
+import time
+
+import pytest
+
+from esmart_monitor.state_file import save_state, load_state
+from tests.simulation import registers
+
+
+def test_load_state_skips_invalid_entries(tmp_path: pathlib.Path, caplog: pytest.LogCaptureFixture) -> None:
+    path = str(tmp_path / "state.json")
+    now = time.time()
+    save_state(path, [(registers["wPvVolt"], 300, now), (registers["wBulkVolt"], 144, now)])
+    with open(path) as f:
+        state = json.load(f)
+    state["values"].update({
+        "mBatVolt": "120",
+        "wFloatVolt": [138],
+        "wLoadOvp": [70000, now],
+        "wLoadUvp": [110, "yesterday"],
+        "wBatOvp": [True, now],
+    })
+    with open(path, "w") as f:
+        json.dump(state, f)
+
+    assert load_state(path, max_age=60) == [(registers["wPvVolt"], 300, now), (registers["wBulkVolt"], 144, now)]
+    assert sum("Ignoring invalid value" in x.message for x in caplog.records) == 5
+
+    state["values"] = [1, 2]
+    with open(path, "w") as f:
+        json.dump(state, f)
+    assert load_state(path, max_age=60) == []
+
+    with open(path, "w") as f:
+        f.write("{\"version\": ")
+    assert load_state(path, max_age=60) == []
@@ -0,0 +1,40 @@
+from typing import List
+
+from esmart_device.registers import PollTier
+from esmart_monitor.snapshot import MonitorSnapshot
+from esmart_monitor.subscription import Subscription
+from tests.simulation import registers
+
+pv_volt, bat_volt, chg_curr = registers["wPvVolt"], registers["mBatVolt"], registers["wChgCurr"]
+
+
+def test_changes_are_coalesced_and_filtered_by_deadband() -> None:
+    snapshots: List[MonitorSnapshot] = [MonitorSnapshot.empty({PollTier.Fast: 10.0, PollTier.Slow: 60.0})]
+
+    def read(*values: int) -> None:
+        snapshots.append(snapshots[-1].with_reads(list(zip((pv_volt, bat_volt, chg_curr), values)), 1000.0 + len(snapshots)))
+
+    sub = Subscription(lambda: snapshots[-1], registers=[pv_volt, bat_volt], deadbands={pv_volt: 5})
+    assert sub.take_changes() == []
+
+    read(365, 132, 10)
+    assert sub.take_changes() == [(pv_volt, 365), (bat_volt, 132)]
+
+    read(366, 133, 11)
+    read(368, 134, 12)
+    read(369, 135, 13)
+    assert sub.take_changes() == [(bat_volt, 135)]
+
+    read(369, 135, 14)
+    assert sub.take_changes() == []
+
+    read(371, 135, 14)
+    assert sub.take_changes() == [(pv_volt, 371)]
+
+    read(366, 135, 14)
+    sub.notify()
+    assert sub.get_changes(timeout=0) == []
+    assert sub.get_changes(timeout=0.01) == []
+    read(365, 130, 14)
+    sub.notify()
+    assert sub.get_changes(timeout=0) == [(pv_volt, 365), (bat_volt, 130)]